@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+
+import click
+import nfl_data_py as nfl
+import pandas as pd
+
+from src.data.make_dataset import (FIRST_NFLVERSE_SEASON, GAMES_TABLE_COLUMN_LIST, SCORE_COLUMN_LIST,
+                                   make_games_table_df)
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+GAMES_TABLE_FILEPATH = PROJECT_DIR / "data" / "processed" / "games_table.csv"
+# Kept apart from the backfill's data/raw/schedules_<season>.parquet cache, which only ever holds complete seasons
+RAW_SCHEDULE_DIR = PROJECT_DIR / "data" / "raw" / "games_table"
+WEEK_PARTITION_DIR = PROJECT_DIR / "data" / "interim" / "games_table"
+MANIFEST_FILEPATH = WEEK_PARTITION_DIR / "manifest.json"
+# Bump when make_week_partition_text changes, so every week is normalised again
+NORMALISE_VERSION = 1
+
+
+def make_content_hash(text):
+    """
+    Function returns the SHA-256 of a string
+    :param text: string
+    :return: Hex digest
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_schedule_hash(schedule_df):
+    """
+    Function hashes the games_table columns of a schedule in game_id order. Scores aren't part of games_table.csv, so
+    a game going final doesn't change the hash
+    :param schedule_df: Dataframe with an nflverse schedule
+    :return: Hex digest
+    """
+    return make_content_hash(schedule_df[GAMES_TABLE_COLUMN_LIST].sort_values("game_id").astype(str)
+                             .to_csv(index=False))
+
+
+def read_manifest(manifest_filepath):
+    """
+    Function reads the hashes recorded by the previous build
+    :param manifest_filepath: path of the manifest
+    :return: Dictionary holding a dictionary of hashes per stage
+    """
+    manifest = {"fetch": dict(), "normalise_seasons": dict(), "normalise_weeks": dict(), "write": None}
+    if Path(manifest_filepath).exists():
+        manifest.update(json.loads(Path(manifest_filepath).read_text()))
+    return manifest
+
+
+def fetch_season_schedule(season, raw_schedule_dir, manifest):
+    """
+    Function downloads a season's nflverse schedule and rewrites its raw copy only when the games_table columns changed
+    :param season: NFL season
+    :param raw_schedule_dir: directory holding schedule_<season>.parquet files
+    :param manifest: Dictionary returned by read_manifest, updated in place
+    :return: True if the raw copy was rewritten
+    """
+    schedule_df = nfl.import_schedules([season])
+    schedule_hash = make_schedule_hash(schedule_df)
+    raw_filepath = Path(raw_schedule_dir) / "schedule_{}.parquet".format(season)
+    if raw_filepath.exists() and manifest["fetch"].get(str(season)) == schedule_hash:
+        return False
+    raw_filepath.parent.mkdir(parents=True, exist_ok=True)
+    schedule_df.to_parquet(raw_filepath, index=False)
+    manifest["fetch"][str(season)] = schedule_hash
+    return True
+
+
+def make_week_partition_text(week_schedule_df):
+    """
+    Function normalises one week of an nflverse schedule to games_table.csv rows in kickoff order
+    :param week_schedule_df: Dataframe with one week of an nflverse schedule
+    :return: CSV text without a header
+    """
+    week_games_table_df = make_games_table_df(week_schedule_df)[GAMES_TABLE_COLUMN_LIST]
+    week_games_table_df = week_games_table_df.sort_values(["gameday", "gametime", "game_id"])
+    return week_games_table_df.to_csv(index=False, header=False)
+
+
+def normalise_season(season, raw_schedule_dir, week_partition_dir, manifest):
+    """
+    Function rewrites the week partitions of a season whose games_table columns changed since the previous build and
+    drops those of weeks no longer in the schedule. A season whose raw copy is unchanged is skipped without reading it
+    :param season: NFL season
+    :param raw_schedule_dir: directory holding schedule_<season>.parquet files
+    :param week_partition_dir: directory holding <season>_<week>.csv partitions
+    :param manifest: Dictionary returned by read_manifest, updated in place
+    :return: Number of week partitions rewritten
+    """
+    season_key = str(season)
+    season_hash = manifest["fetch"][season_key]
+    partition_key_list = [key for key in manifest["normalise_weeks"] if key.startswith(season_key + "_")]
+    if manifest["normalise_seasons"].get(season_key) == season_hash and \
+            all((Path(week_partition_dir) / "{}.csv".format(key)).exists() for key in partition_key_list):
+        return 0
+    schedule_df = pd.read_parquet(Path(raw_schedule_dir) / "schedule_{}.parquet".format(season))
+    week_partition_dir = Path(week_partition_dir)
+    week_partition_dir.mkdir(parents=True, exist_ok=True)
+    rewritten_count = 0
+    week_key_set = set()
+    for week, week_schedule_df in schedule_df[GAMES_TABLE_COLUMN_LIST + SCORE_COLUMN_LIST].groupby("week"):
+        week_key = "{}_{:02d}".format(season, int(week))
+        week_key_set.add(week_key)
+        week_hash = make_content_hash("{}\n{}".format(NORMALISE_VERSION, make_schedule_hash(week_schedule_df)))
+        partition_filepath = week_partition_dir / "{}.csv".format(week_key)
+        if manifest["normalise_weeks"].get(week_key) == week_hash and partition_filepath.exists():
+            continue
+        partition_filepath.write_text(make_week_partition_text(week_schedule_df), encoding="utf-8")
+        manifest["normalise_weeks"][week_key] = week_hash
+        rewritten_count += 1
+    for week_key in set(partition_key_list) - week_key_set:
+        (week_partition_dir / "{}.csv".format(week_key)).unlink(missing_ok=True)
+        del manifest["normalise_weeks"][week_key]
+        rewritten_count += 1
+    manifest["normalise_seasons"][season_key] = season_hash
+    return rewritten_count
+
+
+def write_games_table(season_list, week_partition_dir, output_filepath, manifest):
+    """
+    Function concatenates the seasons' week partitions, in season and week order, under the games_table.csv header.
+    Skipped when neither the partitions nor the output file changed since the previous build
+    :param season_list: seasons written
+    :param week_partition_dir: directory holding <season>_<week>.csv partitions
+    :param output_filepath: path of games_table.csv
+    :param manifest: Dictionary returned by read_manifest, updated in place
+    :return: True if the output file was rewritten
+    """
+    season_key_set = {str(season) for season in season_list}
+    partition_key_list = sorted(key for key in manifest["normalise_weeks"] if key.split("_")[0] in season_key_set)
+    write_hash = make_content_hash("\n".join("{} {}".format(key, manifest["normalise_weeks"][key])
+                                             for key in partition_key_list))
+    output_filepath = Path(output_filepath)
+    previous_write = manifest["write"] or dict()
+    if previous_write.get("input") == write_hash and output_filepath.exists() and \
+            make_content_hash(output_filepath.read_text(encoding="utf-8")) == previous_write.get("output"):
+        return False
+    games_table_text = ",".join(GAMES_TABLE_COLUMN_LIST) + "\n" + "".join(
+        (Path(week_partition_dir) / "{}.csv".format(key)).read_text(encoding="utf-8") for key in partition_key_list)
+    output_filepath.parent.mkdir(parents=True, exist_ok=True)
+    output_filepath.write_text(games_table_text, encoding="utf-8")
+    manifest["write"] = {"input": write_hash, "output": make_content_hash(games_table_text)}
+    return True
+
+
+def pipeline_build_games_table(season_list, fetch=False, raw_schedule_dir=RAW_SCHEDULE_DIR,
+                               week_partition_dir=WEEK_PARTITION_DIR, output_filepath=GAMES_TABLE_FILEPATH,
+                               manifest_filepath=MANIFEST_FILEPATH):
+    """
+    Function pipelines the fetch -> normalise -> write stages of games_table.csv. Every stage compares the content
+    hash of its input with the one recorded in the manifest by the previous build and skips unchanged input, so only
+    the weeks a schedule change touched are normalised again. Seasons are only downloaded when fetch is set or they
+    have never been fetched
+    :param season_list: seasons in games_table.csv
+    :param fetch: download the schedule of every season again
+    :param raw_schedule_dir: directory holding the raw schedules
+    :param week_partition_dir: directory holding the normalised week partitions
+    :param output_filepath: path of games_table.csv
+    :param manifest_filepath: path of the manifest
+    :return: Seasons fetched, week partitions rewritten, whether the output file was rewritten
+    """
+    manifest = read_manifest(manifest_filepath)
+    fetched_count = 0
+    for season in season_list:
+        if fetch or str(season) not in manifest["fetch"] or \
+                not (Path(raw_schedule_dir) / "schedule_{}.parquet".format(season)).exists():
+            fetched_count += fetch_season_schedule(season, raw_schedule_dir, manifest)
+    rewritten_count = sum(normalise_season(season, raw_schedule_dir, week_partition_dir, manifest)
+                          for season in season_list)
+    written = write_games_table(season_list, week_partition_dir, output_filepath, manifest)
+    Path(manifest_filepath).parent.mkdir(parents=True, exist_ok=True)
+    Path(manifest_filepath).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return fetched_count, rewritten_count, written
+
+
+@click.command()
+@click.argument("first_season", type=int)
+@click.argument("last_season", type=int)
+@click.option("--fetch", is_flag=True, help="Download every season's schedule again to pick up schedule changes.")
+@click.option("--output-filepath", type=click.Path(dir_okay=False), default=str(GAMES_TABLE_FILEPATH),
+              help="Where games_table.csv is written.")
+def main(first_season, last_season, fetch, output_filepath):
+    """ Builds data/processed/games_table.csv from the nflverse schedules of FIRST_SEASON to LAST_SEASON (inclusive),
+        redoing only the weeks whose schedule changed since the previous build.
+    """
+    logger = logging.getLogger(__name__)
+    if first_season < FIRST_NFLVERSE_SEASON:
+        raise click.BadParameter("nflverse schedules start in {}".format(FIRST_NFLVERSE_SEASON),
+                                 param_hint="FIRST_SEASON")
+    if last_season < first_season:
+        raise click.BadParameter("must not be before FIRST_SEASON", param_hint="LAST_SEASON")
+    start = time.perf_counter()
+    fetched_count, rewritten_count, written = pipeline_build_games_table(
+        list(range(first_season, last_season + 1)), fetch, output_filepath=output_filepath)
+    logger.info("built %s in %.3fs: %s changed seasons fetched, %s week partitions rewritten, output %s",
+                output_filepath, time.perf_counter() - start, fetched_count, rewritten_count,
+                "rewritten" if written else "unchanged")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
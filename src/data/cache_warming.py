@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+import pandas as pd
+
+
+# How often the week is checked. Rollover happens once a week, so an hour late at worst is still before anyone looks
+WEEK_CHECK_INTERVAL_SECONDS = 3600
+
+
+def make_cache_warm_report_df(warm_step_list):
+    """
+    Function runs each warm-up step in turn and times it. A failing step is logged and reported instead of raised, so
+    one cache failing to warm never stops the others
+    :param warm_step_list: list of (cache name, callable) tuples
+    :return: Dataframe with cache, seconds and error columns
+    """
+    logger = logging.getLogger(__name__)
+    report_row_list = list()
+    for cache_name, warm in warm_step_list:
+        start = time.perf_counter()
+        error = None
+        try:
+            warm()
+        except Exception as exception:
+            error = repr(exception)
+        seconds = time.perf_counter() - start
+        if error is None:
+            logger.info("warmed the %s cache in %.2fs", cache_name, seconds)
+        else:
+            logger.warning("could not warm the %s cache after %.2fs: %s", cache_name, seconds, error)
+        report_row_list.append((cache_name, seconds, error))
+    return pd.DataFrame(report_row_list, columns=["cache", "seconds", "error"])
+
+
+class CacheWarmer:
+    """
+    Class warms a Streamlit process's caches in a background thread, once when it starts (i.e. on deploy) and again
+    whenever the NFL week rolls over, so the first visitor after either finds them already populated.
+    make_warm_step_list takes the week number and returns (cache name, callable) tuples
+    """
+
+    def __init__(self, make_week_number, make_warm_step_list, week_check_interval_seconds=WEEK_CHECK_INTERVAL_SECONDS):
+        self.make_week_number = make_week_number
+        self.make_warm_step_list = make_warm_step_list
+        self.week_check_interval_seconds = week_check_interval_seconds
+        self.week = None
+        self.report_df = None
+        self._thread = None
+
+    def warm(self, week):
+        """
+        Function warms every cache for a week and keeps the report
+        :param week: NFL week number
+        :return: Dataframe returned by make_cache_warm_report_df
+        """
+        logger = logging.getLogger(__name__)
+        logger.info("warming caches for week %s", week)
+        self.report_df = make_cache_warm_report_df(self.make_warm_step_list(week))
+        self.week = week
+        logger.info("warmed caches for week %s in %.2fs", week, self.report_df["seconds"].sum())
+        return self.report_df
+
+    def warm_if_week_changed(self):
+        """
+        Function warms the caches when the current week differs from the one last warmed
+        :return: True if the caches were warmed
+        """
+        week = self.make_week_number()
+        if week == self.week:
+            return False
+        self.warm(week)
+        return True
+
+    def _run(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            try:
+                self.warm_if_week_changed()
+            except Exception:
+                logger.exception("cache warming failed")
+            time.sleep(self.week_check_interval_seconds)
+
+    def start(self):
+        """
+        Function starts the background thread, once
+        :return: None
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+            self._thread.start()
+        return None
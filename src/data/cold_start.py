@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import ast
+import logging
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+import pandas as pd
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+PAGE_FILEPATH_LIST = [PROJECT_DIR / "streamlit_app" / "Weekly_Picks.py"] + \
+                     sorted((PROJECT_DIR / "streamlit_app" / "pages").glob("*.py"))
+# Imported by every page before its own imports run, so it is timed on its own and left out of each page's total
+STREAMLIT_RUNTIME_IMPORT = "import streamlit"
+
+
+def make_page_import_source(page_filepath):
+    """
+    Function returns the import statements a page runs at module load, i.e. every top level import
+    :param page_filepath: path of a Streamlit page
+    :return: Python source string
+    """
+    page_source = Path(page_filepath).read_text(encoding="utf-8")
+    import_node_list = [node for node in ast.parse(page_source).body if isinstance(node, (ast.Import,
+                                                                                          ast.ImportFrom))]
+    return "\n".join(ast.get_source_segment(page_source, node) for node in import_node_list)
+
+
+def make_import_time_df(import_source, preloaded_source=""):
+    """
+    Function runs import statements in a fresh interpreter under -X importtime, so nothing is already imported
+    :param import_source: import statements to time
+    :param preloaded_source: import statements run first and left out of the timings
+    :return: Dataframe with module, level and cumulative_ms columns for every module import_source loaded
+    """
+    # -X importtime only reports a module the first time it is imported, so the preload's modules never show up
+    # under import_source. The marker line separates the two
+    source = preloaded_source + "\nimport sys; sys.stderr.write('cold start marker\\n')\n" + import_source
+    completed_process = subprocess.run([sys.executable, "-X", "importtime", "-c", source], cwd=PROJECT_DIR,
+                                       env=dict(os.environ, PYTHONPATH=str(PROJECT_DIR)), capture_output=True,
+                                       text=True)
+    if completed_process.returncode != 0:
+        raise click.ClickException(completed_process.stderr.strip().splitlines()[-1])
+    import_row_list = list()
+    stderr_line_list = completed_process.stderr.splitlines()
+    for line in stderr_line_list[stderr_line_list.index("cold start marker") + 1:]:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        level = (len(module) - len(module.lstrip())) // 2
+        import_row_list.append((module.strip(), level, int(cumulative_us) / 1000))
+    return pd.DataFrame(import_row_list, columns=["module", "level", "cumulative_ms"])
+
+
+def make_cold_start_report_df(page_filepath_list, repeat, top):
+    """
+    Function times each page's module load imports in repeat fresh interpreters and keeps the median
+    :param page_filepath_list: paths of Streamlit pages
+    :param repeat: number of fresh interpreters per page
+    :param top: number of heaviest top level imports listed per page
+    :return: Dataframe with page, total_ms and heaviest_imports columns
+    """
+    report_row_list = list()
+    runtime_ms = pd.Series([make_import_time_df(STREAMLIT_RUNTIME_IMPORT).query("level == 0")["cumulative_ms"].sum()
+                            for _ in range(repeat)]).median()
+    report_row_list.append(("streamlit runtime", runtime_ms, ""))
+    for page_filepath in page_filepath_list:
+        import_source = make_page_import_source(page_filepath)
+        import_time_df_list = [make_import_time_df(import_source, STREAMLIT_RUNTIME_IMPORT).query("level == 0")
+                               for _ in range(repeat)]
+        total_ms = pd.Series([import_time_df["cumulative_ms"].sum() for import_time_df in import_time_df_list])
+        module_ms = pd.concat(import_time_df_list).groupby("module")["cumulative_ms"].median()
+        heaviest_imports = ", ".join("{} {:.0f}ms".format(module, cumulative_ms) for module, cumulative_ms in
+                                     module_ms.sort_values(ascending=False).head(top).items())
+        report_row_list.append((Path(page_filepath).name, total_ms.median(), heaviest_imports))
+    return pd.DataFrame(report_row_list, columns=["page", "total_ms", "heaviest_imports"])
+
+
+@click.command()
+@click.option("--repeat", type=int, default=5, help="Fresh interpreters per page, the median is reported.")
+@click.option("--top", type=int, default=5, help="Heaviest imports listed per page.")
+def main(repeat, top):
+    """ Reports how long each Streamlit page spends importing modules before its first line of UI runs, measured in
+        fresh interpreters as on a new container.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("timing %s pages, %s fresh interpreters each", len(PAGE_FILEPATH_LIST), repeat)
+    cold_start_report_df = make_cold_start_report_df(PAGE_FILEPATH_LIST, repeat, top)
+    click.echo("{:<22} {:>9}  {}".format("page", "import ms", "heaviest imports"))
+    for page, total_ms, heaviest_imports in cold_start_report_df.itertuples(index=False):
+        click.echo("{:<22} {:>9.0f}  {}".format(page, total_ms, heaviest_imports))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,625 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import psycopg2
+from psycopg2 import pool
+
+from src.data.slow_query_log import SLOW_QUERY_THRESHOLD_MS, SlowQueryLog, make_timed_cursor_factory
+
+
+# Connection errors worth retrying on a fresh connection. Anything else (bad SQL, constraint violations) means the
+# database answered and is raised straight to the caller
+RETRYABLE_ERROR_TUPLE = (psycopg2.OperationalError, psycopg2.InterfaceError)
+# Detect half-open TCP connections (server restarted, NAT dropped the flow) within ~1 minute instead of hanging
+KEEPALIVE_KWARGS = {"keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 3}
+# Seconds the replica is behind the primary; zero on a server which isn't a replica. A replica which isn't streaming
+# from the primary (disconnected, or replaying archived WAL) is infinitely behind, since it can't know what it is
+# missing. A streaming replica which has replayed everything it received is current, so an idle primary doesn't read
+# as lag. The wal receiver's status is hidden from unprivileged roles, who see a row per receiver process
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming' OR status IS NULL)
+            THEN 'Infinity'::float8
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity'::float8)
+    END
+    ;
+"""
+# psycopg2 placeholders, named or positional, and the %% escape
+PLACEHOLDER_PATTERN = re.compile(r"%\((\w+)\)s|%s|%%")
+# The connection manager every page and session of a Streamlit process shares, built by the first page to run
+_shared_connection_manager = None
+_shared_connection_manager_lock = threading.Lock()
+
+
+class DatabaseUnavailableError(Exception):
+    """
+    Raised when the database can't be reached and there is no cached result to fall back on
+    """
+
+
+def make_connection_kwargs_from_env():
+    """
+    Function builds the psycopg2 connection arguments from the standard libpq environment variables (PGUSER,
+    PGPASSWORD, PGDATABASE, PGHOST, PGPORT). Used by the command line tools, the Streamlit pages use st.secrets
+    :return: Dictionary of psycopg2 connection arguments
+    """
+    connection_kwargs = {"user": os.environ.get("PGUSER", "postgres"),
+                         "password": os.environ.get("PGPASSWORD", ""),
+                         "database": os.environ.get("PGDATABASE", "nfl_weekly_picks"),
+                         "host": os.environ.get("PGHOST", "127.0.0.1"),
+                         "port": os.environ.get("PGPORT", "5432")}
+    return connection_kwargs
+
+
+def connect_to_postgres_database_from_env():
+    """
+    Function connects to the database described by the libpq environment variables
+    :return: psycopg2 connection object
+    """
+    return psycopg2.connect(**make_connection_kwargs_from_env())
+
+
+def make_driver_error(error):
+    """
+    Function returns the psycopg2 error an exception was raised from, following its __cause__ chain
+    :param error: exception, such as the DatabaseError pandas raises from a failed query
+    :return: psycopg2.Error object - error itself when there is none
+    """
+    cause = error
+    while cause is not None and not isinstance(cause, psycopg2.Error):
+        cause = cause.__cause__
+    return error if cause is None else cause
+
+
+def make_read_sql_df_operation(query, params=None, dtype=None):
+    """
+    Function makes the operation reading a query into a Pandas DataFrame, for DatabaseConnectionManager.run
+    :param query: SQL query
+    :param params: query parameters
+    :param dtype: column dtypes passed to pandas
+    :return: callable taking a psycopg2 connection
+    """
+    def operation(con):
+        try:
+            return pd.read_sql_query(query, con=con, params=params, dtype=dtype)
+        except pd.errors.DatabaseError as error:
+            # pandas wraps driver errors, which would hide a dropped connection from the retries in run
+            raise make_driver_error(error)
+        finally:
+            con.rollback()
+    return operation
+
+
+class PreparedStatement:
+    """
+    Class turns a psycopg2 query into a server side prepared statement. Its %(name)s or %s placeholders become $n
+    parameters, the same name always taking the same one. The server name carries a hash of the query, so a changed
+    query is prepared again rather than running the old plan
+    """
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        self.server_name = "{}_{}".format(name, hashlib.md5(query.encode("utf-8")).hexdigest()[:8])
+        # dictionary keys for named placeholders, tuple positions for %s ones
+        self.param_key_list = list()
+        statement_query = PLACEHOLDER_PATTERN.sub(self._make_parameter, query.strip().rstrip(";").strip())
+        self.prepare_query = "PREPARE {} AS {}".format(self.server_name, statement_query)
+        self.execute_query = "EXECUTE {}".format(self.server_name)
+        if self.param_key_list:
+            self.execute_query += "({})".format(", ".join(["%s"] * len(self.param_key_list)))
+
+    def _make_parameter(self, match):
+        if match.group(0) == "%%":
+            return "%"
+        param_key = len(self.param_key_list) if match.group(1) is None else match.group(1)
+        if param_key not in self.param_key_list:
+            self.param_key_list.append(param_key)
+        return "${}".format(self.param_key_list.index(param_key) + 1)
+
+    def make_execute_params(self, params):
+        """
+        Function orders the query parameters as the statement's $n parameters
+        :param params: query parameters, a dictionary for named placeholders or a sequence for %s ones
+        :return: Tuple
+        """
+        return tuple(params[param_key] for param_key in self.param_key_list)
+
+
+class KeepIdleConnectionPool(pool.ThreadedConnectionPool):
+    """
+    Class is a ThreadedConnectionPool which keeps every connection put back, up to maxconn. The stock pool closes a
+    returned connection whenever it already holds minconn idle ones, so with minconn=0 (no connection opened up front)
+    it would reconnect on every call
+    """
+
+    def _putconn(self, conn, key=None, close=False):
+        # Called with the pool's lock held
+        minconn = self.minconn
+        self.minconn = self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+
+class DatabaseConnectionManager:
+    """
+    Class holds the pool of database connections shared by every Streamlit session.
+
+    Connections idle for longer than health_check_interval_seconds are pinged before use and reopened if the server
+    dropped them. Calls failing with a connection error are retried on a fresh connection with exponential backoff.
+    After failure_threshold calls in a row exhaust their retries the circuit opens: calls fail fast for
+    reset_timeout_seconds, then a single trial call decides whether it closes again. While the database can't be
+    reached, read_sql_df serves the last successful result of the same query.
+
+    Hot queries can be registered with prepare and run by name through the *_prepared methods. Each pooled connection
+    prepares a statement the first time it runs it and executes the stored plan from then on, so the server no longer
+    parses and plans them on every call. Prepared statements belong to the server session, so this needs direct
+    connections (or session pooling) rather than a transaction pooler.
+
+    Given a SlowQueryLog, every query run on the pool's connections is timed and the slow ones are logged with a plan
+    """
+
+    def __init__(self, connection_kwargs, max_connections=10, max_retries=2, backoff_seconds=0.1,
+                 max_backoff_seconds=1.0, failure_threshold=3, reset_timeout_seconds=30,
+                 health_check_interval_seconds=30, connect_timeout_seconds=2, checkout_timeout_seconds=5,
+                 read_cache_size=256, slow_query_log=None):
+        self.connection_kwargs = dict(KEEPALIVE_KWARGS, connect_timeout=connect_timeout_seconds,
+                                      **connection_kwargs)
+        if slow_query_log is not None:
+            self.connection_kwargs["cursor_factory"] = make_timed_cursor_factory(slow_query_log)
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.health_check_interval_seconds = health_check_interval_seconds
+        self.checkout_timeout_seconds = checkout_timeout_seconds
+        self.read_cache_size = read_cache_size
+        self._pool = None
+        self._lock = threading.Lock()
+        # ThreadedConnectionPool raises instead of waiting when exhausted, so sessions queue on the semaphore
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        self._last_used_dict = dict()
+        self._statement_dict = dict()
+        # server names of the statements each connection has prepared, by id(con) like _last_used_dict
+        self._prepared_name_dict = dict()
+        self._read_cache = OrderedDict()
+        self._failure_count = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # minconn=0 so building the manager never touches the network
+                self._pool = KeepIdleConnectionPool(0, self.max_connections, **self.connection_kwargs)
+            return self._pool
+
+    def _is_healthy(self, con):
+        try:
+            with con.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            con.rollback()
+            return True
+        except RETRYABLE_ERROR_TUPLE:
+            return False
+
+    def _checkout(self):
+        if not self._semaphore.acquire(timeout=self.checkout_timeout_seconds):
+            raise DatabaseUnavailableError("No database connection became free within {} seconds".format(
+                self.checkout_timeout_seconds))
+        try:
+            connection_pool = self._get_pool()
+            con = connection_pool.getconn()
+            idle_seconds = time.monotonic() - self._last_used_dict.get(id(con), time.monotonic())
+            if con.closed or (idle_seconds > self.health_check_interval_seconds and not self._is_healthy(con)):
+                self._last_used_dict.pop(id(con), None)
+                self._prepared_name_dict.pop(id(con), None)
+                connection_pool.putconn(con, close=True)
+                con = connection_pool.getconn()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return con
+
+    def _checkin(self, con, broken):
+        try:
+            if broken or con.closed:
+                self._last_used_dict.pop(id(con), None)
+                self._prepared_name_dict.pop(id(con), None)
+                self._get_pool().putconn(con, close=True)
+            else:
+                self._last_used_dict[id(con)] = time.monotonic()
+                self._get_pool().putconn(con)
+        finally:
+            self._semaphore.release()
+
+    def _check_circuit(self):
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            if time.monotonic() - self._opened_at < self.reset_timeout_seconds or self._trial_in_flight:
+                raise DatabaseUnavailableError("Database circuit breaker is open")
+            self._trial_in_flight = True
+        return None
+
+    def _record_success(self):
+        with self._lock:
+            self._failure_count = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def _record_failure(self):
+        with self._lock:
+            self._failure_count += 1
+            if self._trial_in_flight or self._failure_count >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def _run_once(self, operation):
+        con = self._checkout()
+        broken = False
+        try:
+            return operation(con)
+        except RETRYABLE_ERROR_TUPLE:
+            broken = True
+            raise
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            self._checkin(con, broken)
+
+    def run(self, operation):
+        """
+        Function runs operation(con) on a pooled connection, retrying connection errors with backoff behind the
+        circuit breaker. The operation must end its own transaction (commit or rollback)
+        :param operation: callable taking a psycopg2 connection
+        :return: The operation's return value
+        """
+        self._check_circuit()
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = self._run_once(operation)
+            except RETRYABLE_ERROR_TUPLE as error:
+                last_error = error
+                if attempt < self.max_retries:
+                    time.sleep(min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds))
+                continue
+            except psycopg2.Error:
+                # The server answered, so it is up even though the statement failed
+                self._record_success()
+                raise
+            self._record_success()
+            return result
+        self._record_failure()
+        raise DatabaseUnavailableError(str(last_error)) from last_error
+
+    def execute(self, command, data_tuple=None):
+        """
+        Function executes a write in its own transaction. Writes are retried after a dropped connection, so they
+        should be idempotent (upserts)
+        :param command: SQL query to be executed
+        :param data_tuple: data pairing for SQL query variables
+        :return: None
+        """
+        def operation(con):
+            with con.cursor() as cursor:
+                cursor.execute(command, data_tuple)
+            con.commit()
+        self.run(operation)
+        return None
+
+    def fetchall(self, query, params=None):
+        """
+        Function runs a read and returns every row. Results are never served from cache, use it for reads that must
+        be current such as credential checks
+        :param query: SQL query
+        :param params: query parameters
+        :return: List of row tuples
+        """
+        def operation(con):
+            with con.cursor() as cursor:
+                cursor.execute(query, params)
+                returned_value = cursor.fetchall()
+            con.rollback()
+            return returned_value
+        return self.run(operation)
+
+    def _read_or_cached(self, cache_key, operation):
+        try:
+            result_df = self.run(operation)
+        except DatabaseUnavailableError:
+            with self._lock:
+                cached_df = self._read_cache.get(cache_key)
+            if cached_df is None:
+                raise
+            logging.getLogger(__name__).warning("database unavailable, serving cached read")
+            return cached_df.copy()
+        with self._lock:
+            self._read_cache[cache_key] = result_df
+            self._read_cache.move_to_end(cache_key)
+            while len(self._read_cache) > self.read_cache_size:
+                self._read_cache.popitem(last=False)
+        return result_df
+
+    def read_sql_df(self, query, params=None, dtype=None):
+        """
+        Function runs a read into a Pandas DataFrame. When the database can't be reached the last successful result
+        of the same query and parameters is returned instead
+        :param query: SQL query
+        :param params: query parameters
+        :param dtype: column dtypes passed to pandas
+        :return: Dataframe
+        """
+        return self._read_or_cached((query, repr(params)), make_read_sql_df_operation(query, params, dtype))
+
+    def prepare(self, name, query):
+        """
+        Function registers a query to be run as a prepared statement by name. Registering a name again replaces its
+        query. Nothing is sent to the server until a connection first executes it
+        :param name: statement name, a SQL identifier
+        :param query: SQL query with %(name)s or %s placeholders
+        :return: None
+        """
+        with self._lock:
+            if name not in self._statement_dict or self._statement_dict[name].query != query:
+                self._statement_dict[name] = PreparedStatement(name, query)
+        return None
+
+    def _execute_prepared_statement(self, cursor, name, params):
+        statement = self._statement_dict[name]
+        prepared_name_set = self._prepared_name_dict.setdefault(id(cursor.connection), set())
+        if statement.server_name not in prepared_name_set:
+            # PREPARE isn't transactional, the statement outlives a rollback of the transaction preparing it
+            cursor.execute(statement.prepare_query)
+            prepared_name_set.add(statement.server_name)
+        cursor.execute(statement.execute_query, statement.make_execute_params(params or ()))
+
+    def make_read_prepared_sql_df_operation(self, name, params=None, dtype=None):
+        """
+        Function makes the operation reading a prepared statement into a Pandas DataFrame, for run. The operation
+        must run on this manager's connections
+        :param name: statement name registered with prepare
+        :param params: query parameters
+        :param dtype: column dtypes passed to pandas
+        :return: callable taking a psycopg2 connection
+        """
+        def operation(con):
+            try:
+                with con.cursor() as cursor:
+                    self._execute_prepared_statement(cursor, name, params)
+                    column_list = [column.name for column in cursor.description]
+                    row_list = cursor.fetchall()
+                result_df = pd.DataFrame.from_records(row_list, columns=column_list, coerce_float=True)
+                return result_df.astype(dtype) if dtype else result_df
+            finally:
+                con.rollback()
+        return operation
+
+    def execute_prepared(self, name, params=None):
+        """
+        Function executes a prepared write in its own transaction, see execute
+        :param name: statement name registered with prepare
+        :param params: query parameters
+        :return: None
+        """
+        def operation(con):
+            with con.cursor() as cursor:
+                self._execute_prepared_statement(cursor, name, params)
+            con.commit()
+        self.run(operation)
+        return None
+
+    def fetchall_prepared(self, name, params=None):
+        """
+        Function runs a prepared read and returns every row, see fetchall
+        :param name: statement name registered with prepare
+        :param params: query parameters
+        :return: List of row tuples
+        """
+        def operation(con):
+            with con.cursor() as cursor:
+                self._execute_prepared_statement(cursor, name, params)
+                returned_value = cursor.fetchall()
+            con.rollback()
+            return returned_value
+        return self.run(operation)
+
+    def read_prepared_sql_df(self, name, params=None, dtype=None):
+        """
+        Function runs a prepared read into a Pandas DataFrame, falling back on the cache like read_sql_df
+        :param name: statement name registered with prepare
+        :param params: query parameters
+        :param dtype: column dtypes passed to pandas
+        :return: Dataframe
+        """
+        return self._read_or_cached((name, repr(params)), self.make_read_prepared_sql_df_operation(name, params, dtype))
+
+
+class ReplicaRoutingConnectionManager:
+    """
+    Class routes reads which tolerate a few seconds of staleness (leaderboards, analytics, schedules) to a read
+    replica, and everything else to the primary. execute, fetchall, read_sql_df and run go to the primary, so it can
+    stand in for a DatabaseConnectionManager and only the replica tolerant reads need to change.
+
+    The replica's lag is checked at most every lag_check_interval_seconds. While it is behind by more than
+    max_replica_lag_seconds, can't be reached, or no replica is configured, replica reads go to the primary
+    """
+
+    def __init__(self, primary, replica=None, max_replica_lag_seconds=10, lag_check_interval_seconds=5):
+        self.primary = primary
+        self.replica = replica
+        self.max_replica_lag_seconds = max_replica_lag_seconds
+        self.lag_check_interval_seconds = lag_check_interval_seconds
+        self._lock = threading.Lock()
+        self._lag_checked_at = None
+        self._replica_fresh = False
+
+    def _is_replica_fresh(self):
+        with self._lock:
+            if self._lag_checked_at is not None and \
+                    time.monotonic() - self._lag_checked_at < self.lag_check_interval_seconds:
+                return self._replica_fresh
+            self._lag_checked_at = time.monotonic()
+        try:
+            replica_lag_seconds = float(self.replica.fetchall(REPLICA_LAG_QUERY)[0][0])
+            replica_fresh = replica_lag_seconds <= self.max_replica_lag_seconds
+            if replica_lag_seconds == float("inf"):
+                logging.getLogger(__name__).warning("replica isn't streaming, reading from the primary")
+            elif not replica_fresh:
+                logging.getLogger(__name__).warning("replica is %.1fs behind, reading from the primary",
+                                                    replica_lag_seconds)
+        except DatabaseUnavailableError:
+            logging.getLogger(__name__).warning("replica unavailable, reading from the primary")
+            replica_fresh = False
+        with self._lock:
+            self._replica_fresh = replica_fresh
+        return replica_fresh
+
+    def _run_on_replica_or(self, operation, run_on_primary):
+        if self.replica is not None and self._is_replica_fresh():
+            try:
+                return self.replica.run(operation)
+            except DatabaseUnavailableError:
+                with self._lock:
+                    self._replica_fresh = False
+                logging.getLogger(__name__).warning("replica unavailable, reading from the primary")
+        return run_on_primary()
+
+    def run_replica(self, operation):
+        """
+        Function runs a read only operation(con) on the replica when it is fresh, otherwise on the primary
+        :param operation: callable taking a psycopg2 connection
+        :return: The operation's return value
+        """
+        return self._run_on_replica_or(operation, lambda: self.primary.run(operation))
+
+    def read_replica_sql_df(self, query, params=None, dtype=None):
+        """
+        Function runs a read which tolerates replica lag into a Pandas DataFrame. When neither server can be reached
+        the primary's last successful result of the same query is returned
+        :param query: SQL query
+        :param params: query parameters
+        :param dtype: column dtypes passed to pandas
+        :return: Dataframe
+        """
+        return self._run_on_replica_or(make_read_sql_df_operation(query, params, dtype),
+                                       lambda: self.primary.read_sql_df(query, params, dtype))
+
+    def prepare(self, name, query):
+        """
+        Function registers a prepared statement with the primary and the replica, see DatabaseConnectionManager.prepare
+        """
+        self.primary.prepare(name, query)
+        if self.replica is not None:
+            self.replica.prepare(name, query)
+        return None
+
+    def read_replica_prepared_sql_df(self, name, params=None, dtype=None):
+        """
+        Function runs a prepared read which tolerates replica lag into a Pandas DataFrame, see read_replica_sql_df
+        :param name: statement name registered with prepare
+        :param params: query parameters
+        :param dtype: column dtypes passed to pandas
+        :return: Dataframe
+        """
+        operation = None if self.replica is None else \
+            self.replica.make_read_prepared_sql_df_operation(name, params, dtype)
+        return self._run_on_replica_or(operation, lambda: self.primary.read_prepared_sql_df(name, params, dtype))
+
+    def run(self, operation):
+        """
+        Function runs operation(con) on the primary, see DatabaseConnectionManager.run
+        """
+        return self.primary.run(operation)
+
+    def execute(self, command, data_tuple=None):
+        """
+        Function executes a write on the primary, see DatabaseConnectionManager.execute
+        """
+        return self.primary.execute(command, data_tuple)
+
+    def fetchall(self, query, params=None):
+        """
+        Function runs a read on the primary, see DatabaseConnectionManager.fetchall
+        """
+        return self.primary.fetchall(query, params)
+
+    def read_sql_df(self, query, params=None, dtype=None):
+        """
+        Function runs a read on the primary, see DatabaseConnectionManager.read_sql_df
+        """
+        return self.primary.read_sql_df(query, params, dtype)
+
+    def execute_prepared(self, name, params=None):
+        """
+        Function executes a prepared write on the primary, see DatabaseConnectionManager.execute_prepared
+        """
+        return self.primary.execute_prepared(name, params)
+
+    def fetchall_prepared(self, name, params=None):
+        """
+        Function runs a prepared read on the primary, see DatabaseConnectionManager.fetchall_prepared
+        """
+        return self.primary.fetchall_prepared(name, params)
+
+    def read_prepared_sql_df(self, name, params=None, dtype=None):
+        """
+        Function runs a prepared read on the primary, see DatabaseConnectionManager.read_prepared_sql_df
+        """
+        return self.primary.read_prepared_sql_df(name, params, dtype)
+
+
+def make_connection_kwargs_from_secrets(secrets):
+    """
+    Function builds the psycopg2 connection arguments of the primary and of the optional read replica from the
+    Streamlit secrets (USER, PASSWORD, DATABASE_NAME, HOST and PORT, and REPLICA_HOST and REPLICA_PORT for a replica
+    with the same credentials)
+    :param secrets: st.secrets
+    :return: primary connection arguments, replica connection arguments - None when REPLICA_HOST isn't set
+    """
+    connection_kwargs = {"user": secrets["USER"], "password": secrets["PASSWORD"],
+                         "database": secrets["DATABASE_NAME"], "host": secrets["HOST"], "port": secrets["PORT"]}
+    replica_connection_kwargs = None
+    if secrets.get("REPLICA_HOST"):
+        replica_connection_kwargs = dict(connection_kwargs, host=secrets["REPLICA_HOST"],
+                                         port=secrets.get("REPLICA_PORT", secrets["PORT"]))
+    return connection_kwargs, replica_connection_kwargs
+
+
+def make_shared_connection_manager(secrets, prepared_statement_dict=None):
+    """
+    Function returns the connection manager shared by every page and session of the process, creating it on the first
+    call, so the process holds one pool (and one replica pool) and one slow query log. Each page registers the
+    statements it runs as prepared statements, registering one again does nothing. Queries slower than the
+    SLOW_QUERY_THRESHOLD_MS secret are logged
+    :param secrets: st.secrets
+    :param prepared_statement_dict: Dictionary of statement name to query, the calling page's prepared statements
+    :return: ReplicaRoutingConnectionManager object
+    """
+    global _shared_connection_manager
+    with _shared_connection_manager_lock:
+        if _shared_connection_manager is None:
+            connection_kwargs, replica_connection_kwargs = make_connection_kwargs_from_secrets(secrets)
+            slow_query_log = SlowQueryLog(threshold_ms=secrets.get("SLOW_QUERY_THRESHOLD_MS", SLOW_QUERY_THRESHOLD_MS))
+            replica = None
+            if replica_connection_kwargs is not None:
+                replica = DatabaseConnectionManager(replica_connection_kwargs, slow_query_log=slow_query_log)
+            _shared_connection_manager = ReplicaRoutingConnectionManager(
+                DatabaseConnectionManager(connection_kwargs, slow_query_log=slow_query_log), replica)
+    for name, query in (prepared_statement_dict or dict()).items():
+        _shared_connection_manager.prepare(name, query)
+    return _shared_connection_manager
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import logging
+from decimal import Decimal
+
+import click
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import connect_to_postgres_database_from_env
+from src.data.migrations import MIGRATION_LIST, make_schema_migrations_table
+from src.data.page_queries import (GRADED_PICKS_QUERY, INSERT_USER_WINNING_PICK_QUERY, LEAGUE_ID_FROM_INVITE_CODE_QUERY,
+                                   LEAGUE_USERNAMES_QUERY, LOGIN_CHECK_QUERY, PCT_CORRECT_BY_WEEK_QUERY,
+                                   UNIQUE_EMAIL_QUERY, UNIQUE_LEAGUE_NAME_QUERY, UNIQUE_USERNAME_QUERY,
+                                   USER_ID_FROM_USERNAME_QUERY, USER_LEAGUES_QUERY, USER_PICKS_WITH_WIN_QUERY,
+                                   USER_WEEKLY_PICKS_QUERY, USER_WEEKS_PREDICTION_PCT_QUERY, USERNAMES_QUERY)
+from src.data.pick_submission_queue import CURRENT_PICKS_QUERY, UPSERT_PICKS_QUERY
+from src.features.league_standings import (LEADERBOARD_PAGE_QUERY, LEADERBOARD_PAGE_SIZE, MODEL_RANK_QUERY,
+                                           PAGE_AFTER_KEY_QUERY, USER_STANDING_QUERY)
+from src.features.pick_agreement import PICK_CODES_QUERY
+from src.features.pick_consensus import WEEK_PICK_CONSENSUS_QUERY
+from src.models.standings_projection import CURRENT_POINTS_QUERY, REMAINING_PICK_CODES_QUERY
+
+
+EXPLAIN_CHECK_SCHEMA = "explain_check"
+# Tables which grow with the user base. The schedule tables are bounded by the ~285 games in a season and leagues
+# number in the hundreds, so a sequential scan over them is the cheapest plan and is not reported
+GROWING_TABLE_LIST = ["users", "league_members", "user_weekly_picks", "user_winning_picks", "league_standings"]
+
+# Benchmark-scale data: users split into leagues of ~100, every user picks every game of an 18 week, 16 game per
+# week season
+BENCHMARK_SEED_QUERY_LIST = [
+    """INSERT INTO users (username, password, email, date_created, time_created)
+       SELECT 'user_' || n, md5(n::text), 'user_' || n || '@example.com', current_date, localtime(0)
+       FROM generate_series(1, %(user_count)s) AS n;""",
+    """INSERT INTO leagues (league_name, invite_code, date_created)
+       SELECT 'league_' || n, md5(n::text), current_date
+       FROM generate_series(1, greatest(%(user_count)s / 100, 1)) AS n;""",
+    """INSERT INTO league_members (league_id, user_id, date_joined)
+       SELECT 1 + (usr.user_id - 1) %% (SELECT count(*) FROM leagues), usr.user_id, current_date
+       FROM users usr;""",
+    """INSERT INTO nfl_games_2022 (game_id, season, game_type, week, gameday, weekday, gametime, away_team,
+                                   home_team, stadium)
+       SELECT '2022_' || lpad(w::text, 2, '0') || '_T' || lpad((2 * g)::text, 2, '0') || '_T' ||
+              lpad((2 * g + 1)::text, 2, '0'),
+              2022, 'REG', w, date '2022-09-11' + 7 * (w - 1), 'Sunday', '13:00',
+              'T' || lpad((2 * g)::text, 2, '0'), 'T' || lpad((2 * g + 1)::text, 2, '0'), 'Stadium ' || g
+       FROM generate_series(1, 18) AS w, generate_series(0, 15) AS g;""",
+    """INSERT INTO nfl_teams (team_abbr)
+       SELECT 'T' || lpad(n::text, 2, '0')
+       FROM generate_series(0, 31) AS n;""",
+    """INSERT INTO nfl_games (game_id, season, week, away_team_id, home_team_id, kickoff)
+       SELECT nfl.game_id, nfl.season, nfl.week, away.team_id, home.team_id,
+              (nfl.gameday + nfl.gametime::time) AT TIME ZONE 'US/Eastern'
+       FROM nfl_games_2022 nfl
+       JOIN nfl_teams away
+           ON nfl.away_team = away.team_abbr
+       JOIN nfl_teams home
+           ON nfl.home_team = home.team_abbr;""",
+    """INSERT INTO nfl_game_scores_2022 (game_id, week, away_team, away_score, home_team, home_score, game_key)
+       SELECT nfl.game_id, nfl.week, nfl.away_team, (random() * 40)::int, nfl.home_team, (random() * 40)::int,
+              gms.game_key
+       FROM nfl_games_2022 nfl
+       JOIN nfl_games gms
+           ON nfl.game_id = gms.game_id;""",
+    """INSERT INTO user_weekly_picks (user_id_game_id, user_id, game_id, winning_pick, timestamp_added, game_key,
+                                      pick_team_id, league_id)
+       SELECT pck.user_id || '_' || pck.game_id, pck.user_id, pck.game_id, tms.team_abbr, now(), pck.game_key,
+              pck.pick_team_id, pck.league_id
+       FROM (
+           SELECT mbr.league_id, mbr.user_id, gms.game_id, gms.game_key,
+                  CASE WHEN random() < 0.5 THEN gms.away_team_id ELSE gms.home_team_id END AS pick_team_id
+           FROM league_members mbr
+           CROSS JOIN nfl_games gms
+       ) pck
+       JOIN nfl_teams tms
+           ON pck.pick_team_id = tms.team_id;""",
+    """INSERT INTO user_winning_picks (user_id_game_id, user_id, game_id, week, correct_pick_flag, game_key,
+                                       league_id)
+       SELECT pck.user_id_game_id, pck.user_id, pck.game_id, gms.week,
+              CASE
+                  WHEN scr.away_score > scr.home_score AND pck.pick_team_id = gms.away_team_id THEN 1
+                  WHEN scr.away_score < scr.home_score AND pck.pick_team_id = gms.home_team_id THEN 1
+                  ELSE 0
+              END,
+              pck.game_key, pck.league_id
+       FROM user_weekly_picks pck
+       JOIN nfl_games gms
+           ON pck.game_key = gms.game_key
+       JOIN nfl_game_scores_2022 scr
+           ON pck.game_key = scr.game_key;""",
+    "REFRESH MATERIALIZED VIEW league_standings;",
+]
+BENCHMARK_TABLE_LIST = ["users", "leagues", "league_members", "nfl_teams", "nfl_games", "nfl_games_2022",
+                        "nfl_game_scores_2022", "user_weekly_picks", "user_winning_picks", "league_standings"]
+
+# (name, query, params, full_scan_expected) for every query the Streamlit pages run. Every pick, grade and standing
+# query is scoped to one league, so none of them should read another league's rows
+EXPLAIN_CHECK_QUERY_LIST = [
+    ("make_check_for_unique_username", UNIQUE_USERNAME_QUERY, {"username": "user_42"}, False),
+    ("make_check_for_unique_email", UNIQUE_EMAIL_QUERY, {"email": "user_42@example.com"}, False),
+    ("make_username_password_login_check", LOGIN_CHECK_QUERY, {"username": "user_42", "password": "hash"}, False),
+    ("make_id_from_username", USER_ID_FROM_USERNAME_QUERY, {"username": "user_42"}, False),
+    ("make_user_leagues_df", USER_LEAGUES_QUERY, {"user_id": 42}, False),
+    ("make_check_for_unique_league_name", UNIQUE_LEAGUE_NAME_QUERY, {"league_name": "league_7"}, False),
+    ("make_league_id_from_invite_code", LEAGUE_ID_FROM_INVITE_CODE_QUERY, {"invite_code": "abc"}, False),
+    ("make_user_weekly_picks_df", USER_WEEKLY_PICKS_QUERY, {"league_id": 1, "user_id": 42}, False),
+    # The pick submission queue's flush, shown for a single submitted pick
+    ("flush pick submissions current picks",
+     CURRENT_PICKS_QUERY.replace("%%s", "(%(league_id)s, %(user_id)s, %(game_id)s)"),
+     {"flush_time": datetime.datetime(2022, 9, 1, tzinfo=datetime.timezone.utc), "league_id": 1, "user_id": 42,
+      "game_id": "2022_01_T00_T01"}, False),
+    ("flush pick submissions upsert",
+     UPSERT_PICKS_QUERY.replace("%s", "(%(league_id)s, %(user_id)s, %(game_id)s, %(winning_pick)s, now())"),
+     {"league_id": 1, "user_id": 42, "game_id": "2022_01_T00_T01", "winning_pick": "T00"}, False),
+    ("make_insert_into_user_winning_picks_table", INSERT_USER_WINNING_PICK_QUERY,
+     {"user_id_game_id": "42_2022_01_T00_T01", "user_id": 42, "league_id": 1, "game_id": "2022_01_T00_T01",
+      "game_key": 1, "week": 1, "correct_pick_flag": 1}, False),
+    ("make_user_weeks_prediction_pct_df", USER_WEEKS_PREDICTION_PCT_QUERY, {"league_id": 1, "user_id": 42}, False),
+    ("make_user_picks_with_win_df", USER_PICKS_WITH_WIN_QUERY, {"league_id": 1, "user_id": 42}, False),
+    ("make_usernames_df", USERNAMES_QUERY, {"user_id_list": list(range(1, 6))}, False),
+    ("make_games_with_scores_df", GRADED_PICKS_QUERY, {"league_id": 1}, False),
+    ("make_leaderboard_page_df", LEADERBOARD_PAGE_QUERY,
+     {"league_id": 1, "after_rank": 0, "after_user_id": 0, "page_size": LEADERBOARD_PAGE_SIZE}, False),
+    ("make_user_standing", USER_STANDING_QUERY, {"league_id": 1, "user_id": 1001}, False),
+    ("make_model_standing", MODEL_RANK_QUERY, {"league_id": 1, "pct_correct": Decimal("52.1")}, False),
+    ("make_page_after_key", PAGE_AFTER_KEY_QUERY,
+     {"league_id": 1, "before_rank": 40, "before_user_id": 1001, "rows_above": LEADERBOARD_PAGE_SIZE}, False),
+    ("make_pct_correct_by_week_df", PCT_CORRECT_BY_WEEK_QUERY,
+     {"league_id": 1, "season": 2022, "user_id_list": list(range(1, 2501, 100))}, False),
+    ("make_week_pick_consensus", WEEK_PICK_CONSENSUS_QUERY, {"league_id": 1, "season": 2022, "week": 5}, False),
+    ("make_week_pick_agreement", PICK_CODES_QUERY, {"league_id": 1, "season": 2022, "week": 5}, False),
+    ("make_projected_standings_df picks", REMAINING_PICK_CODES_QUERY, {"league_id": 1, "season": 2022}, False),
+    ("make_projected_standings_df points", CURRENT_POINTS_QUERY, {"league_id": 1}, False),
+    ("make_projected_standings_df usernames", LEAGUE_USERNAMES_QUERY, {"league_id": 1}, False),
+]
+
+
+def make_seq_scanned_relations(plan):
+    """
+    Function walks an EXPLAIN (FORMAT JSON) plan tree and returns the relations read by a sequential scan
+    :param plan: Plan dictionary
+    :return: List of relation names
+    """
+    relation_list = list()
+    if plan["Node Type"] == "Seq Scan":
+        relation_list.append(plan["Relation Name"])
+    for child_plan in plan.get("Plans", []):
+        relation_list.extend(make_seq_scanned_relations(child_plan))
+    return relation_list
+
+
+def make_explain_plan(cursor, query, params):
+    """
+    Function returns the planner's chosen plan for a query without running it
+    :param cursor: psycopg2 cursor object
+    :param query: SQL query
+    :param params: query parameters
+    :return: Plan dictionary
+    """
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    explain_output = cursor.fetchone()[0]
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    return explain_output[0]["Plan"]
+
+
+def make_benchmark_schema(con, schema, user_count):
+    """
+    Function builds the full schema in a scratch schema, seeds it at benchmark scale and vacuums it so the planner sees
+    the steady state of a live database (visibility map set, statistics current). The connection's search_path is left
+    pointing at the scratch schema
+    :param con: psycopg2 connection object
+    :param schema: name of the scratch schema, which must not exist yet
+    :param user_count: number of seeded users, each picking every game of the season
+    :return: None
+    """
+    with con, con.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA " + schema + ";")
+        cursor.execute("SET search_path TO " + schema + ";")
+        make_schema_migrations_table(cursor)
+        for version, description, ddl in MIGRATION_LIST:
+            cursor.execute(ddl)
+        for seed_query in BENCHMARK_SEED_QUERY_LIST:
+            cursor.execute(seed_query, {"user_count": user_count})
+    con.autocommit = True
+    with con.cursor() as cursor:
+        cursor.execute("VACUUM ANALYZE " + ", ".join(BENCHMARK_TABLE_LIST) + ";")
+    con.autocommit = False
+    return None
+
+
+def pipeline_explain_seq_scan_check(con, user_count=5000):
+    """
+    Function builds and seeds a scratch schema with make_benchmark_schema and EXPLAINs every page query. The scratch
+    schema is dropped afterwards
+    :param con: psycopg2 connection object
+    :param user_count: number of seeded users, each picking every game of the season
+    :return: List of (query name, seq scanned growing tables, full_scan_expected) tuples
+    """
+    result_list = list()
+    try:
+        make_benchmark_schema(con, EXPLAIN_CHECK_SCHEMA, user_count)
+        with con, con.cursor() as cursor:
+            for name, query, params, full_scan_expected in EXPLAIN_CHECK_QUERY_LIST:
+                plan = make_explain_plan(cursor, query, params)
+                seq_scanned_list = [relation for relation in make_seq_scanned_relations(plan)
+                                    if relation in GROWING_TABLE_LIST]
+                result_list.append((name, seq_scanned_list, full_scan_expected))
+    finally:
+        con.rollback()
+        con.autocommit = False
+        with con, con.cursor() as cursor:
+            cursor.execute("DROP SCHEMA IF EXISTS " + EXPLAIN_CHECK_SCHEMA + " CASCADE;")
+    return result_list
+
+
+@click.command()
+@click.option("--user-count", type=int, default=5000, help="Number of users seeded for the check.")
+def main(user_count):
+    """ Fails if any page query sequentially scans a table that grows with the user base.
+    """
+    con = connect_to_postgres_database_from_env()
+    try:
+        result_list = pipeline_explain_seq_scan_check(con, user_count)
+    finally:
+        con.close()
+    failed_count = 0
+    for name, seq_scanned_list, full_scan_expected in result_list:
+        if not seq_scanned_list:
+            status = "OK"
+        elif full_scan_expected:
+            status = "FULL SCAN (expected)"
+        else:
+            status = "SEQ SCAN"
+            failed_count += 1
+        click.echo("{:<45} {:<22} {}".format(name, status, ", ".join(seq_scanned_list)))
+    if failed_count:
+        raise click.ClickException("{} queries sequentially scan a growing table".format(failed_count))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from pathlib import Path
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import connect_to_postgres_database_from_env
+
+
+DEFAULT_CHUNK_SIZE = 50000
+EXPORT_FORMAT_LIST = ["csv", "parquet"]
+# Columns of the hand-made data/interim/week_nfl_picks_*.csv dumps, followed by the league, schedule and grade
+PICK_HISTORY_SCHEMA = pa.schema([("user_id_game_id", pa.string()),
+                                 ("user_id", pa.int32()),
+                                 ("game_id", pa.string()),
+                                 ("winning_pick", pa.string()),
+                                 ("timestamp_added", pa.timestamp("us")),
+                                 ("league_id", pa.int32()),
+                                 ("season", pa.int16()),
+                                 ("week", pa.int16()),
+                                 ("correct_pick_flag", pa.int8())])
+# pandas dtypes of the PICK_HISTORY_SCHEMA columns. Every chunk is cast to them, so a chunk with a missing grade or
+# timestamp writes its columns in the same format as every other chunk
+PICK_HISTORY_DTYPE_DICT = {"user_id": "int32", "timestamp_added": "datetime64[us]", "league_id": "int32",
+                           "season": "int16", "week": "int16", "correct_pick_flag": "Int8"}
+CSV_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+PICK_HISTORY_SELECT = """
+    SELECT pck.user_id_game_id, pck.user_id, pck.game_id, pck.winning_pick, pck.timestamp_added, pck.league_id,
+           gms.season, gms.week, win.correct_pick_flag
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    LEFT JOIN user_winning_picks win
+        ON pck.league_id = win.league_id AND pck.user_id = win.user_id AND pck.game_key = win.game_key
+"""
+# Ordered so each user's picks are contiguous and in schedule order in the exported file. When exported for one of the
+# league's players, the others' picks of games which haven't kicked off are left out, as on the pages
+LEAGUE_PICK_HISTORY_QUERY = PICK_HISTORY_SELECT + """
+    WHERE pck.league_id = %(league_id)s
+        AND (%(viewer_user_id)s::integer IS NULL OR pck.user_id = %(viewer_user_id)s OR gms.kickoff <= now())
+    ORDER BY pck.user_id, pck.game_key
+    ;
+"""
+USER_PICK_HISTORY_QUERY = PICK_HISTORY_SELECT + """
+    WHERE pck.league_id = %(league_id)s AND pck.user_id = %(user_id)s
+    ORDER BY pck.game_key
+    ;
+"""
+
+
+def iter_pick_history_dfs(con, league_id, user_id=None, chunk_size=DEFAULT_CHUNK_SIZE, viewer_user_id=None):
+    """
+    Function streams a league's (or one of its users') pick history from a server-side cursor, so only chunk_size
+    rows are ever held in memory. The caller owns the transaction
+    :param con: psycopg2 connection object
+    :param league_id: league_id key
+    :param user_id: user_id key - None exports the whole league
+    :param chunk_size: rows per chunk
+    :param viewer_user_id: user_id key of the player exporting the whole league, whose picks of games which haven't
+                           kicked off are the only ones included - None includes everyone's
+    :return: Generator of Dataframes with the PICK_HISTORY_SCHEMA columns
+    """
+    if user_id is None:
+        query, params = LEAGUE_PICK_HISTORY_QUERY, {"league_id": league_id, "viewer_user_id": viewer_user_id}
+    else:
+        query, params = USER_PICK_HISTORY_QUERY, {"league_id": league_id, "user_id": user_id}
+    with con.cursor(name="pick_history_export") as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(query, params)
+        while True:
+            row_list = cursor.fetchmany(chunk_size)
+            if not row_list:
+                break
+            yield pd.DataFrame.from_records(row_list, columns=PICK_HISTORY_SCHEMA.names).astype(
+                PICK_HISTORY_DTYPE_DICT)
+
+
+def write_pick_history_csv(pick_history_df_iter, file_obj):
+    """
+    Function writes pick history chunks to a binary file object as CSV, header first. Timestamps are written with
+    their microseconds and missing grades as empty fields, the same in every chunk
+    :param pick_history_df_iter: iterable of Dataframes returned by iter_pick_history_dfs
+    :param file_obj: binary file object
+    :return: Number of rows written
+    """
+    row_count = 0
+    file_obj.write((",".join(PICK_HISTORY_SCHEMA.names) + "\n").encode())
+    for pick_history_df in pick_history_df_iter:
+        file_obj.write(pick_history_df.to_csv(index=False, header=False, date_format=CSV_TIMESTAMP_FORMAT).encode())
+        row_count += len(pick_history_df)
+    return row_count
+
+
+def write_pick_history_parquet(pick_history_df_iter, file_obj):
+    """
+    Function writes pick history chunks to a binary file object as Parquet, one row group per chunk. The schema is
+    fixed up front so chunks with only missing grades still get the right column types
+    :param pick_history_df_iter: iterable of Dataframes
+    :param file_obj: binary file object
+    :return: Number of rows written
+    """
+    row_count = 0
+    with pq.ParquetWriter(file_obj, PICK_HISTORY_SCHEMA) as writer:
+        for pick_history_df in pick_history_df_iter:
+            writer.write_table(pa.Table.from_pandas(pick_history_df, schema=PICK_HISTORY_SCHEMA,
+                                                    preserve_index=False))
+            row_count += len(pick_history_df)
+    return row_count
+
+
+def export_pick_history(con, file_obj, export_format, league_id, user_id=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                        viewer_user_id=None):
+    """
+    Function exports a league's (or one of its users') pick history to a binary file object
+    :param con: psycopg2 connection object
+    :param file_obj: binary file object
+    :param export_format: csv or parquet
+    :param league_id: league_id key
+    :param user_id: user_id key - None exports the whole league
+    :param chunk_size: rows per chunk
+    :param viewer_user_id: user_id key of the player exporting the whole league - None includes every pick
+    :return: Number of rows written
+    """
+    writer_dict = {"csv": write_pick_history_csv, "parquet": write_pick_history_parquet}
+    try:
+        return writer_dict[export_format](iter_pick_history_dfs(con, league_id, user_id, chunk_size, viewer_user_id),
+                                          file_obj)
+    finally:
+        con.rollback()
+
+
+@click.command()
+@click.argument("league_id", type=int)
+@click.argument("output_filepath", type=click.Path(dir_okay=False))
+@click.option("--user-id", type=int, default=None, help="Export a single user's picks instead of the whole league.")
+@click.option("--format", "export_format", type=click.Choice(EXPORT_FORMAT_LIST), default=None,
+              help="Output format, defaults to the OUTPUT_FILEPATH extension.")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per round trip.")
+def main(league_id, output_filepath, user_id, export_format, chunk_size):
+    """ Streams a league's (or one user's) picks and graded results into a CSV or Parquet file.
+    """
+    logger = logging.getLogger(__name__)
+    export_format = export_format or Path(output_filepath).suffix.lstrip(".").lower()
+    if export_format not in EXPORT_FORMAT_LIST:
+        raise click.BadParameter("use a .csv or .parquet file or pass --format", param_hint="OUTPUT_FILEPATH")
+    con = connect_to_postgres_database_from_env()
+    start = time.perf_counter()
+    try:
+        with open(output_filepath, "wb") as file_obj:
+            row_count = export_pick_history(con, file_obj, export_format, league_id, user_id, chunk_size)
+    finally:
+        con.close()
+    elapsed = time.perf_counter() - start
+    logger.info("exported %s rows to %s in %.2fs (%.0f rows/s)", row_count, output_filepath, elapsed,
+                row_count / max(elapsed, 1e-9))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from pathlib import Path
+
+import click
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import connect_to_postgres_database_from_env
+from src.data.make_dataset import DEFAULT_CHUNK_SIZE, copy_df_in_chunks
+from src.data.page_queries import GRADE_GAMES_QUERY
+from src.features.league_standings import REFRESH_LEAGUE_STANDINGS_QUERY
+
+
+# Columns of the hand-made data/interim/week_nfl_picks_*.csv files
+PICK_FILE_COLUMN_LIST = ["user_id_game_id", "user_id", "game_id", "winning_pick", "timestamp_added"]
+REJECT_COLUMN_LIST = ["source_filepath", "line_number"] + PICK_FILE_COLUMN_LIST + ["reject_reason"]
+MALFORMED_ROW = "malformed row"
+MISMATCHED_USER_ID_GAME_ID = "user_id_game_id does not match user_id and game_id"
+UNKNOWN_GAME = "game not in schedule"
+TEAM_NOT_IN_GAME = "team not playing in game"
+PICKED_AFTER_KICKOFF = "picked after kickoff"
+NOT_LEAGUE_MEMBER = "user not in league"
+SUPERSEDED_PICK = "superseded by a later pick in the import"
+# The app stores timestamp_added as the naive local time of the server running it
+DEFAULT_TIMESTAMP_TIMEZONE = "UTC"
+
+# The games the pages and the live-score poller keep in nfl_games, with the kickoff the pages lock picks at
+SCHEDULE_QUERY = """
+    SELECT gms.game_id, away.team_abbr AS away_team, home.team_abbr AS home_team, gms.kickoff
+    FROM nfl_games gms
+    JOIN nfl_teams away
+        ON gms.away_team_id = away.team_id
+    JOIN nfl_teams home
+        ON gms.home_team_id = home.team_id
+    WHERE gms.game_id = ANY(%(game_id_list)s)
+    ;
+"""
+LEAGUE_MEMBERS_QUERY = "SELECT user_id FROM league_members WHERE league_id = %(league_id)s;"
+CREATE_STAGING_TABLE_QUERY = """
+    CREATE TEMPORARY TABLE pick_import_staging (
+        user_id_game_id TEXT,
+        user_id INTEGER,
+        game_id TEXT,
+        winning_pick TEXT,
+        timestamp_added TIMESTAMP
+    ) ON COMMIT DROP;
+"""
+COPY_STAGING_QUERY = "COPY pick_import_staging ({}) FROM STDIN WITH (FORMAT csv)".format(
+    ", ".join(PICK_FILE_COLUMN_LIST))
+# A pick already stored with a later timestamp, e.g. changed in the app after the offline sheet was filled, is kept.
+# Unchanged picks aren't rewritten, so importing the same file twice is a no-op
+MERGE_STAGING_QUERY = """
+    INSERT INTO user_weekly_picks (user_id_game_id, user_id, league_id, game_id, winning_pick, timestamp_added,
+                                   game_key, pick_team_id)
+    SELECT stg.user_id_game_id, stg.user_id, %(league_id)s, stg.game_id, stg.winning_pick, stg.timestamp_added,
+           gms.game_key, tms.team_id
+    FROM pick_import_staging stg
+    JOIN nfl_games gms
+        ON stg.game_id = gms.game_id
+    JOIN nfl_teams tms
+        ON stg.winning_pick = tms.team_abbr
+    ON CONFLICT (league_id, user_id, game_key) DO UPDATE SET
+    (winning_pick, pick_team_id, timestamp_added) = (EXCLUDED.winning_pick, EXCLUDED.pick_team_id,
+                                                     EXCLUDED.timestamp_added)
+    WHERE (user_weekly_picks.timestamp_added IS NULL OR user_weekly_picks.timestamp_added <= EXCLUDED.timestamp_added)
+        AND user_weekly_picks.pick_team_id IS DISTINCT FROM EXCLUDED.pick_team_id
+    RETURNING game_key
+    ;
+"""
+
+
+def read_pick_files_df(filepath_list):
+    """
+    Function reads pick files as text, so badly typed values can be rejected row by row instead of failing the read
+    :param filepath_list: list of CSV filepaths
+    :return: Dataframe with the PICK_FILE_COLUMN_LIST columns plus source_filepath and line_number
+    """
+    pick_file_df_list = list()
+    for filepath in filepath_list:
+        pick_file_df = pd.read_csv(filepath, dtype=str, keep_default_na=False)
+        missing_column_list = [column for column in PICK_FILE_COLUMN_LIST if column not in pick_file_df.columns]
+        if missing_column_list:
+            raise click.BadParameter("{} is missing columns {}".format(filepath, missing_column_list))
+        pick_file_df = pick_file_df[PICK_FILE_COLUMN_LIST]
+        pick_file_df.insert(0, "source_filepath", str(filepath))
+        # Line 1 is the header
+        pick_file_df.insert(1, "line_number", pick_file_df.index + 2)
+        pick_file_df_list.append(pick_file_df)
+    return pd.concat(pick_file_df_list, ignore_index=True)
+
+
+def make_schedule_df(con, game_id_list):
+    """
+    Function returns the sides and kickoff time of the given games
+    :param con: psycopg2 connection object
+    :param game_id_list: list of game_ids
+    :return: Dataframe with game_id, away_team, home_team and kickoff (UTC) columns
+    """
+    with con, con.cursor() as cursor:
+        cursor.execute(SCHEDULE_QUERY, {"game_id_list": game_id_list})
+        schedule_df = pd.DataFrame(cursor.fetchall(), columns=["game_id", "away_team", "home_team", "kickoff"])
+    schedule_df["kickoff"] = pd.to_datetime(schedule_df["kickoff"], utc=True)
+    return schedule_df
+
+
+def make_league_user_id_set(con, league_id):
+    """
+    Function returns the user_ids of a league's members
+    :param con: psycopg2 connection object
+    :param league_id: league_id key
+    :return: Set of ints
+    """
+    with con, con.cursor() as cursor:
+        cursor.execute(LEAGUE_MEMBERS_QUERY, {"league_id": league_id})
+        return {row[0] for row in cursor.fetchall()}
+
+
+def make_validated_picks_df(picks_df, schedule_df, league_user_id_set,
+                            timestamp_timezone=DEFAULT_TIMESTAMP_TIMEZONE):
+    """
+    Function validates every pick at once against the schedule and the league. Each row gets the first rule it breaks,
+    in the order the REJECT constants are declared. When a user picked the same game more than once only the latest
+    pick is kept
+    :param picks_df: Dataframe returned by read_pick_files_df
+    :param schedule_df: Dataframe returned by make_schedule_df
+    :param league_user_id_set: Set returned by make_league_user_id_set
+    :param timestamp_timezone: timezone of the naive timestamp_added values
+    :return: Dataframe of valid picks, Dataframe of rejected picks with a reject_reason column
+    """
+    validated_df = picks_df.merge(schedule_df, how="left", on="game_id")
+    user_id = pd.to_numeric(validated_df["user_id"], errors="coerce")
+    timestamp_added = pd.to_datetime(validated_df["timestamp_added"], errors="coerce")
+    # Localized only to compare with kickoff, the picks are stored with their timestamp as written
+    picked_at = timestamp_added.dt.tz_localize(timestamp_timezone, ambiguous=False, nonexistent="shift_forward")
+    reason_series = pd.Series(pd.NA, index=validated_df.index, dtype="object")
+    rule_list = [
+        (MALFORMED_ROW, user_id.isna() | (user_id % 1 != 0) | timestamp_added.isna() |
+         (validated_df["game_id"] == "") | (validated_df["winning_pick"] == "")),
+        (MISMATCHED_USER_ID_GAME_ID, validated_df["user_id_game_id"] != (validated_df["user_id"] + "_" +
+                                                                          validated_df["game_id"])),
+        (UNKNOWN_GAME, validated_df["kickoff"].isna()),
+        (TEAM_NOT_IN_GAME, (validated_df["winning_pick"] != validated_df["away_team"]) &
+         (validated_df["winning_pick"] != validated_df["home_team"])),
+        (PICKED_AFTER_KICKOFF, picked_at >= validated_df["kickoff"]),
+        (NOT_LEAGUE_MEMBER, ~user_id.isin(list(league_user_id_set))),
+    ]
+    for reason, broken in rule_list:
+        reason_series = reason_series.mask(reason_series.isna() & broken, reason)
+    validated_df["user_id"] = user_id.where(user_id % 1 == 0).astype("Int64")
+    validated_df["timestamp_added"] = timestamp_added
+
+    ordered_df = validated_df[reason_series.isna()].sort_values(["timestamp_added", "line_number"])
+    superseded = ordered_df.duplicated(["user_id", "game_id"], keep="last")
+    reason_series[superseded[superseded].index] = SUPERSEDED_PICK
+
+    valid_picks_df = validated_df.loc[reason_series.isna(), PICK_FILE_COLUMN_LIST].reset_index(drop=True)
+    rejected_picks_df = picks_df.loc[reason_series.notna()].assign(reject_reason=reason_series.dropna())
+    return valid_picks_df, rejected_picks_df[REJECT_COLUMN_LIST].reset_index(drop=True)
+
+
+def load_valid_picks(con, valid_picks_df, league_id, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Function COPYs valid picks into a staging table, merges them into user_weekly_picks and grades any of their games
+    which already have a final score, refreshing the league standings, all in a single transaction
+    :param con: psycopg2 connection object
+    :param valid_picks_df: Dataframe returned by make_validated_picks_df
+    :param league_id: league_id key
+    :param chunk_size: rows per COPY chunk
+    :return: Number of picks inserted or updated
+    """
+    with con, con.cursor() as cursor:
+        cursor.execute(CREATE_STAGING_TABLE_QUERY)
+        copy_df_in_chunks(cursor, valid_picks_df, COPY_STAGING_QUERY, chunk_size)
+        cursor.execute(MERGE_STAGING_QUERY, {"league_id": league_id})
+        game_key_list = sorted({row[0] for row in cursor.fetchall()})
+        merged_count = cursor.rowcount
+        if game_key_list:
+            cursor.execute(GRADE_GAMES_QUERY, {"game_key_list": game_key_list})
+            cursor.execute(REFRESH_LEAGUE_STANDINGS_QUERY)
+    return merged_count
+
+
+@click.command()
+@click.argument("league_id", type=int)
+@click.argument("input_filepaths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--reject-filepath", type=click.Path(dir_okay=False), default="pick_import_rejects.csv",
+              help="Where rejected rows are written, with the reason each was rejected.")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per COPY chunk.")
+@click.option("--timestamp-timezone", default=DEFAULT_TIMESTAMP_TIMEZONE,
+              help="Timezone of timestamp_added, the local timezone of the server running the app.")
+def main(league_id, input_filepaths, reject_filepath, chunk_size, timestamp_timezone):
+    """ Validates the picks in INPUT_FILEPATHS (week_nfl_picks_*.csv layout) and loads the valid ones into
+        LEAGUE_ID.
+    """
+    logger = logging.getLogger(__name__)
+    start = time.perf_counter()
+    picks_df = read_pick_files_df([Path(filepath) for filepath in input_filepaths])
+    con = connect_to_postgres_database_from_env()
+    try:
+        schedule_df = make_schedule_df(con, sorted(picks_df["game_id"].unique()))
+        valid_picks_df, rejected_picks_df = make_validated_picks_df(picks_df, schedule_df,
+                                                                    make_league_user_id_set(con, league_id),
+                                                                    timestamp_timezone)
+        merged_count = load_valid_picks(con, valid_picks_df, league_id, chunk_size)
+    finally:
+        con.close()
+    rejected_picks_df.to_csv(reject_filepath, index=False)
+    logger.info("read %s picks in %.2fs: %s valid (%s inserted or updated), %s rejected to %s", len(picks_df),
+                time.perf_counter() - start, len(valid_picks_df), merged_count, len(rejected_picks_df),
+                reject_filepath)
+    for reason, reject_count in rejected_picks_df["reject_reason"].value_counts().items():
+        logger.info("  %s: %s", reason, reject_count)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import time
+
+import click
+import nfl_data_py as nfl
+import pandas as pd
+import pytz
+import requests
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import DatabaseConnectionManager, DatabaseUnavailableError, make_connection_kwargs_from_env
+from src.data.page_queries import GRADE_GAMES_QUERY
+from src.features.build_features import make_season_results_df, pipeline_update_team_form
+from src.features.league_standings import REFRESH_LEAGUE_STANDINGS_QUERY
+
+
+SEASON = 2022
+ESPN_SCOREBOARD_URL = "https://site.api.espn.com/apis/site/v2/sports/football/nfl/scoreboard"
+# ESPN abbreviations which differ from the nflverse ones used everywhere else
+ESPN_TEAM_ABBR_DICT = {"LAR": "LA", "WSH": "WAS"}
+EASTERN_TIMEZONE = pytz.timezone("US/Eastern")
+# A game is polled from shortly before kickoff until it is final. Past the longest plausible game (a delay, a
+# suspension or a scoreboard without the final yet) it is still polled, every OVERDUE_INTERVAL_SECONDS
+PREGAME_LEAD = datetime.timedelta(minutes=5)
+GAME_WINDOW = datetime.timedelta(hours=5)
+DEFAULT_LIVE_INTERVAL_SECONDS = 15
+OVERDUE_INTERVAL_SECONDS = 300
+DEFAULT_IDLE_INTERVAL_SECONDS = 3600
+REQUEST_TIMEOUT_SECONDS = 10
+
+INSERT_NFL_GAMES_QUERY = """
+    INSERT INTO nfl_teams (team_abbr)
+    VALUES (%(away_team)s), (%(home_team)s)
+    ON CONFLICT (team_abbr) DO NOTHING;
+    INSERT INTO nfl_games (game_id, season, week, away_team_id, home_team_id, kickoff)
+    SELECT %(game_id)s, %(season)s, %(week)s, away.team_id, home.team_id, %(kickoff)s
+    FROM nfl_teams away, nfl_teams home
+    WHERE away.team_abbr = %(away_team)s AND home.team_abbr = %(home_team)s
+    ON CONFLICT (game_id) DO UPDATE SET kickoff = EXCLUDED.kickoff
+    WHERE nfl_games.kickoff IS DISTINCT FROM EXCLUDED.kickoff;
+"""
+KNOWN_SCORES_QUERY = "SELECT game_id, away_score, home_score FROM nfl_game_scores_2022;"
+# Returns the game_key only when the row was inserted or its score actually changed
+UPSERT_FINAL_SCORE_QUERY = """
+    INSERT INTO nfl_game_scores_2022 (game_id, week, away_team, away_score, home_team, home_score, game_key)
+    SELECT gms.game_id, gms.week, %(away_team)s, %(away_score)s, %(home_team)s, %(home_score)s, gms.game_key
+    FROM nfl_games gms
+    WHERE gms.game_id = %(game_id)s
+    ON CONFLICT (game_id) DO UPDATE SET
+    (away_score, home_score) = (EXCLUDED.away_score, EXCLUDED.home_score)
+    WHERE (nfl_game_scores_2022.away_score, nfl_game_scores_2022.home_score) IS DISTINCT FROM
+          (EXCLUDED.away_score, EXCLUDED.home_score)
+    RETURNING game_key
+    ;
+"""
+# Grades every league's picks of the given games in one statement, rewriting only grades which change
+GRADE_GAMES_QUERY = """
+    INSERT INTO user_winning_picks (user_id_game_id, user_id, league_id, game_id, game_key, week, correct_pick_flag)
+    SELECT pck.user_id_game_id, pck.user_id, pck.league_id, pck.game_id, pck.game_key, gms.week,
+        CASE
+            WHEN scr.away_score > scr.home_score AND pck.pick_team_id = gms.away_team_id THEN 1
+            WHEN scr.away_score < scr.home_score AND pck.pick_team_id = gms.home_team_id THEN 1
+            ELSE 0
+        END AS correct_pick_flag
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    JOIN nfl_game_scores_2022 scr
+        ON pck.game_key = scr.game_key
+    WHERE pck.game_key = ANY(%(game_key_list)s)
+    ON CONFLICT (league_id, user_id, game_key) DO UPDATE SET
+    (week, correct_pick_flag) = (EXCLUDED.week, EXCLUDED.correct_pick_flag)
+    WHERE user_winning_picks.correct_pick_flag IS DISTINCT FROM EXCLUDED.correct_pick_flag
+    ;
+"""
+
+
+def make_kickoff_index_df(schedule_df):
+    """
+    Function builds the kickoff index of a season: one row per game with its Eastern kickoff time, sorted by kickoff.
+    Rest and spread are kept for the team form feature store
+    :param schedule_df: Dataframe with an nflverse schedule
+    :return: Dataframe with game_id, season, week, away_team, home_team, away_rest, home_rest, spread_line, gameday
+             and kickoff columns
+    """
+    kickoff_index_df = schedule_df[["game_id", "season", "week", "away_team", "home_team", "away_rest", "home_rest",
+                                    "spread_line", "gameday", "gametime"]].copy()
+    kickoff_index_df["kickoff"] = pd.to_datetime(kickoff_index_df["gameday"].astype(str) + " " +
+                                                 kickoff_index_df["gametime"]).dt.tz_localize(EASTERN_TIMEZONE)
+    kickoff_index_df["gameday"] = kickoff_index_df["kickoff"].dt.date
+    kickoff_index_df = kickoff_index_df.drop(columns="gametime").sort_values("kickoff").reset_index(drop=True)
+    return kickoff_index_df
+
+
+def make_live_games_df(kickoff_index_df, final_game_id_set, now):
+    """
+    Function returns the games which have kicked off (or are about to) and aren't final yet, however long ago they
+    kicked off
+    :param kickoff_index_df: Dataframe returned by make_kickoff_index_df
+    :param final_game_id_set: game_ids already stored with a final score
+    :param now: timezone aware datetime
+    :return: Dataframe
+    """
+    kicked_off = kickoff_index_df["kickoff"] - PREGAME_LEAD <= now
+    live_games_df = kickoff_index_df[kicked_off & ~kickoff_index_df["game_id"].isin(final_game_id_set)]
+    return live_games_df
+
+
+def make_next_poll_seconds(kickoff_index_df, final_game_id_set, now, live_interval_seconds,
+                           idle_interval_seconds, overdue_interval_seconds=OVERDUE_INTERVAL_SECONDS):
+    """
+    Function decides how long to sleep before the next poll: live_interval_seconds while any game is within
+    GAME_WINDOW of its kickoff, at most overdue_interval_seconds while a game past it isn't final, otherwise until just
+    before the next kickoff, never longer than idle_interval_seconds so schedule changes (flexed games) are picked up
+    :param kickoff_index_df: Dataframe returned by make_kickoff_index_df
+    :param final_game_id_set: game_ids already stored with a final score
+    :param now: timezone aware datetime
+    :param live_interval_seconds: poll interval while games are in progress
+    :param idle_interval_seconds: longest sleep between games
+    :param overdue_interval_seconds: longest sleep while a game past GAME_WINDOW isn't final
+    :return: Seconds to sleep
+    """
+    live_games_df = make_live_games_df(kickoff_index_df, final_game_id_set, now)
+    if (now <= live_games_df["kickoff"] + GAME_WINDOW).any():
+        return live_interval_seconds
+    longest_sleep_seconds = idle_interval_seconds
+    if len(live_games_df) != 0:
+        longest_sleep_seconds = min(overdue_interval_seconds, idle_interval_seconds)
+    upcoming_kickoff_series = kickoff_index_df.loc[kickoff_index_df["kickoff"] - PREGAME_LEAD > now, "kickoff"]
+    if len(upcoming_kickoff_series) == 0:
+        return longest_sleep_seconds
+    seconds_to_window = (upcoming_kickoff_series.iloc[0] - PREGAME_LEAD - now).total_seconds()
+    return max(min(seconds_to_window, longest_sleep_seconds), live_interval_seconds)
+
+
+def make_espn_scoreboard_df(gameday):
+    """
+    Function fetches the ESPN scoreboard of one day
+    :param gameday: date
+    :return: Dataframe with gameday, away_team, away_score, home_team, home_score and completed columns
+    """
+    response = requests.get(ESPN_SCOREBOARD_URL, params={"dates": gameday.strftime("%Y%m%d")},
+                            timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    scoreboard_list = list()
+    for event in response.json().get("events", []):
+        competition = event["competitions"][0]
+        team_dict = dict()
+        for competitor in competition["competitors"]:
+            team_abbr = competitor["team"]["abbreviation"]
+            team_dict[competitor["homeAway"]] = (ESPN_TEAM_ABBR_DICT.get(team_abbr, team_abbr),
+                                                 int(competitor.get("score") or 0))
+        scoreboard_list.append({"gameday": gameday,
+                                "away_team": team_dict["away"][0], "away_score": team_dict["away"][1],
+                                "home_team": team_dict["home"][0], "home_score": team_dict["home"][1],
+                                "completed": bool(competition["status"]["type"]["completed"])})
+    return pd.DataFrame(scoreboard_list, columns=["gameday", "away_team", "away_score", "home_team", "home_score",
+                                                  "completed"])
+
+
+def make_changed_final_scores_df(live_games_df, scoreboard_df, known_score_dict):
+    """
+    Function matches the scoreboard to the live games and keeps the final scores which differ from the stored ones
+    :param live_games_df: Dataframe returned by make_live_games_df
+    :param scoreboard_df: Dataframe returned by make_espn_scoreboard_df
+    :param known_score_dict: Dictionary holding game_id as key and the stored (away_score, home_score) as value
+    :return: Dataframe with game_id, away_team, away_score, home_team and home_score columns
+    """
+    final_scores_df = live_games_df.merge(scoreboard_df[scoreboard_df["completed"]],
+                                          on=["gameday", "away_team", "home_team"])
+    changed_mask = [known_score_dict.get(game_id) != (away_score, home_score) for game_id, away_score, home_score in
+                    final_scores_df[["game_id", "away_score", "home_score"]].itertuples(index=False)]
+    return final_scores_df.loc[changed_mask, ["game_id", "away_team", "away_score", "home_team", "home_score"]]
+
+
+def write_score_deltas(database, changed_final_scores_df):
+    """
+    Function stores the changed final scores, grades the picks of those games and refreshes the league standings in a
+    single transaction
+    :param database: DatabaseConnectionManager object
+    :param changed_final_scores_df: Dataframe returned by make_changed_final_scores_df
+    :return: Number of graded picks written
+    """
+    def operation(con):
+        game_key_list = list()
+        with con.cursor() as cursor:
+            for row in changed_final_scores_df.to_dict("records"):
+                cursor.execute(UPSERT_FINAL_SCORE_QUERY, {key: value if isinstance(value, str) else int(value)
+                                                          for key, value in row.items()})
+                game_key_list.extend(returned_row[0] for returned_row in cursor.fetchall())
+            graded_count = 0
+            if game_key_list:
+                cursor.execute(GRADE_GAMES_QUERY, {"game_key_list": game_key_list})
+                graded_count = cursor.rowcount
+                cursor.execute(REFRESH_LEAGUE_STANDINGS_QUERY)
+        con.commit()
+        return graded_count
+    return database.run(operation)
+
+
+def make_known_score_dict(database):
+    """
+    Function returns the scores already stored
+    :param database: DatabaseConnectionManager object
+    :return: Dictionary holding game_id as key and (away_score, home_score) as value
+    """
+    return {game_id: (away_score, home_score) for game_id, away_score, home_score in
+            database.fetchall(KNOWN_SCORES_QUERY)}
+
+
+def pipeline_refresh_kickoff_index_df(database, season):
+    """
+    Function pipelines the process required to load a season's kickoff index and make sure every game has a game_key
+    and its current kickoff
+    :param database: DatabaseConnectionManager object
+    :param season: NFL season
+    :return: Dataframe returned by make_kickoff_index_df
+    """
+    kickoff_index_df = make_kickoff_index_df(nfl.import_schedules([season]))
+
+    def operation(con):
+        with con.cursor() as cursor:
+            for row in kickoff_index_df[["game_id", "season", "week", "away_team", "home_team",
+                                         "kickoff"]].to_dict("records"):
+                cursor.execute(INSERT_NFL_GAMES_QUERY, {key: value if isinstance(value, (str, pd.Timestamp)) else
+                                                        int(value) for key, value in row.items()})
+        con.commit()
+    database.run(operation)
+    return kickoff_index_df
+
+
+def pipeline_poll_once(database, kickoff_index_df, known_score_dict, now):
+    """
+    Function pipelines one poll: fetch the scoreboard of every day with a live game, write the final scores which
+    changed and grade them. known_score_dict is updated in place
+    :param database: DatabaseConnectionManager object
+    :param kickoff_index_df: Dataframe returned by make_kickoff_index_df
+    :param known_score_dict: Dictionary returned by make_known_score_dict
+    :param now: timezone aware datetime
+    :return: Number of changed games, number of graded picks written
+    """
+    live_games_df = make_live_games_df(kickoff_index_df, set(known_score_dict), now)
+    if len(live_games_df) == 0:
+        return 0, 0
+    scoreboard_df = pd.concat([make_espn_scoreboard_df(gameday) for gameday in live_games_df["gameday"].unique()],
+                              ignore_index=True)
+    changed_final_scores_df = make_changed_final_scores_df(live_games_df, scoreboard_df, known_score_dict)
+    if len(changed_final_scores_df) == 0:
+        return 0, 0
+    graded_count = write_score_deltas(database, changed_final_scores_df)
+    for game_id, away_score, home_score in changed_final_scores_df[["game_id", "away_score",
+                                                                    "home_score"]].itertuples(index=False):
+        known_score_dict[game_id] = (away_score, home_score)
+    return len(changed_final_scores_df), graded_count
+
+
+def update_team_form(kickoff_index_df, known_score_dict):
+    """
+    Function brings the team form feature store up to date with the stored final scores. Only the weeks whose
+    results changed are rewritten, and a failed write is retried with the next change
+    :param kickoff_index_df: Dataframe returned by make_kickoff_index_df
+    :param known_score_dict: Dictionary returned by make_known_score_dict
+    :return: None
+    """
+    try:
+        pipeline_update_team_form(make_season_results_df(kickoff_index_df, known_score_dict))
+    except OSError as error:
+        logging.getLogger(__name__).warning("team form update failed: %s", error)
+    return None
+
+
+@click.command()
+@click.option("--season", type=int, default=SEASON, help="NFL season to poll.")
+@click.option("--live-interval", type=int, default=DEFAULT_LIVE_INTERVAL_SECONDS,
+              help="Seconds between polls while games are in progress.")
+@click.option("--idle-interval", type=int, default=DEFAULT_IDLE_INTERVAL_SECONDS,
+              help="Longest sleep between game windows, the schedule is reloaded this often.")
+@click.option("--once", is_flag=True, help="Poll once and exit.")
+def main(season, live_interval, idle_interval, once):
+    """ Polls live scores while games are in progress, storing final scores as soon as games end, grading every
+        league's picks of those games and updating the team form feature store.
+    """
+    logger = logging.getLogger(__name__)
+    database = DatabaseConnectionManager(make_connection_kwargs_from_env(), max_connections=1)
+    kickoff_index_df = pipeline_refresh_kickoff_index_df(database, season)
+    known_score_dict = make_known_score_dict(database)
+    update_team_form(kickoff_index_df, known_score_dict)
+    schedule_refreshed_at = time.monotonic()
+    while True:
+        now = datetime.datetime.now(EASTERN_TIMEZONE)
+        try:
+            changed_count, graded_count = pipeline_poll_once(database, kickoff_index_df, known_score_dict, now)
+            if changed_count:
+                logger.info("stored %s final scores, wrote %s grades", changed_count, graded_count)
+                update_team_form(kickoff_index_df, known_score_dict)
+        except (requests.RequestException, DatabaseUnavailableError) as error:
+            logger.warning("poll failed, retrying next interval: %s", error)
+        except Exception:
+            # An unexpected scoreboard payload or a failed statement skips this poll, not the rest of the season
+            logger.exception("poll failed, retrying next interval")
+        if once:
+            break
+        sleep_seconds = make_next_poll_seconds(kickoff_index_df, set(known_score_dict), now, live_interval,
+                                               idle_interval)
+        time.sleep(sleep_seconds)
+        if time.monotonic() - schedule_refreshed_at >= idle_interval:
+            # Scores stored by the pages or corrected by hand are picked up with the schedule
+            try:
+                kickoff_index_df = pipeline_refresh_kickoff_index_df(database, season)
+                stored_score_dict = make_known_score_dict(database)
+                schedule_refreshed_at = time.monotonic()
+            except Exception:
+                logger.exception("schedule refresh failed, keeping the current one")
+            else:
+                if stored_score_dict != known_score_dict:
+                    known_score_dict = stored_score_dict
+                    update_team_form(kickoff_index_df, known_score_dict)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
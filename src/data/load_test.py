@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+import click
+import numpy as np
+import psycopg2
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import DatabaseConnectionManager, make_connection_kwargs_from_env
+from src.data.explain_check import make_benchmark_schema
+from src.data.page_queries import (GRADED_PICKS_QUERY, LEAGUE_USERNAMES_QUERY, LOGIN_CHECK_QUERY,
+                                   PCT_CORRECT_BY_WEEK_QUERY, USER_ID_FROM_USERNAME_QUERY, USER_LEAGUES_QUERY,
+                                   USER_WEEKLY_PICKS_QUERY)
+from src.data.pick_submission_queue import EASTERN_TIMEZONE, PickSubmissionQueue
+from src.features.league_standings import (FIRST_PAGE_AFTER_KEY, LEADERBOARD_PAGE_QUERY, LEADERBOARD_PAGE_SIZE,
+                                           USER_STANDING_QUERY)
+from src.features.pick_consensus import WEEK_PICK_CONSENSUS_QUERY
+from src.models.standings_projection import CURRENT_POINTS_QUERY, REMAINING_PICK_CODES_QUERY
+
+
+LOAD_TEST_SCHEMA = "load_test"
+SEASON = 2022
+STEP_LIST = ["login", "load_week", "submit_picks", "leaderboard"]
+# The queries each step runs, by the page function which runs them
+PAGE_QUERY_DICT = {"make_username_password_login_check": LOGIN_CHECK_QUERY,
+                   "make_id_from_username": USER_ID_FROM_USERNAME_QUERY,
+                   "make_user_leagues_df": USER_LEAGUES_QUERY,
+                   "make_user_weekly_picks_df": USER_WEEKLY_PICKS_QUERY,
+                   "make_games_with_scores_df": GRADED_PICKS_QUERY,
+                   "make_week_pick_consensus": WEEK_PICK_CONSENSUS_QUERY,
+                   "make_leaderboard_page_df": LEADERBOARD_PAGE_QUERY,
+                   "make_user_standing": USER_STANDING_QUERY,
+                   "make_pct_correct_by_week_df": PCT_CORRECT_BY_WEEK_QUERY,
+                   "make_projected_standings_df picks": REMAINING_PICK_CODES_QUERY,
+                   "make_projected_standings_df points": CURRENT_POINTS_QUERY,
+                   "make_projected_standings_df usernames": LEAGUE_USERNAMES_QUERY}
+# The pages st.cache these per league, so only the first session of each league runs them
+LEAGUE_CACHED_QUERY_DICT = {"load_week": ["make_games_with_scores_df", "make_week_pick_consensus"],
+                            "leaderboard": ["make_projected_standings_df picks",
+                                            "make_projected_standings_df points",
+                                            "make_projected_standings_df usernames"]}
+WEEK_GAMES_QUERY = """
+    SELECT gms.game_id, away.team_abbr, home.team_abbr
+    FROM nfl_games gms
+    JOIN nfl_teams away
+        ON gms.away_team_id = away.team_id
+    JOIN nfl_teams home
+        ON gms.home_team_id = home.team_id
+    WHERE gms.season = %(season)s AND gms.week = %(week)s
+    ORDER BY 1
+    ;
+"""
+SUBMISSION_TIMEOUT_SECONDS = 30
+SERVER_CONNECTIONS_QUERY = "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database();"
+
+
+class LoadTestRecorder:
+    """
+    Class collects the latency and outcome of every step of every session, plus the number of server connections
+    sampled while each step had a session in it
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency_dict = defaultdict(list)
+        self._error_dict = defaultdict(int)
+        self._active_step_dict = defaultdict(int)
+        self._connection_sample_dict = defaultdict(list)
+
+    def run_step(self, step, operation):
+        """
+        Function times operation() as one step of a session. Errors are counted rather than raised so the session
+        carries on, like a user retrying the page
+        :param step: step name
+        :param operation: callable taking no arguments
+        :return: True if the step succeeded
+        """
+        with self._lock:
+            self._active_step_dict[step] += 1
+        start = time.perf_counter()
+        succeeded = True
+        try:
+            operation()
+        except Exception as error:
+            succeeded = False
+            logging.getLogger(__name__).debug("%s failed: %s", step, error)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._active_step_dict[step] -= 1
+            self._latency_dict[step].append(elapsed)
+            if not succeeded:
+                self._error_dict[step] += 1
+        return succeeded
+
+    def record_connection_sample(self, server_connection_count):
+        """
+        Function attributes a server connection count to every step which has a session in it
+        :param server_connection_count: connections open to the database
+        :return: None
+        """
+        with self._lock:
+            for step, active_count in self._active_step_dict.items():
+                if active_count > 0:
+                    self._connection_sample_dict[step].append(server_connection_count)
+        return None
+
+    def make_report_row_list(self):
+        """
+        Function summarises every step
+        :return: List of (step, calls, p50 ms, p95 ms, p99 ms, error rate, mean connections, peak connections)
+        """
+        report_row_list = list()
+        with self._lock:
+            for step in STEP_LIST:
+                latency_array = np.array(self._latency_dict[step]) * 1000
+                if len(latency_array) == 0:
+                    continue
+                p50, p95, p99 = np.percentile(latency_array, [50, 95, 99])
+                connection_sample_list = self._connection_sample_dict[step] or [0]
+                report_row_list.append((step, len(latency_array), p50, p95, p99,
+                                        self._error_dict[step] / len(latency_array),
+                                        np.mean(connection_sample_list), max(connection_sample_list)))
+        return report_row_list
+
+
+class LeagueCache:
+    """
+    Class stands in for st.cache: the first caller of a key runs the operation while later callers wait for it
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_lock_dict = defaultdict(threading.Lock)
+        self._result_dict = dict()
+
+    def get_or_run(self, key, operation):
+        """
+        Function returns the cached result of key, running operation() to make it on first use
+        :param key: cache key
+        :param operation: callable taking no arguments
+        :return: The operation's return value
+        """
+        with self._lock:
+            key_lock = self._key_lock_dict[key]
+        with key_lock:
+            if key not in self._result_dict:
+                self._result_dict[key] = operation()
+            return self._result_dict[key]
+
+
+class SimulatedSession:
+    """
+    Class replays what one browser session of the app asks of the database: login, load the week on Weekly Picks,
+    submit the week's picks, open the Leaderboard. Queries the pages st.cache per league run once per league for the
+    whole test, as they would in a single Streamlit server process
+    """
+
+    def __init__(self, database, submission_queue, recorder, league_cache, user_id, league_count, week,
+                 week_game_list):
+        self.database = database
+        self.submission_queue = submission_queue
+        self.recorder = recorder
+        self.league_cache = league_cache
+        self.user_id = user_id
+        self.username = "user_{}".format(user_id)
+        # BENCHMARK_SEED_QUERY_LIST stores md5(n) as user n's password and puts them in league 1 + (n - 1) % leagues
+        self.password = hashlib.md5(str(user_id).encode()).hexdigest()
+        self.league_id = 1 + (user_id - 1) % league_count
+        self.week = week
+        self.week_game_list = week_game_list
+        self.random = random.Random(user_id)
+
+    def _read(self, name, params):
+        return self.database.read_sql_df(PAGE_QUERY_DICT[name], params=params)
+
+    def _read_league_cached(self, step):
+        for name in LEAGUE_CACHED_QUERY_DICT[step]:
+            self.league_cache.get_or_run((name, self.league_id), lambda: self._read(
+                name, {"league_id": self.league_id, "season": SEASON, "week": self.week}))
+
+    def login(self):
+        """
+        Function checks the session's credentials and looks up its user_id, like login_and_signup_ui_app
+        :return: None
+        """
+        returned_value = self.database.fetchall(PAGE_QUERY_DICT["make_username_password_login_check"],
+                                                {"username": self.username, "password": self.password})
+        if not returned_value:
+            raise ValueError("login failed for {}".format(self.username))
+        self.database.fetchall(PAGE_QUERY_DICT["make_id_from_username"], {"username": self.username})
+
+    def load_week(self):
+        """
+        Function runs the reads behind opening Weekly Picks on a week
+        :return: None
+        """
+        self._read("make_user_leagues_df", {"user_id": self.user_id})
+        self._read_league_cached("load_week")
+        self._read("make_user_weekly_picks_df", {"league_id": self.league_id, "user_id": self.user_id})
+
+    def submit_picks(self):
+        """
+        Function picks a random side of every game of the week and submits them through the pick submission queue,
+        like pipeline_submit_weekly_picks, waiting until they are committed
+        :return: None
+        """
+        pick_dict = {game_id: self.random.choice([away_team, home_team])
+                     for game_id, away_team, home_team in self.week_game_list}
+        submission = self.submission_queue.submit(self.league_id, self.user_id, pick_dict)
+        if not submission.wait(SUBMISSION_TIMEOUT_SECONDS):
+            raise TimeoutError("picks of {} weren't committed in time".format(self.username))
+        if submission.error is not None:
+            raise submission.error
+
+    def leaderboard(self):
+        """
+        Function runs the reads behind opening the Leaderboard
+        :return: None
+        """
+        leaderboard_page_df = self._read("make_leaderboard_page_df", {
+            "league_id": self.league_id, "after_rank": FIRST_PAGE_AFTER_KEY[0], "after_user_id": FIRST_PAGE_AFTER_KEY[1],
+            "page_size": LEADERBOARD_PAGE_SIZE})
+        self._read("make_user_standing", {"league_id": self.league_id, "user_id": self.user_id})
+        self._read("make_pct_correct_by_week_df", {"league_id": self.league_id, "season": SEASON,
+                                                   "user_id_list": leaderboard_page_df["user_id"].tolist()})
+        self._read_league_cached("leaderboard")
+
+    def run(self):
+        """
+        Function runs the session's steps in order, stopping at login if it fails
+        :return: None
+        """
+        if not self.recorder.run_step("login", self.login):
+            return None
+        for step in STEP_LIST[1:]:
+            self.recorder.run_step(step, getattr(self, step))
+        return None
+
+
+def sample_server_connections(connection_kwargs, recorder, stop_event, interval_seconds):
+    """
+    Function samples the number of connections open to the database until stop_event is set
+    :param connection_kwargs: psycopg2 connection arguments
+    :param recorder: LoadTestRecorder object
+    :param stop_event: threading.Event object
+    :param interval_seconds: seconds between samples
+    :return: Peak connection count
+    """
+    peak_connection_count = 0
+    con = psycopg2.connect(**connection_kwargs)
+    con.autocommit = True
+    try:
+        with con.cursor() as cursor:
+            while not stop_event.is_set():
+                cursor.execute(SERVER_CONNECTIONS_QUERY)
+                # Not counting this sampler's own connection
+                server_connection_count = cursor.fetchone()[0] - 1
+                recorder.record_connection_sample(server_connection_count)
+                peak_connection_count = max(peak_connection_count, server_connection_count)
+                stop_event.wait(interval_seconds)
+    finally:
+        con.close()
+    return peak_connection_count
+
+
+def pipeline_load_test(connection_kwargs, session_count, user_count, week, max_connections, ramp_seconds,
+                       sample_interval_seconds=0.05):
+    """
+    Function runs session_count simulated sessions against the seeded load test schema, all starting within
+    ramp_seconds of each other, through one DatabaseConnectionManager shared by every session like the app's
+    :param connection_kwargs: psycopg2 connection arguments pointing at the load test schema
+    :param session_count: number of concurrent sessions
+    :param user_count: number of seeded users
+    :param week: NFL week the sessions pick
+    :param max_connections: connection pool size
+    :param ramp_seconds: seconds over which sessions start
+    :param sample_interval_seconds: seconds between server connection samples
+    :return: LoadTestRecorder object, peak server connection count, wall clock seconds, pick submission transactions
+    """
+    con = psycopg2.connect(**connection_kwargs)
+    try:
+        with con, con.cursor() as cursor:
+            cursor.execute(WEEK_GAMES_QUERY, {"season": SEASON, "week": week})
+            week_game_list = cursor.fetchall()
+            cursor.execute("SELECT count(*) FROM leagues;")
+            league_count = cursor.fetchone()[0]
+    finally:
+        con.close()
+    database = DatabaseConnectionManager(connection_kwargs, max_connections=max_connections)
+    # The seeded season is in the past, flush as if it hadn't kicked off yet
+    submission_queue = PickSubmissionQueue(database, make_now=lambda: EASTERN_TIMEZONE.localize(
+        datetime.datetime(SEASON, 9, 1))).start()
+    recorder = LoadTestRecorder()
+    league_cache = LeagueCache()
+    user_id_list = random.Random(0).sample(range(1, user_count + 1), session_count)
+    session_list = [SimulatedSession(database, submission_queue, recorder, league_cache, user_id, league_count, week,
+                                     week_game_list) for user_id in user_id_list]
+
+    stop_event = threading.Event()
+    peak_connection_list = list()
+    sampler = threading.Thread(target=lambda: peak_connection_list.append(sample_server_connections(
+        connection_kwargs, recorder, stop_event, sample_interval_seconds)), daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    thread_list = list()
+    for index, session in enumerate(session_list):
+        start_delay = ramp_seconds * index / session_count
+        thread = threading.Timer(start_delay, session.run)
+        thread.start()
+        thread_list.append(thread)
+    for thread in thread_list:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    sampler.join()
+    return recorder, max(peak_connection_list, default=0), elapsed, submission_queue.flushed_batch_count
+
+
+@click.command()
+@click.option("--sessions", "session_count", type=int, default=200, help="Number of concurrent sessions.")
+@click.option("--user-count", type=int, default=5000, help="Number of users seeded before the test.")
+@click.option("--week", type=click.IntRange(1, 18), default=1, help="NFL week the sessions submit picks for.")
+@click.option("--max-connections", type=int, default=10,
+              help="Connection pool size, the app's DatabaseConnectionManager default.")
+@click.option("--ramp-seconds", type=float, default=5.0, help="Seconds over which the sessions start.")
+@click.option("--keep-schema", is_flag=True, help="Leave the seeded load_test schema in place afterwards.")
+def main(session_count, user_count, week, max_connections, ramp_seconds, keep_schema):
+    """ Simulates concurrent sessions logging in, loading the week, submitting picks and opening the Leaderboard
+        against a seeded scratch schema, and reports latency, error rate and connections per step.
+    """
+    logger = logging.getLogger(__name__)
+    if session_count > user_count:
+        raise click.BadParameter("can't exceed --user-count", param_hint="--sessions")
+    connection_kwargs = make_connection_kwargs_from_env()
+    con = psycopg2.connect(**connection_kwargs)
+    try:
+        logger.info("seeding %s users into the %s schema", user_count, LOAD_TEST_SCHEMA)
+        make_benchmark_schema(con, LOAD_TEST_SCHEMA, user_count)
+        logger.info("running %s sessions over a %s connection pool", session_count, max_connections)
+        recorder, peak_connection_count, elapsed, flushed_batch_count = pipeline_load_test(
+            dict(connection_kwargs, options="-c search_path=" + LOAD_TEST_SCHEMA), session_count, user_count,
+            week, max_connections, ramp_seconds)
+    finally:
+        con.rollback()
+        if not keep_schema:
+            with con, con.cursor() as cursor:
+                cursor.execute("DROP SCHEMA IF EXISTS " + LOAD_TEST_SCHEMA + " CASCADE;")
+        con.close()
+    click.echo("{:<14} {:>7} {:>9} {:>9} {:>9} {:>8} {:>11} {:>11}".format(
+        "step", "calls", "p50 ms", "p95 ms", "p99 ms", "errors", "mean conns", "peak conns"))
+    for step, call_count, p50, p95, p99, error_rate, mean_connections, peak_connections in \
+            recorder.make_report_row_list():
+        click.echo("{:<14} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1%} {:>11.1f} {:>11}".format(
+            step, call_count, p50, p95, p99, error_rate, mean_connections, peak_connections))
+    click.echo("{} sessions in {:.2f}s, peak {} server connections, picks written in {} transactions".format(
+        session_count, elapsed, peak_connection_count, flushed_batch_count))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
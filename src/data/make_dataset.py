@@ -1,28 +1,212 @@
 # -*- coding: utf-8 -*-
 import click
+import io
 import logging
+import time
 from pathlib import Path
+
+import nfl_data_py as nfl
+import pandas as pd
 from dotenv import find_dotenv, load_dotenv
 
+from src.data.database import connect_to_postgres_database_from_env
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_CACHE_DIR = PROJECT_DIR / "data" / "raw"
+DEFAULT_CHUNK_SIZE = 10000
+# nflverse schedules start in 1999
+FIRST_NFLVERSE_SEASON = 1999
+# data/processed/games_table.csv layout, followed by the final scores
+GAMES_TABLE_COLUMN_LIST = ["game_id", "season", "game_type", "week", "gameday", "weekday", "gametime", "away_team",
+                           "home_team", "stadium"]
+SCORE_COLUMN_LIST = ["away_score", "home_score"]
+HISTORY_COLUMN_LIST = GAMES_TABLE_COLUMN_LIST + SCORE_COLUMN_LIST
+
+# Each season is COPYed into a staging table and merged in the same transaction, so a season is either fully loaded
+# and recorded in backfill_seasons or not loaded at all
+CREATE_STAGING_TABLE_QUERY = """
+    CREATE TEMPORARY TABLE backfill_staging (LIKE nfl_game_history) ON COMMIT DROP;
+    ALTER TABLE backfill_staging DROP COLUMN game_key;
+"""
+COPY_STAGING_QUERY = "COPY backfill_staging ({}) FROM STDIN WITH (FORMAT csv)".format(", ".join(HISTORY_COLUMN_LIST))
+MERGE_STAGING_QUERY = """
+    INSERT INTO nfl_teams (team_abbr)
+        SELECT away_team FROM backfill_staging
+        UNION SELECT home_team FROM backfill_staging
+        ORDER BY 1
+        ON CONFLICT (team_abbr) DO NOTHING;
+    INSERT INTO nfl_games (game_id, season, week, away_team_id, home_team_id, kickoff)
+        SELECT stg.game_id, stg.season, stg.week, away.team_id, home.team_id,
+               (stg.gameday + NULLIF(stg.gametime, '')::time) AT TIME ZONE 'US/Eastern'
+        FROM backfill_staging stg
+        JOIN nfl_teams away
+            ON stg.away_team = away.team_abbr
+        JOIN nfl_teams home
+            ON stg.home_team = home.team_abbr
+        ORDER BY 1
+        ON CONFLICT (game_id) DO UPDATE SET kickoff = EXCLUDED.kickoff
+        WHERE EXCLUDED.kickoff IS NOT NULL AND nfl_games.kickoff IS DISTINCT FROM EXCLUDED.kickoff;
+    INSERT INTO nfl_game_history (game_key, {columns})
+        SELECT gms.game_key, {staging_columns}
+        FROM backfill_staging stg
+        JOIN nfl_games gms
+            ON stg.game_id = gms.game_id
+        ON CONFLICT (game_id) DO UPDATE SET
+        (gameday, gametime, stadium, away_score, home_score) =
+        (EXCLUDED.gameday, EXCLUDED.gametime, EXCLUDED.stadium, EXCLUDED.away_score, EXCLUDED.home_score);
+""".format(columns=", ".join(HISTORY_COLUMN_LIST),
+           staging_columns=", ".join("stg." + column for column in HISTORY_COLUMN_LIST))
+RECORD_SEASON_QUERY = """
+    INSERT INTO backfill_seasons (season, row_count, complete)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (season) DO UPDATE SET
+    (row_count, complete, loaded_at) = (EXCLUDED.row_count, EXCLUDED.complete, now());
+"""
+
+
+def make_season_schedule_df(season, cache_dir):
+    """
+    Function returns a season's nflverse schedule, reading it from the local cache when present. Only seasons where
+    every game has a final score are cached, so the current season is always fetched fresh
+    :param season: NFL season
+    :param cache_dir: directory holding schedules_<season>.parquet files
+    :return: Dataframe
+    """
+    cache_path = Path(cache_dir) / "schedules_{}.parquet".format(season)
+    if cache_path.exists():
+        return pd.read_parquet(cache_path)
+    schedule_df = nfl.import_schedules([season])
+    if schedule_df[SCORE_COLUMN_LIST].notna().all(axis=None):
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        schedule_df.to_parquet(cache_path, index=False)
+    return schedule_df
+
+
+def make_games_table_df(schedule_df):
+    """
+    Function normalises an nflverse schedule to the games_table.csv columns plus the final scores
+    :param schedule_df: Dataframe with an nflverse schedule
+    :return: Dataframe
+    """
+    games_table_df = schedule_df[HISTORY_COLUMN_LIST].copy()
+    games_table_df["gameday"] = pd.to_datetime(games_table_df["gameday"]).dt.date
+    for column in ["season", "week"] + SCORE_COLUMN_LIST:
+        games_table_df[column] = games_table_df[column].astype("Int16")
+    return games_table_df.sort_values("game_id").reset_index(drop=True)
+
+
+def copy_df_in_chunks(cursor, dataframe, copy_query, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Function streams a dataframe into Postgres with COPY, chunk_size rows at a time so memory stays flat however many
+    rows are loaded. Missing values are written as empty fields, which COPY reads as NULL
+    :param cursor: psycopg2 cursor object
+    :param dataframe: Dataframe whose columns match the COPY column list
+    :param copy_query: COPY ... FROM STDIN WITH (FORMAT csv) query
+    :param chunk_size: rows per chunk
+    :return: Number of rows copied
+    """
+    for start in range(0, len(dataframe), chunk_size):
+        buffer = io.StringIO()
+        dataframe.iloc[start:start + chunk_size].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(copy_query, buffer)
+    return len(dataframe)
+
+
+def make_complete_seasons(con):
+    """
+    Function returns the seasons a previous backfill loaded with every final score
+    :param con: psycopg2 connection object
+    :return: Set of ints
+    """
+    with con, con.cursor() as cursor:
+        cursor.execute("SELECT season FROM backfill_seasons WHERE complete;")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def load_season(con, games_table_df, season, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Function loads one season into nfl_game_history, adding its teams and games to the dimension tables, and records
+    it in backfill_seasons. Runs in a single transaction
+    :param con: psycopg2 connection object
+    :param games_table_df: Dataframe returned by make_games_table_df
+    :param season: NFL season
+    :param chunk_size: rows per COPY chunk
+    :return: Number of rows loaded
+    """
+    complete = bool(games_table_df[SCORE_COLUMN_LIST].notna().all(axis=None))
+    with con, con.cursor() as cursor:
+        cursor.execute(CREATE_STAGING_TABLE_QUERY)
+        row_count = copy_df_in_chunks(cursor, games_table_df, COPY_STAGING_QUERY, chunk_size)
+        cursor.execute(MERGE_STAGING_QUERY)
+        cursor.execute(RECORD_SEASON_QUERY, (season, row_count, complete))
+    return row_count
+
+
+def pipeline_backfill_seasons(con, season_list, cache_dir=DEFAULT_CACHE_DIR, chunk_size=DEFAULT_CHUNK_SIZE,
+                              force=False):
+    """
+    Function pipelines the process required to backfill a list of seasons. Seasons already loaded with every final
+    score are skipped unless force is set, so an interrupted run picks up at the first missing season
+    :param con: psycopg2 connection object
+    :param season_list: seasons to load
+    :param cache_dir: directory holding the cached schedules
+    :param chunk_size: rows per COPY chunk
+    :param force: reload seasons which are already complete
+    :return: Total rows loaded, seconds spent loading
+    """
+    logger = logging.getLogger(__name__)
+    complete_season_set = set() if force else make_complete_seasons(con)
+    total_row_count = 0
+    total_load_seconds = 0.0
+    for season in season_list:
+        if season in complete_season_set:
+            logger.info("season %s already loaded, skipping", season)
+            continue
+        games_table_df = make_games_table_df(make_season_schedule_df(season, cache_dir))
+        start = time.perf_counter()
+        row_count = load_season(con, games_table_df, season, chunk_size)
+        load_seconds = time.perf_counter() - start
+        logger.info("season %s: %s rows in %.3fs (%.0f rows/s)", season, row_count, load_seconds,
+                    row_count / max(load_seconds, 1e-9))
+        total_row_count += row_count
+        total_load_seconds += load_seconds
+    return total_row_count, total_load_seconds
+
 
 @click.command()
-@click.argument('input_filepath', type=click.Path(exists=True))
-@click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
-    """ Runs data processing scripts to turn raw data from (../raw) into
-        cleaned data ready to be analyzed (saved in ../processed).
+@click.argument("first_season", type=int)
+@click.argument("last_season", type=int)
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=str(DEFAULT_CACHE_DIR),
+              help="Directory caching the downloaded schedules.")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per COPY chunk.")
+@click.option("--force", is_flag=True, help="Reload seasons which are already loaded.")
+def main(first_season, last_season, cache_dir, chunk_size, force):
+    """ Backfills the schedules and final scores of FIRST_SEASON to LAST_SEASON (inclusive) into the
+        nfl_game_history table.
     """
     logger = logging.getLogger(__name__)
-    logger.info('making final data set from raw data')
+    if first_season < FIRST_NFLVERSE_SEASON:
+        raise click.BadParameter("nflverse schedules start in {}".format(FIRST_NFLVERSE_SEASON),
+                                 param_hint="FIRST_SEASON")
+    if last_season < first_season:
+        raise click.BadParameter("must not be before FIRST_SEASON", param_hint="LAST_SEASON")
+    logger.info('backfilling seasons %s to %s', first_season, last_season)
+    con = connect_to_postgres_database_from_env()
+    try:
+        total_row_count, total_load_seconds = pipeline_backfill_seasons(
+            con, list(range(first_season, last_season + 1)), cache_dir, chunk_size, force)
+    finally:
+        con.close()
+    logger.info("loaded %s rows in %.3fs (%.0f rows/s)", total_row_count, total_load_seconds,
+                total_row_count / max(total_load_seconds, 1e-9))
 
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    # not used in this stub but often useful for finding various files
-    project_dir = Path(__file__).resolve().parents[2]
-
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import click
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import connect_to_postgres_database_from_env
+
+
+MIGRATION_ADVISORY_LOCK_KEY = 20220908
+
+# Versioned DDL. Never edit a migration which has been applied somewhere, append a new one instead
+MIGRATION_LIST = [
+    (1, "create core tables", """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT NOT NULL,
+            date_created DATE,
+            time_created TIME
+        );
+        CREATE TABLE IF NOT EXISTS nfl_games_2022 (
+            game_id TEXT PRIMARY KEY,
+            season INTEGER,
+            game_type TEXT,
+            week INTEGER NOT NULL,
+            gameday DATE,
+            weekday TEXT,
+            gametime TEXT,
+            away_team TEXT NOT NULL,
+            home_team TEXT NOT NULL,
+            stadium TEXT
+        );
+        CREATE TABLE IF NOT EXISTS nfl_game_scores_2022 (
+            game_id TEXT PRIMARY KEY,
+            week INTEGER NOT NULL,
+            away_team TEXT NOT NULL,
+            away_score INTEGER,
+            home_team TEXT NOT NULL,
+            home_score INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS user_weekly_picks (
+            user_id_game_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (user_id),
+            game_id TEXT NOT NULL,
+            winning_pick TEXT NOT NULL,
+            timestamp_added TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS user_winning_picks (
+            user_id_game_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (user_id),
+            game_id TEXT NOT NULL,
+            week INTEGER NOT NULL,
+            correct_pick_flag INTEGER
+        );
+    """),
+    # Tables created by hand before migration 1 existed have no keys, and the grading/score pipelines inserted the
+    # same rows on every cache miss. Keep the first copy of each row, then add the unique keys the upserts need. The
+    # index names match the primary keys created by migration 1 so this is a no-op on fresh databases
+    (2, "deduplicate and key pre-existing tables", """
+        DELETE FROM user_winning_picks a
+            USING user_winning_picks b
+            WHERE a.user_id_game_id = b.user_id_game_id AND a.ctid > b.ctid;
+        DELETE FROM nfl_game_scores_2022 a
+            USING nfl_game_scores_2022 b
+            WHERE a.game_id = b.game_id AND a.ctid > b.ctid;
+        CREATE UNIQUE INDEX IF NOT EXISTS user_winning_picks_pkey ON user_winning_picks (user_id_game_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS user_weekly_picks_pkey ON user_weekly_picks (user_id_game_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS nfl_game_scores_2022_pkey ON nfl_game_scores_2022 (game_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS nfl_games_2022_pkey ON nfl_games_2022 (game_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username) INCLUDE (user_id, password);
+        CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON users (email);
+    """),
+    (3, "hot-path covering indexes", """
+        CREATE INDEX IF NOT EXISTS user_weekly_picks_user_id_idx
+            ON user_weekly_picks (user_id) INCLUDE (game_id, winning_pick);
+        CREATE INDEX IF NOT EXISTS user_weekly_picks_game_id_idx
+            ON user_weekly_picks (game_id) INCLUDE (user_id_game_id, user_id, winning_pick);
+        CREATE INDEX IF NOT EXISTS user_winning_picks_user_id_week_idx
+            ON user_winning_picks (user_id, week) INCLUDE (game_id, correct_pick_flag);
+        CREATE INDEX IF NOT EXISTS nfl_game_scores_2022_week_idx
+            ON nfl_game_scores_2022 (week) INCLUDE (game_id);
+        CREATE INDEX IF NOT EXISTS nfl_games_2022_week_idx
+            ON nfl_games_2022 (week) INCLUDE (game_id);
+    """),
+    # Small integer surrogate keys. Every game_id reads season_week_away_home, so the dimension tables can be filled
+    # from the ids already stored anywhere. The text columns stay for display and for the CSV formats
+    (4, "integer surrogate keys for teams and games", """
+        CREATE TABLE IF NOT EXISTS nfl_teams (
+            team_id SMALLSERIAL PRIMARY KEY,
+            team_abbr TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS nfl_games (
+            game_key SERIAL PRIMARY KEY,
+            game_id TEXT NOT NULL UNIQUE,
+            season SMALLINT NOT NULL,
+            week SMALLINT NOT NULL,
+            away_team_id SMALLINT NOT NULL REFERENCES nfl_teams (team_id),
+            home_team_id SMALLINT NOT NULL REFERENCES nfl_teams (team_id)
+        );
+        CREATE TEMPORARY TABLE known_game_ids ON COMMIT DROP AS
+            SELECT game_id FROM nfl_games_2022
+            UNION SELECT game_id FROM nfl_game_scores_2022
+            UNION SELECT game_id FROM user_weekly_picks
+            UNION SELECT game_id FROM user_winning_picks;
+        INSERT INTO nfl_teams (team_abbr)
+            SELECT split_part(game_id, '_', 3) FROM known_game_ids
+            UNION SELECT split_part(game_id, '_', 4) FROM known_game_ids
+            ORDER BY 1
+            ON CONFLICT (team_abbr) DO NOTHING;
+        INSERT INTO nfl_games (game_id, season, week, away_team_id, home_team_id)
+            SELECT ids.game_id, split_part(ids.game_id, '_', 1)::smallint, split_part(ids.game_id, '_', 2)::smallint,
+                   away.team_id, home.team_id
+            FROM known_game_ids ids
+            JOIN nfl_teams away
+                ON away.team_abbr = split_part(ids.game_id, '_', 3)
+            JOIN nfl_teams home
+                ON home.team_abbr = split_part(ids.game_id, '_', 4)
+            ORDER BY 1
+            ON CONFLICT (game_id) DO NOTHING;
+
+        ALTER TABLE nfl_game_scores_2022 ADD COLUMN IF NOT EXISTS game_key INTEGER REFERENCES nfl_games (game_key);
+        UPDATE nfl_game_scores_2022 scr SET game_key = gms.game_key
+            FROM nfl_games gms
+            WHERE scr.game_id = gms.game_id;
+        ALTER TABLE nfl_game_scores_2022 ALTER COLUMN game_key SET NOT NULL;
+        CREATE UNIQUE INDEX IF NOT EXISTS nfl_game_scores_2022_game_key_key
+            ON nfl_game_scores_2022 (game_key) INCLUDE (away_score, home_score);
+
+        ALTER TABLE user_weekly_picks
+            ADD COLUMN IF NOT EXISTS game_key INTEGER REFERENCES nfl_games (game_key),
+            ADD COLUMN IF NOT EXISTS pick_team_id SMALLINT REFERENCES nfl_teams (team_id);
+        UPDATE user_weekly_picks pck SET game_key = gms.game_key, pick_team_id = tms.team_id
+            FROM nfl_games gms, nfl_teams tms
+            WHERE pck.game_id = gms.game_id AND pck.winning_pick = tms.team_abbr;
+        ALTER TABLE user_weekly_picks
+            ALTER COLUMN game_key SET NOT NULL,
+            ALTER COLUMN pick_team_id SET NOT NULL;
+        ALTER TABLE user_weekly_picks DROP CONSTRAINT IF EXISTS user_weekly_picks_pkey;
+        DROP INDEX IF EXISTS user_weekly_picks_pkey;
+        ALTER TABLE user_weekly_picks ADD CONSTRAINT user_weekly_picks_pkey PRIMARY KEY (user_id, game_key)
+            INCLUDE (pick_team_id, game_id, winning_pick);
+        DROP INDEX IF EXISTS user_weekly_picks_user_id_idx;
+        DROP INDEX IF EXISTS user_weekly_picks_game_id_idx;
+        CREATE INDEX IF NOT EXISTS user_weekly_picks_game_key_idx
+            ON user_weekly_picks (game_key) INCLUDE (user_id, pick_team_id);
+
+        ALTER TABLE user_winning_picks ADD COLUMN IF NOT EXISTS game_key INTEGER REFERENCES nfl_games (game_key);
+        UPDATE user_winning_picks pck SET game_key = gms.game_key
+            FROM nfl_games gms
+            WHERE pck.game_id = gms.game_id;
+        ALTER TABLE user_winning_picks ALTER COLUMN game_key SET NOT NULL;
+        ALTER TABLE user_winning_picks DROP CONSTRAINT IF EXISTS user_winning_picks_pkey;
+        DROP INDEX IF EXISTS user_winning_picks_pkey;
+        ALTER TABLE user_winning_picks ADD CONSTRAINT user_winning_picks_pkey PRIMARY KEY (user_id, game_key);
+    """),
+    # Every pick, grade and standing belongs to one league. Keys lead with league_id so each league's rows are a
+    # contiguous index range, and picks reference league_members so nobody can pick in a league they haven't joined.
+    # Existing users and picks move into a single league, its invite code can be read from the leagues table
+    (5, "league-scoped pools", """
+        CREATE TABLE IF NOT EXISTS leagues (
+            league_id SERIAL PRIMARY KEY,
+            league_name TEXT NOT NULL UNIQUE,
+            invite_code TEXT NOT NULL UNIQUE,
+            date_created DATE
+        );
+        CREATE TABLE IF NOT EXISTS league_members (
+            league_id INTEGER NOT NULL REFERENCES leagues (league_id),
+            user_id INTEGER NOT NULL REFERENCES users (user_id),
+            date_joined DATE,
+            PRIMARY KEY (league_id, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS league_members_user_id_idx ON league_members (user_id) INCLUDE (league_id);
+        INSERT INTO leagues (league_name, invite_code, date_created)
+            SELECT 'NFL Weekly Picks', substr(md5(random()::text), 1, 8), current_date
+            WHERE EXISTS (SELECT 1 FROM users);
+        INSERT INTO league_members (league_id, user_id, date_joined)
+            SELECT lg.league_id, usr.user_id, usr.date_created
+            FROM leagues lg, users usr
+            WHERE lg.league_name = 'NFL Weekly Picks'
+            ON CONFLICT DO NOTHING;
+
+        ALTER TABLE user_weekly_picks ADD COLUMN IF NOT EXISTS league_id INTEGER;
+        UPDATE user_weekly_picks SET league_id = (SELECT league_id FROM leagues WHERE league_name = 'NFL Weekly Picks')
+            WHERE league_id IS NULL;
+        ALTER TABLE user_weekly_picks
+            ALTER COLUMN league_id SET NOT NULL,
+            ADD CONSTRAINT user_weekly_picks_league_member_fkey FOREIGN KEY (league_id, user_id)
+                REFERENCES league_members (league_id, user_id);
+        ALTER TABLE user_weekly_picks DROP CONSTRAINT user_weekly_picks_pkey;
+        ALTER TABLE user_weekly_picks ADD CONSTRAINT user_weekly_picks_pkey PRIMARY KEY (league_id, user_id, game_key)
+            INCLUDE (pick_team_id, game_id, winning_pick);
+        DROP INDEX IF EXISTS user_weekly_picks_game_key_idx;
+        CREATE INDEX IF NOT EXISTS user_weekly_picks_league_id_game_key_idx
+            ON user_weekly_picks (league_id, game_key) INCLUDE (user_id, pick_team_id);
+
+        ALTER TABLE user_winning_picks ADD COLUMN IF NOT EXISTS league_id INTEGER;
+        UPDATE user_winning_picks SET league_id = (SELECT league_id FROM leagues WHERE league_name = 'NFL Weekly Picks')
+            WHERE league_id IS NULL;
+        ALTER TABLE user_winning_picks
+            ALTER COLUMN league_id SET NOT NULL,
+            ADD CONSTRAINT user_winning_picks_league_member_fkey FOREIGN KEY (league_id, user_id)
+                REFERENCES league_members (league_id, user_id);
+        ALTER TABLE user_winning_picks DROP CONSTRAINT user_winning_picks_pkey;
+        ALTER TABLE user_winning_picks ADD CONSTRAINT user_winning_picks_pkey PRIMARY KEY (league_id, user_id, game_key)
+            INCLUDE (week, correct_pick_flag);
+        DROP INDEX IF EXISTS user_winning_picks_user_id_week_idx;
+    """),
+    # Schedules and final scores of every season loaded by the backfill command, in the games_table.csv layout.
+    # backfill_seasons records each loaded season so an interrupted backfill resumes where it stopped
+    (6, "historical schedules and scores", """
+        CREATE TABLE IF NOT EXISTS nfl_game_history (
+            game_id TEXT PRIMARY KEY,
+            game_key INTEGER NOT NULL REFERENCES nfl_games (game_key),
+            season SMALLINT NOT NULL,
+            game_type TEXT,
+            week SMALLINT NOT NULL,
+            gameday DATE,
+            weekday TEXT,
+            gametime TEXT,
+            away_team TEXT NOT NULL,
+            home_team TEXT NOT NULL,
+            stadium TEXT,
+            away_score SMALLINT,
+            home_score SMALLINT
+        );
+        CREATE INDEX IF NOT EXISTS nfl_game_history_season_week_idx ON nfl_game_history (season, week);
+        CREATE TABLE IF NOT EXISTS backfill_seasons (
+            season SMALLINT PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            complete BOOLEAN NOT NULL,
+            loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """),
+    # The live-score poller grades a finished game across every league at once
+    (7, "grade picks by game across leagues", """
+        CREATE INDEX IF NOT EXISTS user_weekly_picks_game_key_idx
+            ON user_weekly_picks (game_key) INCLUDE (league_id, user_id, pick_team_id);
+    """),
+    # Every player's totals and rank, refreshed whenever grades are written. Ties share the best rank and the
+    # (league_id, standing_rank, user_id) index serves leaderboard pages in key order without sorting the league.
+    # The unique index lets REFRESH ... CONCURRENTLY run without blocking leaderboard reads
+    (8, "ranked league standings", """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS league_standings AS
+            WITH league_picks AS (
+                SELECT league_id, user_id, SUM(correct_pick_flag) AS correct_picks, COUNT(*) AS graded_picks,
+                       COUNT(DISTINCT week) AS weeks_played
+                FROM user_winning_picks
+                GROUP BY league_id, user_id
+            )
+            SELECT league_id, user_id, correct_picks, graded_picks, weeks_played,
+                   100 * ROUND(CAST(correct_picks AS numeric) / CAST(graded_picks AS numeric), 3) AS pct_correct,
+                   RANK() OVER (PARTITION BY league_id ORDER BY correct_picks DESC) AS standing_rank,
+                   COUNT(*) OVER (PARTITION BY league_id, correct_picks) > 1 AS tied
+            FROM league_picks;
+        CREATE UNIQUE INDEX IF NOT EXISTS league_standings_league_id_user_id_key
+            ON league_standings (league_id, user_id) INCLUDE (standing_rank, tied);
+        CREATE INDEX IF NOT EXISTS league_standings_league_id_standing_rank_idx
+            ON league_standings (league_id, standing_rank, user_id)
+            INCLUDE (correct_picks, pct_correct, weeks_played, tied);
+    """),
+    # Every game's kickoff, written with the game by the pages, the backfill and the live-score poller, so picks can be
+    # checked against kickoff without the optional history backfill. nflverse gamedays and gametimes are US/Eastern
+    (9, "game kickoff times", """
+        ALTER TABLE nfl_games ADD COLUMN IF NOT EXISTS kickoff TIMESTAMPTZ;
+        UPDATE nfl_games gms SET kickoff = (sch.gameday + sch.gametime::time) AT TIME ZONE 'US/Eastern'
+            FROM nfl_games_2022 sch
+            WHERE gms.game_id = sch.game_id AND sch.gametime <> '';
+        UPDATE nfl_games gms SET kickoff = (hst.gameday + hst.gametime::time) AT TIME ZONE 'US/Eastern'
+            FROM nfl_game_history hst
+            WHERE gms.game_id = hst.game_id AND hst.gametime <> '' AND gms.kickoff IS NULL;
+    """),
+]
+
+def make_schema_migrations_table(cursor):
+    """
+    Function creates the table recording which migration versions have been applied
+    :param cursor: psycopg2 cursor object
+    :return: None
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                          version INTEGER PRIMARY KEY,
+                          description TEXT NOT NULL,
+                          applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                      );""")
+    return None
+
+
+def make_applied_migration_versions(cursor):
+    """
+    Function returns the set of migration versions already applied to the database
+    :param cursor: psycopg2 cursor object
+    :return: Set of ints
+    """
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def apply_migrations(con, target_version=None):
+    """
+    Function applies every pending migration up to target_version, each one in its own transaction. An advisory lock
+    stops two deploys from running the same migration concurrently
+    :param con: psycopg2 connection object
+    :param target_version: last version to apply - None applies all
+    :return: List of applied versions
+    """
+    applied_version_list = list()
+    with con, con.cursor() as cursor:
+        make_schema_migrations_table(cursor)
+    for version, description, ddl in MIGRATION_LIST:
+        if target_version is not None and version > target_version:
+            break
+        with con, con.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s);", [MIGRATION_ADVISORY_LOCK_KEY])
+            if version in make_applied_migration_versions(cursor):
+                continue
+            cursor.execute(ddl)
+            cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                           (version, description))
+        applied_version_list.append(version)
+    return applied_version_list
+
+
+@click.group()
+def cli():
+    """ Versioned schema migrations for the NFL weekly picks database.
+    """
+
+
+@cli.command()
+@click.option("--target-version", type=int, default=None, help="Last migration version to apply.")
+def upgrade(target_version):
+    """ Applies every pending migration.
+    """
+    logger = logging.getLogger(__name__)
+    con = connect_to_postgres_database_from_env()
+    try:
+        applied_version_list = apply_migrations(con, target_version)
+    finally:
+        con.close()
+    if applied_version_list:
+        logger.info("applied migrations %s", applied_version_list)
+    else:
+        logger.info("database schema is up to date")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    cli()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+
+# The queries the Streamlit pages run, kept here so the pages and the EXPLAIN check run exactly the same SQL
+
+# Weekly Picks: sign up, login and leagues
+UNIQUE_USERNAME_QUERY = """
+    SELECT username
+    FROM users
+    WHERE username = %(username)s
+    LIMIT 1
+    ;
+"""
+UNIQUE_EMAIL_QUERY = """
+    SELECT email
+    FROM users
+    WHERE email = %(email)s
+    LIMIT 1
+    ;
+"""
+INSERT_USER_QUERY = """
+    INSERT INTO users (username, password, email, date_created, time_created)
+    VALUES (%(username)s, %(password)s, %(email)s, %(date_created)s, %(time_created)s)
+    ;
+"""
+LOGIN_CHECK_QUERY = """
+    SELECT *
+    FROM users
+    WHERE username = %(username)s AND password = %(password)s
+    ;
+"""
+USER_ID_FROM_USERNAME_QUERY = """
+    SELECT user_id
+    FROM users
+    WHERE username = %(username)s
+    ;
+"""
+USER_LEAGUES_QUERY = """
+    SELECT lg.league_id, lg.league_name, lg.invite_code
+    FROM league_members mbr
+    JOIN leagues lg
+        ON mbr.league_id = lg.league_id
+    WHERE mbr.user_id = %(user_id)s
+    ORDER BY lg.league_name
+    ;
+"""
+UNIQUE_LEAGUE_NAME_QUERY = """
+    SELECT league_name
+    FROM leagues
+    WHERE league_name = %(league_name)s
+    LIMIT 1
+    ;
+"""
+LEAGUE_ID_FROM_INVITE_CODE_QUERY = """
+    SELECT league_id
+    FROM leagues
+    WHERE invite_code = %(invite_code)s
+    ;
+"""
+INSERT_LEAGUE_QUERY = """
+    WITH new_league AS (
+        INSERT INTO leagues (league_name, invite_code, date_created)
+        VALUES (%(league_name)s, %(invite_code)s, %(date_created)s)
+        RETURNING league_id
+    )
+    INSERT INTO league_members (league_id, user_id, date_joined)
+    SELECT league_id, %(user_id)s, %(date_created)s FROM new_league
+    ;
+"""
+INSERT_LEAGUE_MEMBER_QUERY = """
+    INSERT INTO league_members (league_id, user_id, date_joined)
+    VALUES (%(league_id)s, %(user_id)s, %(date_joined)s)
+    ON CONFLICT (league_id, user_id) DO NOTHING
+    ;
+"""
+
+# Weekly Picks: schedule and scores, written in one statement per table. Kickoffs arrive as naive US/Eastern times and
+# follow flexed games. A score whose game has no game_key fails the NOT NULL constraint instead of being dropped
+INSERT_NFL_TEAMS_QUERY = """
+    INSERT INTO nfl_teams (team_abbr)
+    VALUES %s
+    ON CONFLICT (team_abbr) DO NOTHING
+    ;
+"""
+INSERT_NFL_GAMES_QUERY = """
+    INSERT INTO nfl_games (game_id, season, week, away_team_id, home_team_id, kickoff)
+    SELECT sub.game_id, sub.season, sub.week, away.team_id, home.team_id, sub.kickoff AT TIME ZONE 'US/Eastern'
+    FROM (VALUES %s) AS sub (game_id, season, week, away_team, home_team, kickoff)
+    JOIN nfl_teams away
+        ON sub.away_team = away.team_abbr
+    JOIN nfl_teams home
+        ON sub.home_team = home.team_abbr
+    ON CONFLICT (game_id) DO UPDATE SET kickoff = EXCLUDED.kickoff
+    WHERE EXCLUDED.kickoff IS NOT NULL AND nfl_games.kickoff IS DISTINCT FROM EXCLUDED.kickoff
+    ;
+"""
+# Returns the game_key of each game inserted or whose score changed, for its picks to be graded in the same transaction
+UPSERT_GAME_SCORES_QUERY = """
+    INSERT INTO nfl_game_scores_2022 (game_id, week, away_team, away_score, home_team, home_score, game_key)
+    SELECT sub.game_id, sub.week, sub.away_team, sub.away_score, sub.home_team, sub.home_score, gms.game_key
+    FROM (VALUES %s) AS sub (game_id, week, away_team, away_score, home_team, home_score)
+    LEFT JOIN nfl_games gms
+        ON sub.game_id = gms.game_id
+    ON CONFLICT (game_id) DO UPDATE SET
+    (away_score, home_score) = (EXCLUDED.away_score, EXCLUDED.home_score)
+    WHERE (nfl_game_scores_2022.away_score, nfl_game_scores_2022.home_score) IS DISTINCT FROM
+          (EXCLUDED.away_score, EXCLUDED.home_score)
+    RETURNING game_key
+    ;
+"""
+# Grades every league's picks of the given games in one statement, rewriting only grades which change. Run
+# wherever final scores or picks of scored games are written: the pages, live_scores and import_picks
+GRADE_GAMES_QUERY = """
+    INSERT INTO user_winning_picks (user_id_game_id, user_id, league_id, game_id, game_key, week, correct_pick_flag)
+    SELECT pck.user_id_game_id, pck.user_id, pck.league_id, pck.game_id, pck.game_key, gms.week,
+        CASE
+            WHEN scr.away_score > scr.home_score AND pck.pick_team_id = gms.away_team_id THEN 1
+            WHEN scr.away_score < scr.home_score AND pck.pick_team_id = gms.home_team_id THEN 1
+            ELSE 0
+        END AS correct_pick_flag
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    JOIN nfl_game_scores_2022 scr
+        ON pck.game_key = scr.game_key
+    WHERE pck.game_key = ANY(%(game_key_list)s)
+    ON CONFLICT (league_id, user_id, game_key) DO UPDATE SET
+    (week, correct_pick_flag) = (EXCLUDED.week, EXCLUDED.correct_pick_flag)
+    WHERE user_winning_picks.correct_pick_flag IS DISTINCT FROM EXCLUDED.correct_pick_flag
+    ;
+"""
+
+# Weekly Picks: picks and grading
+USER_WEEKLY_PICKS_QUERY = """
+    SELECT game_id, winning_pick
+    FROM user_weekly_picks
+    WHERE league_id = %(league_id)s AND user_id = %(user_id)s
+    ;
+"""
+# Every pick of a league for a game with a final score, with whether it was right. Ties grade as wrong
+GRADED_PICKS_QUERY = """
+    WITH nfl_game_winners AS (
+        SELECT scr.game_key, gms.week,
+            CASE
+                WHEN scr.away_score > scr.home_score THEN gms.away_team_id
+                WHEN scr.away_score < scr.home_score THEN gms.home_team_id
+            END AS winning_team_id
+        FROM nfl_game_scores_2022 scr
+        JOIN nfl_games gms
+            ON scr.game_key = gms.game_key
+    )
+    SELECT usr.user_id_game_id, usr.user_id, usr.league_id, usr.game_id, usr.game_key, nfl.week,
+        CASE
+            WHEN usr.pick_team_id = nfl.winning_team_id THEN 1
+            ELSE 0
+        END AS correct_pick_flag
+    FROM nfl_game_winners nfl
+    JOIN user_weekly_picks usr
+        ON nfl.game_key = usr.game_key
+    WHERE usr.league_id = %(league_id)s
+    ;
+"""
+INSERT_USER_WINNING_PICK_QUERY = """
+    INSERT INTO user_winning_picks (user_id_game_id, user_id, league_id, game_id, game_key, week, correct_pick_flag)
+    VALUES (%(user_id_game_id)s, %(user_id)s, %(league_id)s, %(game_id)s, %(game_key)s, %(week)s,
+            %(correct_pick_flag)s)
+    ON CONFLICT (league_id, user_id, game_key) DO UPDATE SET
+    (week, correct_pick_flag) = (EXCLUDED.week, EXCLUDED.correct_pick_flag)
+    ;
+"""
+
+# Analytics
+USER_WEEKS_PREDICTION_PCT_QUERY = """
+    SELECT week,
+        COUNT(week) AS played_games,
+        SUM(correct_pick_flag) AS correct_picks,
+        (CAST(SUM(correct_pick_flag) AS float) / CAST(COUNT(week) AS float)) AS pct_correct
+    FROM user_winning_picks
+    WHERE league_id = %(league_id)s AND user_id = %(user_id)s
+    GROUP BY week
+    ORDER BY week
+    ;
+"""
+# Every pick of a user with the game's teams and whether it was right, 0 until the game has a final score
+USER_PICKS_WITH_WIN_QUERY = """
+    WITH user_picks AS (
+        SELECT game_key, game_id, winning_pick, pick_team_id
+        FROM user_weekly_picks
+        WHERE league_id = %(league_id)s AND user_id = %(user_id)s
+    ),
+        nfl_game_scores AS (
+        SELECT scr.game_key, scr.away_team, scr.home_team,
+            CASE
+                WHEN scr.home_score > scr.away_score THEN gms.home_team_id
+                WHEN scr.home_score < scr.away_score THEN gms.away_team_id
+                ELSE NULL
+            END AS nfl_winning_team_id
+        FROM nfl_game_scores_2022 scr
+        JOIN nfl_games gms
+            ON scr.game_key = gms.game_key
+    )
+    SELECT usr.game_id, nfl.away_team, nfl.home_team, usr.winning_pick,
+        CASE
+            WHEN usr.pick_team_id = nfl.nfl_winning_team_id THEN 1
+            ELSE 0
+        END AS correct_or_not
+    FROM user_picks usr
+    LEFT JOIN nfl_game_scores nfl
+        ON usr.game_key = nfl.game_key
+    ;
+"""
+USERNAMES_QUERY = """
+    SELECT user_id, username
+    FROM users
+    WHERE user_id = ANY(%(user_id_list)s)
+    ;
+"""
+
+# Leaderboard
+# Each week's share is of every game scheduled that week in nfl_games
+PCT_CORRECT_BY_WEEK_QUERY = """
+    WITH nfl_games_per_week AS (
+        SELECT
+            week,
+            COUNT(game_key) AS count_of_games
+        FROM
+             nfl_games
+        WHERE season = %(season)s
+        GROUP BY 1
+    ),
+        won_by_week AS(
+        SELECT
+            user_id,
+            week,
+            CAST(SUM(correct_pick_flag) AS numeric) AS correct_picks
+        FROM user_winning_picks
+        WHERE league_id = %(league_id)s AND user_id = ANY(%(user_id_list)s)
+        GROUP BY 1, 2
+    ),
+        pct_won_by_week AS (
+        SELECT
+            (SELECT usr.username FROM users usr WHERE usr.user_id = won.user_id) AS username,
+            won.week,
+            won.correct_picks,
+            ROUND((won.correct_picks / nfl.count_of_games), 3) AS pct_correct
+        FROM
+            won_by_week won
+        LEFT JOIN
+            nfl_games_per_week nfl
+            ON won.week = nfl.week
+    )
+    SELECT * FROM pct_won_by_week
+    ORDER BY 2, 1
+    ;
+"""
+# Usernames are looked up one primary key probe per member, so the cost follows the league size and not the user base
+LEAGUE_USERNAMES_QUERY = """
+    SELECT mbr.user_id, (SELECT usr.username FROM users usr WHERE usr.user_id = mbr.user_id) AS username
+    FROM league_members mbr
+    WHERE mbr.league_id = %(league_id)s
+    ;
+"""
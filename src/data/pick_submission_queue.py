@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import threading
+
+import pytz
+from psycopg2.extras import execute_values
+
+
+EASTERN_TIMEZONE = pytz.timezone("US/Eastern")
+FLUSH_INTERVAL_SECONDS = 0.25
+MAX_BATCH_SIZE = 500
+# Each submitted pick with the pick already stored and whether its game has kicked off by the flush. Every submitted
+# row comes back, with a NULL game_key when the game isn't in nfl_games
+CURRENT_PICKS_QUERY = """
+    SELECT sub.league_id, sub.user_id, sub.game_id, gms.game_key, pck.winning_pick,
+           COALESCE(gms.kickoff <= %(flush_time)s, FALSE) AS locked
+    FROM (VALUES %%s) AS sub (league_id, user_id, game_id)
+    LEFT JOIN nfl_games gms
+        ON sub.game_id = gms.game_id
+    LEFT JOIN user_weekly_picks pck
+        ON pck.league_id = sub.league_id AND pck.user_id = sub.user_id AND pck.game_key = gms.game_key
+    ;
+"""
+UPSERT_PICKS_QUERY = """
+    INSERT INTO user_weekly_picks (user_id_game_id, user_id, league_id, game_id, winning_pick, timestamp_added,
+                                   game_key, pick_team_id)
+    SELECT sub.user_id || '_' || sub.game_id, sub.user_id, sub.league_id, sub.game_id, sub.winning_pick,
+           sub.timestamp_added, gms.game_key, tms.team_id
+    FROM (VALUES %s) AS sub (league_id, user_id, game_id, winning_pick, timestamp_added)
+    JOIN nfl_games gms
+        ON sub.game_id = gms.game_id
+    JOIN nfl_teams tms
+        ON sub.winning_pick = tms.team_abbr
+    ON CONFLICT (league_id, user_id, game_key) DO UPDATE SET
+    (winning_pick, pick_team_id, timestamp_added) = (EXCLUDED.winning_pick, EXCLUDED.pick_team_id,
+                                                     EXCLUDED.timestamp_added)
+    ;
+"""
+
+
+def make_eastern_now():
+    """
+    Function returns the current time in US/Eastern, the schedule's timezone
+    :return: Aware datetime
+    """
+    return datetime.datetime.now(tz=EASTERN_TIMEZONE)
+
+
+class PickSubmission:
+    """
+    Class is the receipt of one submission. It is settled once the submission's picks are committed. When a later
+    submission of the same player in the same league is merged into it before then, it is settled with that
+    submission, superseded and without the changed picks, so they are only reported once
+    """
+
+    def __init__(self, league_id, user_id, pick_dict, submitted_at):
+        self.league_id = league_id
+        self.user_id = user_id
+        self.pick_dict = pick_dict
+        self.submitted_at = submitted_at
+        self.changed_pick_list = list()
+        self.locked_game_id_list = list()
+        self.rejected_game_id_list = list()
+        self.superseded = False
+        self.error = None
+        self.superseded_submission_list = list()
+        self._settled = threading.Event()
+
+    def settle(self, changed_pick_list=None, locked_game_id_list=None, rejected_game_id_list=None, superseded=False,
+               error=None):
+        """
+        Function records the outcome of the submission, settles the submissions it superseded and wakes its waiters
+        :param changed_pick_list: list of (game_id, previous pick, new pick) tuples written
+        :param locked_game_id_list: games whose pick wasn't changed because they had kicked off
+        :param rejected_game_id_list: games whose pick wasn't written because they aren't in nfl_games
+        :param superseded: True if a later submission replaced this one
+        :param error: exception the flush failed with
+        :return: None
+        """
+        self.changed_pick_list = changed_pick_list or list()
+        self.locked_game_id_list = locked_game_id_list or list()
+        self.rejected_game_id_list = rejected_game_id_list or list()
+        self.superseded = superseded
+        self.error = error
+        for superseded_submission in self.superseded_submission_list:
+            superseded_submission.settle(locked_game_id_list=self.locked_game_id_list,
+                                         rejected_game_id_list=self.rejected_game_id_list, superseded=True,
+                                         error=error)
+        self._settled.set()
+        return None
+
+    def wait(self, timeout=None):
+        """
+        Function waits until the submission is settled
+        :param timeout: seconds to wait
+        :return: True if it was settled in time
+        """
+        return self._settled.wait(timeout)
+
+
+class PickSubmissionQueue:
+    """
+    Class is an in-process write-behind queue for pick submissions. Submissions wait at most flush_interval_seconds,
+    and a player's pending submission in a league is merged into their later one, so repeated clicks collapse into one
+    write of the latest pick of every game. A background thread flushes up to max_batch_size players per transaction:
+    their stored picks are read in one query, and the changed picks of games which haven't kicked off by the flush are
+    upserted in one statement. Picks of games missing from nfl_games are rejected. A submission is only settled once
+    its transaction commits
+    """
+
+    def __init__(self, database, flush_interval_seconds=FLUSH_INTERVAL_SECONDS, max_batch_size=MAX_BATCH_SIZE,
+                 make_now=make_eastern_now):
+        self.database = database
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_batch_size = max_batch_size
+        self.make_now = make_now
+        self.flushed_batch_count = 0
+        self.written_pick_count = 0
+        self._condition = threading.Condition()
+        self._pending_dict = dict()
+        self._thread = None
+
+    def submit(self, league_id, user_id, pick_dict):
+        """
+        Function queues a player's picks. A pending submission of theirs in the league is merged into the new one,
+        which keeps its picks of the games the new one doesn't pick, and is settled when the new one is
+        :param league_id: league id key
+        :param user_id: user id key
+        :param pick_dict: Dictionary with game_id as a key and the picked team as a value
+        :return: PickSubmission object
+        """
+        with self._condition:
+            superseded_submission = self._pending_dict.pop((league_id, user_id), None)
+            if superseded_submission is None:
+                submission = PickSubmission(league_id, user_id, dict(pick_dict), datetime.datetime.now())
+            else:
+                submission = PickSubmission(league_id, user_id, dict(superseded_submission.pick_dict, **pick_dict),
+                                            datetime.datetime.now())
+                submission.superseded_submission_list = (superseded_submission.superseded_submission_list +
+                                                         [superseded_submission])
+                superseded_submission.superseded_submission_list = list()
+            self._pending_dict[(league_id, user_id)] = submission
+            if len(self._pending_dict) >= self.max_batch_size:
+                self._condition.notify()
+        return submission
+
+    def _take_batch(self):
+        with self._condition:
+            key_list = list(self._pending_dict)[:self.max_batch_size]
+            return [self._pending_dict.pop(key) for key in key_list]
+
+    def make_flush_operation(self, submission_list, flush_time):
+        """
+        Function makes the operation writing a batch of submissions in one transaction, for
+        DatabaseConnectionManager.run
+        :param submission_list: list of PickSubmission objects, at most one per player and league
+        :param flush_time: aware datetime games must kick off after for their pick to change
+        :return: callable taking a psycopg2 connection and returning a Dictionary of (changed picks, locked games,
+                 rejected games) by (league_id, user_id)
+        """
+        def operation(con):
+            outcome_dict = {(submission.league_id, submission.user_id): (list(), list(), list())
+                            for submission in submission_list}
+            submitted_row_list = [(submission.league_id, submission.user_id, game_id)
+                                  for submission in submission_list for game_id in submission.pick_dict]
+            submission_dict = {(submission.league_id, submission.user_id): submission
+                               for submission in submission_list}
+            upsert_row_list = list()
+            if not submitted_row_list:
+                con.rollback()
+                return outcome_dict
+            with con.cursor() as cursor:
+                current_pick_list = execute_values(cursor, cursor.mogrify(CURRENT_PICKS_QUERY,
+                                                                          {"flush_time": flush_time}).decode(),
+                                                   submitted_row_list, fetch=True, page_size=len(submitted_row_list))
+                for league_id, user_id, game_id, game_key, current_pick, locked in current_pick_list:
+                    submission = submission_dict[(league_id, user_id)]
+                    new_pick = submission.pick_dict[game_id]
+                    changed_pick_list, locked_game_id_list, rejected_game_id_list = outcome_dict[(league_id, user_id)]
+                    if game_key is None:
+                        rejected_game_id_list.append(game_id)
+                        continue
+                    if new_pick == current_pick:
+                        continue
+                    if locked:
+                        locked_game_id_list.append(game_id)
+                        continue
+                    changed_pick_list.append((game_id, current_pick, new_pick))
+                    upsert_row_list.append((league_id, user_id, game_id, new_pick, submission.submitted_at))
+                if upsert_row_list:
+                    execute_values(cursor, UPSERT_PICKS_QUERY, upsert_row_list, page_size=len(upsert_row_list))
+            con.commit()
+            return outcome_dict
+        return operation
+
+    def flush(self):
+        """
+        Function writes up to max_batch_size pending submissions in one transaction and settles them
+        :return: Number of submissions flushed
+        """
+        submission_list = self._take_batch()
+        if not submission_list:
+            return 0
+        try:
+            outcome_dict = self.database.run(self.make_flush_operation(submission_list, self.make_now()))
+        except Exception as error:
+            logging.getLogger(__name__).exception("could not flush %s pick submissions", len(submission_list))
+            for submission in submission_list:
+                submission.settle(error=error)
+            return len(submission_list)
+        for submission in submission_list:
+            changed_pick_list, locked_game_id_list, rejected_game_id_list = outcome_dict[(submission.league_id,
+                                                                                          submission.user_id)]
+            if rejected_game_id_list:
+                logging.getLogger(__name__).warning("rejected picks of user %s for games not in nfl_games: %s",
+                                                    submission.user_id, rejected_game_id_list)
+            submission.settle(changed_pick_list, locked_game_id_list, rejected_game_id_list)
+            self.written_pick_count += len(changed_pick_list)
+        self.flushed_batch_count += 1
+        return len(submission_list)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending_dict) < self.max_batch_size:
+                    self._condition.wait(self.flush_interval_seconds)
+            while self.flush() == self.max_batch_size:
+                pass
+
+    def start(self):
+        """
+        Function starts the background flushing thread, once
+        :return: PickSubmissionQueue object
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pick-submission-queue", daemon=True)
+            self._thread.start()
+        return self
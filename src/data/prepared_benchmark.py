@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+import click
+import numpy as np
+import psycopg2
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.database import DatabaseConnectionManager, DatabaseUnavailableError, make_connection_kwargs_from_env
+from src.data.explain_check import make_benchmark_schema
+from src.data.page_queries import USER_WEEKLY_PICKS_QUERY, USER_WEEKS_PREDICTION_PCT_QUERY
+from src.features.league_standings import LEADERBOARD_PAGE_QUERY, LEADERBOARD_PAGE_SIZE
+
+
+PREPARED_BENCHMARK_SCHEMA = "prepared_benchmark"
+# The statements the pages prepare, under the names they prepare them with, and the parameters of one call. Picks are
+# written by the pick submission queue in batches, not by a per-session statement
+HOT_QUERY_DICT = {"user_weekly_picks": (USER_WEEKLY_PICKS_QUERY, {"league_id": 1, "user_id": 1}),
+                  "leaderboard_page": (LEADERBOARD_PAGE_QUERY, {"league_id": 1, "after_rank": 0, "after_user_id": 0,
+                                                                "page_size": LEADERBOARD_PAGE_SIZE}),
+                  "user_weeks_prediction_pct": (USER_WEEKS_PREDICTION_PCT_QUERY, {"league_id": 1, "user_id": 1})}
+MODE_LIST = ["plain", "prepared"]
+
+
+def make_hot_query_params(name, params, user_id, league_count):
+    """
+    Function points a hot query's parameters at one user and their league
+    :param name: statement name in HOT_QUERY_DICT
+    :param params: the statement's parameters in HOT_QUERY_DICT
+    :param user_id: seeded user id
+    :param league_count: number of seeded leagues
+    :return: Dictionary of query parameters
+    """
+    league_id = 1 + (user_id - 1) % league_count
+    hot_query_params = dict(params, league_id=league_id)
+    if "user_id" in params:
+        hot_query_params["user_id"] = user_id
+    return hot_query_params
+
+
+def run_hot_query_calls(database, mode, call_list, latency_dict, error_dict, lock):
+    """
+    Function runs hot queries one after the other, plain or as prepared statements, and records each one's latency.
+    Calls which can't get a connection are counted rather than raised
+    :param database: DatabaseConnectionManager object with the hot queries prepared
+    :param mode: plain or prepared
+    :param call_list: list of (query name, params) tuples
+    :param latency_dict: Dictionary of latency lists by (mode, query name), updated in place
+    :param error_dict: Dictionary of error counts by (mode, query name), updated in place
+    :param lock: threading.Lock object guarding latency_dict and error_dict
+    :return: None
+    """
+    for name, params in call_list:
+        start = time.perf_counter()
+        try:
+            if mode == "plain":
+                database.fetchall(HOT_QUERY_DICT[name][0], params)
+            else:
+                database.fetchall_prepared(name, params)
+        except DatabaseUnavailableError:
+            with lock:
+                error_dict[(mode, name)] += 1
+            continue
+        elapsed = time.perf_counter() - start
+        with lock:
+            latency_dict[(mode, name)].append(elapsed)
+    return None
+
+
+def pipeline_prepared_benchmark(connection_kwargs, thread_count, call_count, user_count, max_connections):
+    """
+    Function runs the hot queries from thread_count threads through one DatabaseConnectionManager, first as plain
+    queries then as prepared statements on a fresh pool, so both modes pay for opening their connections
+    :param connection_kwargs: psycopg2 connection arguments pointing at the seeded schema
+    :param thread_count: number of concurrent threads
+    :param call_count: hot query calls per thread and mode
+    :param user_count: number of seeded users
+    :param max_connections: connection pool size
+    :return: List of (query name, plain p50 ms, plain p95 ms, prepared p50 ms, prepared p95 ms, p50 ms saved,
+             errors)
+    """
+    con = psycopg2.connect(**connection_kwargs)
+    try:
+        with con, con.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM leagues;")
+            league_count = cursor.fetchone()[0]
+    finally:
+        con.close()
+    latency_dict = defaultdict(list)
+    error_dict = defaultdict(int)
+    lock = threading.Lock()
+    for mode in MODE_LIST:
+        database = DatabaseConnectionManager(connection_kwargs, max_connections=max_connections)
+        for name in HOT_QUERY_DICT:
+            database.prepare(name, HOT_QUERY_DICT[name][0])
+        thread_list = list()
+        for thread_index in range(thread_count):
+            # Same seed in both modes, so each runs exactly the same calls
+            thread_random = random.Random(thread_index)
+            call_list = [(name, make_hot_query_params(name, HOT_QUERY_DICT[name][1],
+                                                      thread_random.randint(1, user_count), league_count))
+                         for name in thread_random.choices(list(HOT_QUERY_DICT), k=call_count)]
+            thread_list.append(threading.Thread(target=run_hot_query_calls,
+                                                args=(database, mode, call_list, latency_dict, error_dict,
+                                                      lock)))
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+    report_row_list = list()
+    for name in HOT_QUERY_DICT:
+        plain_p50, plain_p95 = np.percentile(np.array(latency_dict[("plain", name)]) * 1000, [50, 95])
+        prepared_p50, prepared_p95 = np.percentile(np.array(latency_dict[("prepared", name)]) * 1000, [50, 95])
+        report_row_list.append((name, plain_p50, plain_p95, prepared_p50, prepared_p95, plain_p50 - prepared_p50,
+                                error_dict[("plain", name)] + error_dict[("prepared", name)]))
+    return report_row_list
+
+
+@click.command()
+@click.option("--threads", "thread_count", type=int, default=50, help="Number of concurrent threads.")
+@click.option("--calls", "call_count", type=int, default=200, help="Hot query calls per thread and mode.")
+@click.option("--user-count", type=int, default=5000, help="Number of users seeded before the benchmark.")
+@click.option("--max-connections", type=int, default=10,
+              help="Connection pool size, the app's DatabaseConnectionManager default.")
+@click.option("--keep-schema", is_flag=True, help="Leave the seeded prepared_benchmark schema in place afterwards.")
+def main(thread_count, call_count, user_count, max_connections, keep_schema):
+    """ Times the hot page queries run plain and as prepared statements from many threads sharing one pool, against a
+        seeded scratch schema, and reports the latency saved per query.
+    """
+    logger = logging.getLogger(__name__)
+    connection_kwargs = make_connection_kwargs_from_env()
+    con = psycopg2.connect(**connection_kwargs)
+    try:
+        logger.info("seeding %s users into the %s schema", user_count, PREPARED_BENCHMARK_SCHEMA)
+        make_benchmark_schema(con, PREPARED_BENCHMARK_SCHEMA, user_count)
+        logger.info("running %s calls from each of %s threads over a %s connection pool", call_count, thread_count,
+                    max_connections)
+        report_row_list = pipeline_prepared_benchmark(
+            dict(connection_kwargs, options="-c search_path=" + PREPARED_BENCHMARK_SCHEMA), thread_count,
+            call_count, user_count, max_connections)
+    finally:
+        con.rollback()
+        if not keep_schema:
+            with con, con.cursor() as cursor:
+                cursor.execute("DROP SCHEMA IF EXISTS " + PREPARED_BENCHMARK_SCHEMA + " CASCADE;")
+        con.close()
+    click.echo("{:<36} {:>10} {:>10} {:>13} {:>13} {:>9} {:>7}".format(
+        "query", "plain p50", "plain p95", "prepared p50", "prepared p95", "saved", "errors"))
+    for name, plain_p50, plain_p95, prepared_p50, prepared_p95, saved, error_count in report_row_list:
+        click.echo("{:<36} {:>10.2f} {:>10.2f} {:>13.2f} {:>13.2f} {:>9.2f} {:>7}".format(
+            name, plain_p50, plain_p95, prepared_p50, prepared_p95, saved, error_count))
+    click.echo("latencies in ms, saved is the p50 difference")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
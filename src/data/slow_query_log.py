@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import click
+import pandas as pd
+import psycopg2
+from psycopg2 import extensions
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+SLOW_QUERY_LOG_FILEPATH = PROJECT_DIR / "reports" / "slow_queries.jsonl"
+SLOW_QUERY_THRESHOLD_MS = 200
+# Each query is explained at most once per cooldown, so a query which is always slow doesn't fill the log with plans
+EXPLAIN_COOLDOWN_SECONDS = 300
+EXPLAIN_SAVEPOINT = "slow_query_explain"
+# Frames from these packages are skipped when looking for the page function which ran the query
+LIBRARY_PATH_PATTERN = re.compile(r"[/\\](psycopg2|pandas|threading|slow_query_log|database)[/\\.]")
+# Every page's log appends to the same file, and a line with a plan is longer than a single atomic write
+LOG_FILE_LOCK = threading.Lock()
+
+
+def make_query_fingerprint(query):
+    """
+    Function identifies a query by its text with whitespace collapsed, so the same query from any call site groups
+    together
+    :param query: SQL query
+    :return: Hex digest
+    """
+    return hashlib.md5(" ".join(query.split()).encode("utf-8")).hexdigest()[:12]
+
+
+def make_redacted_params(params):
+    """
+    Function replaces every query parameter value with its type name, so the log never holds user data (passwords,
+    emails) but still shows how the query was called
+    :param params: query parameters, a dictionary or a sequence
+    :return: Dictionary or list of type names
+    """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def make_caller_name():
+    """
+    Function returns the innermost function outside the database libraries on the current stack, i.e. the page
+    function which ran the query
+    :return: file:function string
+    """
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if not LIBRARY_PATH_PATTERN.search(frame.filename):
+            return "{}:{}".format(Path(frame.filename).name, frame.name)
+    return None
+
+
+class SlowQueryLog:
+    """
+    Class appends the queries slower than threshold_ms to a JSON lines file, with their redacted parameters,
+    duration, calling function and its EXPLAIN plan. Shared by every connection of a process
+    """
+
+    def __init__(self, filepath=SLOW_QUERY_LOG_FILEPATH, threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+                 explain_cooldown_seconds=EXPLAIN_COOLDOWN_SECONDS):
+        self.filepath = Path(filepath)
+        self.threshold_ms = threshold_ms
+        self.explain_cooldown_seconds = explain_cooldown_seconds
+        self._lock = threading.Lock()
+        self._explained_at_dict = dict()
+
+    def should_explain(self, fingerprint):
+        """
+        Function claims the right to explain a query, at most once per cooldown
+        :param fingerprint: value returned by make_query_fingerprint
+        :return: True if the caller should explain it
+        """
+        with self._lock:
+            explained_at = self._explained_at_dict.get(fingerprint)
+            if explained_at is not None and time.monotonic() - explained_at < self.explain_cooldown_seconds:
+                return False
+            self._explained_at_dict[fingerprint] = time.monotonic()
+        return True
+
+    def record(self, query, params, duration_ms, plan=None, explain_error=None):
+        """
+        Function appends a slow query to the log
+        :param query: SQL query
+        :param params: query parameters, redacted before they are written
+        :param duration_ms: milliseconds the query took
+        :param plan: EXPLAIN (FORMAT JSON) plan, if the query was explained
+        :param explain_error: why the query couldn't be explained
+        :return: None
+        """
+        slow_query = {"logged_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "fingerprint": make_query_fingerprint(query),
+                      "caller": make_caller_name(), "duration_ms": round(duration_ms, 3),
+                      "query": " ".join(query.split()), "params": make_redacted_params(params), "plan": plan,
+                      "explain_error": explain_error}
+        line = json.dumps(slow_query, default=str) + "\n"
+        with LOG_FILE_LOCK:
+            self.filepath.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.filepath, "a", encoding="utf-8") as slow_query_file:
+                slow_query_file.write(line)
+        logging.getLogger(__name__).warning("slow query from %s took %.0fms", slow_query["caller"], duration_ms)
+        return None
+
+
+def make_explained_plan(con, query, params):
+    """
+    Function runs EXPLAIN of a query, which plans it without running it again, inside a savepoint which is then rolled
+    back so a query which can't be explained doesn't abort the transaction
+    :param con: psycopg2 connection object, not in autocommit
+    :param query: SQL query
+    :param params: query parameters
+    :return: EXPLAIN (FORMAT JSON) plan, or None and the error
+    """
+    with con.cursor(cursor_factory=extensions.cursor) as cursor:
+        cursor.execute("SAVEPOINT " + EXPLAIN_SAVEPOINT + ";")
+        try:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan, explain_error = cursor.fetchone()[0], None
+        except psycopg2.Error as error:
+            plan, explain_error = None, str(error).strip()
+        cursor.execute("ROLLBACK TO SAVEPOINT " + EXPLAIN_SAVEPOINT + ";")
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    if explain_error is None and not isinstance(plan, list):
+        # Several statements in one query, the row is the last statement's
+        plan, explain_error = None, "not a single statement"
+    return plan, explain_error
+
+
+def make_timed_cursor_factory(slow_query_log):
+    """
+    Function makes a psycopg2 cursor class timing every execute, for the cursor_factory connection argument. Queries
+    slower than the log's threshold are explained and recorded once they have run
+    :param slow_query_log: SlowQueryLog object
+    :return: psycopg2 cursor class
+    """
+    class TimedCursor(extensions.cursor):
+
+        def execute(self, query, params=None):
+            start = time.perf_counter()
+            returned_value = super().execute(query, params)
+            duration_ms = (time.perf_counter() - start) * 1000
+            if duration_ms >= slow_query_log.threshold_ms:
+                self._record_slow_query(query, params, duration_ms)
+            return returned_value
+
+        def _record_slow_query(self, query, params, duration_ms):
+            if isinstance(query, bytes):
+                query = query.decode(self.connection.encoding)
+            plan, explain_error = None, None
+            if self.connection.autocommit:
+                explain_error = "not explained, autocommit connection"
+            elif slow_query_log.should_explain(make_query_fingerprint(query)):
+                try:
+                    plan, explain_error = make_explained_plan(self.connection, query, params)
+                except psycopg2.Error as error:
+                    explain_error = str(error).strip()
+            try:
+                slow_query_log.record(query, params, duration_ms, plan, explain_error)
+            except OSError:
+                logging.getLogger(__name__).exception("could not write the slow query log")
+
+    return TimedCursor
+
+
+def read_slow_query_log_df(filepath):
+    """
+    Function reads a slow query log
+    :param filepath: path of the JSON lines log
+    :return: Dataframe with a row per slow query
+    """
+    return pd.read_json(filepath, lines=True, dtype={"duration_ms": "float64"})
+
+
+def make_worst_offenders_df(slow_query_df, top):
+    """
+    Function ranks queries by the total time they spent above the threshold, with the latest plan of each
+    :param slow_query_df: Dataframe returned by read_slow_query_log_df
+    :param top: number of queries returned
+    :return: Dataframe with fingerprint, caller, calls, total_ms, p50_ms, max_ms, query and plan columns
+    """
+    worst_offenders_df = slow_query_df.groupby("fingerprint").agg(
+        caller=("caller", "last"), calls=("duration_ms", "size"), total_ms=("duration_ms", "sum"),
+        p50_ms=("duration_ms", "median"), max_ms=("duration_ms", "max"), query=("query", "last"))
+    explained_df = slow_query_df[slow_query_df["plan"].notna()].groupby("fingerprint")["plan"].last()
+    worst_offenders_df["plan"] = explained_df.reindex(worst_offenders_df.index)
+    return worst_offenders_df.sort_values("total_ms", ascending=False).head(top).reset_index()
+
+
+def make_plan_text(plan, depth=0):
+    """
+    Function renders an EXPLAIN (FORMAT JSON) plan as an indented tree of node types, relations and the planner's
+    cost and row estimates
+    :param plan: a plan node, or the list EXPLAIN returns
+    :param depth: indentation level
+    :return: string
+    """
+    if isinstance(plan, list):
+        plan = plan[0]["Plan"]
+    relation = " on {}".format(plan["Relation Name"]) if "Relation Name" in plan else ""
+    if "Index Name" in plan:
+        relation += " using {}".format(plan["Index Name"])
+    line = "{}{}{}  cost={:.2f}..{:.2f} rows={}".format(
+        "  " * depth + ("-> " if depth else ""), plan["Node Type"], relation, plan.get("Startup Cost", 0),
+        plan.get("Total Cost", 0), plan.get("Plan Rows"))
+    return "\n".join([line] + [make_plan_text(child, depth + 1) for child in plan.get("Plans", [])])
+
+
+@click.command()
+@click.option("--log-filepath", type=click.Path(exists=True, dir_okay=False), default=str(SLOW_QUERY_LOG_FILEPATH),
+              help="Slow query log to summarise.")
+@click.option("--top", type=int, default=10, help="Number of queries listed.")
+@click.option("--show-plans", is_flag=True, help="Print the latest plan of each query.")
+def main(log_filepath, top, show_plans):
+    """ Lists the queries which spent the most time above the slow query threshold, worst first.
+    """
+    slow_query_df = read_slow_query_log_df(log_filepath)
+    worst_offenders_df = make_worst_offenders_df(slow_query_df, top)
+    click.echo("{:<12} {:<48} {:>6} {:>10} {:>9} {:>9}".format("fingerprint", "caller", "calls", "total ms",
+                                                              "p50 ms", "max ms"))
+    for row in worst_offenders_df.itertuples(index=False):
+        click.echo("{:<12} {:<48} {:>6} {:>10.0f} {:>9.0f} {:>9.0f}".format(
+            row.fingerprint, str(row.caller)[:48], row.calls, row.total_ms, row.p50_ms, row.max_ms))
+        if show_plans:
+            click.echo("  " + row.query)
+            if isinstance(row.plan, list):
+                click.echo("  " + make_plan_text(row.plan).replace("\n", "\n  "))
+            click.echo("")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
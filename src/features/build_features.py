@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+TEAM_FORM_DIR = PROJECT_DIR / "data" / "processed" / "team_form"
+MANIFEST_FILENAME = "manifest.json"
+# Bump when make_week_team_form_df changes, so every week is computed again
+FORM_VERSION = 1
+# Rolling form covers the last FORM_WEEKS weeks, byes included
+FORM_WEEKS = 4
+RESULT_COLUMN_LIST = ["game_id", "season", "week", "away_team", "home_team", "away_rest", "home_rest", "spread_line",
+                      "away_score", "home_score"]
+# Running totals each partition stores, from which any window is the difference of two partitions
+COUNT_COLUMN_LIST = ["games", "wins", "losses", "ties", "points_for", "points_against", "rest_days", "ats_games",
+                     "covers"]
+FORM_COUNT_COLUMN_LIST = ["form_" + column for column in COUNT_COLUMN_LIST]
+SCORE_TABLE_QUERY = "SELECT game_id, away_score, home_score FROM nfl_game_scores_2022;"
+
+
+def make_season_results_df(schedule_df, score_dict=None):
+    """
+    Function takes a season's games with their spread and rest from the schedule and their scores from the score
+    table when one is given, as the score table is written as soon as games go final
+    :param schedule_df: Dataframe with an nflverse schedule, or any frame with game_id, season, week, teams, rest and
+                        spread_line columns
+    :param score_dict: Dictionary holding game_id as key and (away_score, home_score) as value, or None to use the
+                       schedule's scores alone
+    :return: Dataframe with the RESULT_COLUMN_LIST columns, unplayed games with missing scores
+    """
+    season_results_df = schedule_df.reindex(columns=RESULT_COLUMN_LIST).copy()
+    for column in ["away_team", "home_team"]:
+        season_results_df[column] = season_results_df[column].astype(str)
+    if score_dict is not None:
+        score_df = pd.DataFrame.from_dict(score_dict, orient="index", columns=["away_score", "home_score"])
+        score_df = score_df.reindex(season_results_df["game_id"]).set_index(season_results_df.index)
+        for column in ["away_score", "home_score"]:
+            season_results_df[column] = score_df[column].astype("float64").fillna(season_results_df[column])
+    return season_results_df
+
+
+def make_team_games_df(week_results_df):
+    """
+    Function turns scored games into one row per team and game. nflverse spread_line is the home team's expected
+    margin, so a team covers when its margin beats its side of the spread. Pushes and games without a spread aren't
+    against the spread games
+    :param week_results_df: Dataframe with RESULT_COLUMN_LIST columns
+    :return: Dataframe with team and COUNT_COLUMN_LIST columns
+    """
+    scored_df = week_results_df[week_results_df["away_score"].notna() & week_results_df["home_score"].notna()]
+    home_margin = (scored_df["home_score"] - scored_df["away_score"]).to_numpy(dtype=np.float64)
+    spread_line = scored_df["spread_line"].to_numpy(dtype=np.float64)
+    ats_game = ~np.isnan(spread_line) & (home_margin != spread_line)
+    side_list = list()
+    for team, points_for, points_against, rest_days, margin, spread in [
+            ("home_team", "home_score", "away_score", "home_rest", home_margin, spread_line),
+            ("away_team", "away_score", "home_score", "away_rest", -home_margin, -spread_line)]:
+        side_list.append(pd.DataFrame({"team": scored_df[team].to_numpy(), "games": 1, "wins": margin > 0,
+                                       "losses": margin < 0, "ties": margin == 0,
+                                       "points_for": scored_df[points_for].to_numpy(),
+                                       "points_against": scored_df[points_against].to_numpy(),
+                                       "rest_days": scored_df[rest_days].fillna(0).to_numpy(),
+                                       "ats_games": ats_game, "covers": ats_game & (margin > spread)}))
+    return pd.concat(side_list, ignore_index=True).astype(dict.fromkeys(COUNT_COLUMN_LIST, "int64"))
+
+
+def make_rate(numerator, denominator):
+    """
+    Function divides two columns, leaving NaN where the denominator is 0
+    :param numerator: Series
+    :param denominator: Series
+    :return: float32 Series
+    """
+    return (numerator / denominator.where(denominator != 0)).astype("float32")
+
+
+def make_week_team_form_df(season, week, cumulative_df, window_start_df):
+    """
+    Function makes a week's partition: every team's running totals through the week's results, their totals over
+    the last FORM_WEEKS weeks and the rates read off both. Use a week's partition as the form going into the next week
+    :param season: NFL season
+    :param week: NFL week number
+    :param cumulative_df: Dataframe of COUNT_COLUMN_LIST running totals through the week, indexed by team
+    :param window_start_df: Dataframe of COUNT_COLUMN_LIST running totals through the week before the window
+    :return: Dataframe
+    """
+    form_df = (cumulative_df - window_start_df.reindex(cumulative_df.index, fill_value=0))
+    form_df.columns = FORM_COUNT_COLUMN_LIST
+    week_team_form_df = pd.concat([cumulative_df, form_df], axis=1).astype("int16")
+    for prefix in ["", "form_"]:
+        games = week_team_form_df[prefix + "games"]
+        week_team_form_df[prefix + "win_pct"] = make_rate(week_team_form_df[prefix + "wins"] +
+                                                          week_team_form_df[prefix + "ties"] / 2, games)
+        week_team_form_df[prefix + "points_for_per_game"] = make_rate(week_team_form_df[prefix + "points_for"], games)
+        week_team_form_df[prefix + "points_against_per_game"] = make_rate(week_team_form_df[prefix +
+                                                                                            "points_against"], games)
+        week_team_form_df[prefix + "rest_days_per_game"] = make_rate(week_team_form_df[prefix + "rest_days"], games)
+        week_team_form_df[prefix + "cover_rate"] = make_rate(week_team_form_df[prefix + "covers"],
+                                                             week_team_form_df[prefix + "ats_games"])
+    week_team_form_df = week_team_form_df.rename_axis("team").reset_index()
+    week_team_form_df.insert(0, "week", np.int8(week))
+    week_team_form_df.insert(0, "season", np.int16(season))
+    return week_team_form_df
+
+
+def make_week_results_hash(week_results_df):
+    """
+    Function hashes a week's games and scores, in game_id order
+    :param week_results_df: Dataframe with RESULT_COLUMN_LIST columns
+    :return: Hex digest
+    """
+    return hashlib.sha256(week_results_df.sort_values("game_id").astype(str).to_csv(index=False)
+                          .encode("utf-8")).hexdigest()
+
+
+def make_partition_filepath(store_dir, season, week):
+    """
+    Function returns where a week's partition is stored
+    :param store_dir: feature store directory
+    :param season: NFL season
+    :param week: NFL week number
+    :return: Path
+    """
+    return Path(store_dir) / "season={}".format(season) / "week={:02d}.parquet".format(week)
+
+
+def read_manifest(store_dir):
+    """
+    Function reads the week hashes recorded by the previous update
+    :param store_dir: feature store directory
+    :return: Dictionary with version and a dictionary of week hashes per season
+    """
+    manifest_filepath = Path(store_dir) / MANIFEST_FILENAME
+    manifest = {"version": FORM_VERSION, "seasons": dict()}
+    if manifest_filepath.exists():
+        manifest.update(json.loads(manifest_filepath.read_text()))
+    if manifest["version"] != FORM_VERSION:
+        manifest = {"version": FORM_VERSION, "seasons": dict()}
+    return manifest
+
+
+def read_team_form_df(season, week=None, store_dir=TEAM_FORM_DIR, column_list=None):
+    """
+    Function reads every team's form through a week, by default the latest week stored. Only the week's partition and
+    the columns asked for are read
+    :param season: NFL season
+    :param week: NFL week number, or None for the latest
+    :param store_dir: feature store directory
+    :param column_list: columns to read, or None for every column
+    :return: Dataframe with a row per team, empty if the week isn't stored
+    """
+    if week is None:
+        week_list = sorted(int(filepath.stem.split("=")[1]) for filepath in
+                           (Path(store_dir) / "season={}".format(season)).glob("week=*.parquet"))
+        if not week_list:
+            return pd.DataFrame(columns=column_list)
+        week = week_list[-1]
+    partition_filepath = make_partition_filepath(store_dir, season, week)
+    if not partition_filepath.exists():
+        return pd.DataFrame(columns=column_list)
+    return pd.read_parquet(partition_filepath, columns=column_list)
+
+
+def read_cumulative_df(store_dir, season, week):
+    """
+    Function reads the running totals of a stored week
+    :param store_dir: feature store directory
+    :param season: NFL season
+    :param week: NFL week number
+    :return: Dataframe of COUNT_COLUMN_LIST indexed by team
+    """
+    cumulative_df = read_team_form_df(season, week, store_dir, ["team"] + COUNT_COLUMN_LIST)
+    return cumulative_df.set_index("team").astype("int64")
+
+
+def pipeline_update_team_form(season_results_df, store_dir=TEAM_FORM_DIR):
+    """
+    Function pipelines the process required to bring a season's team form up to date. Each week with a result is
+    hashed and the weeks are only recomputed from the first one whose results changed (usually the latest), starting
+    from the running totals stored with the week before it, so a week's results landing rewrites a single partition
+    :param season_results_df: Dataframe returned by make_season_results_df for one season
+    :param store_dir: feature store directory
+    :return: List of weeks written
+    """
+    logger = logging.getLogger(__name__)
+    season = int(season_results_df["season"].iloc[0])
+    manifest = read_manifest(store_dir)
+    week_hash_dict = manifest["seasons"].setdefault(str(season), dict())
+    scored_results_df = season_results_df[season_results_df["away_score"].notna() &
+                                          season_results_df["home_score"].notna()]
+    scored_week_list = sorted(int(week) for week in scored_results_df["week"].unique())
+    week_results_dict = {week: season_results_df[season_results_df["week"] == week] for week in scored_week_list}
+    new_hash_dict = {week: make_week_results_hash(week_results_dict[week]) for week in scored_week_list}
+    stale_week_list = [week for week in scored_week_list if week_hash_dict.get(str(week)) != new_hash_dict[week] or
+                       not make_partition_filepath(store_dir, season, week).exists()]
+    if not stale_week_list:
+        return list()
+    first_stale_week = stale_week_list[0]
+    team_index = pd.Index(sorted(set(season_results_df["away_team"]) | set(season_results_df["home_team"])),
+                          name="team")
+    empty_df = pd.DataFrame(0, index=team_index, columns=COUNT_COLUMN_LIST)
+    # Running totals of the stored weeks the first recomputed weeks' windows start from
+    cumulative_dict = {week: read_cumulative_df(store_dir, season, week).reindex(team_index, fill_value=0)
+                       for week in scored_week_list if first_stale_week - FORM_WEEKS <= week < first_stale_week}
+    written_week_list = list()
+    for week in [week for week in scored_week_list if week >= first_stale_week]:
+        previous_week_list = [stored_week for stored_week in cumulative_dict if stored_week < week]
+        cumulative_df = cumulative_dict[max(previous_week_list)] if previous_week_list else empty_df
+        week_totals_df = make_team_games_df(week_results_dict[week]).groupby("team").sum()
+        cumulative_df = cumulative_df.add(week_totals_df.reindex(team_index, fill_value=0), fill_value=0)
+        cumulative_dict[week] = cumulative_df
+        window_week_list = [stored_week for stored_week in cumulative_dict if stored_week <= week - FORM_WEEKS]
+        window_start_df = cumulative_dict[max(window_week_list)] if window_week_list else empty_df
+        partition_filepath = make_partition_filepath(store_dir, season, week)
+        partition_filepath.parent.mkdir(parents=True, exist_ok=True)
+        make_week_team_form_df(season, week, cumulative_df, window_start_df).to_parquet(partition_filepath,
+                                                                                        index=False)
+        week_hash_dict[str(week)] = new_hash_dict[week]
+        written_week_list.append(week)
+    (Path(store_dir) / MANIFEST_FILENAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    logger.info("wrote %s team form weeks of %s", len(written_week_list), season)
+    return written_week_list
+
+
+@click.command()
+@click.option("--first-season", type=int, default=2022, help="First season updated.")
+@click.option("--last-season", type=int, default=2022, help="Last season updated.")
+@click.option("--score-table", is_flag=True,
+              help="Take scores from nfl_game_scores_2022, which has games as soon as they go final.")
+@click.option("--store-dir", type=click.Path(file_okay=False), default=str(TEAM_FORM_DIR),
+              help="Feature store directory.")
+def main(first_season, last_season, score_table, store_dir):
+    """ Brings every team's rolling form (record, points for and against, rest and cover rate against the spread),
+        stored by season and week, up to date with the latest results.
+    """
+    from src.data.make_dataset import DEFAULT_CACHE_DIR, make_season_schedule_df
+    logger = logging.getLogger(__name__)
+    score_dict = None
+    if score_table:
+        from src.data.database import DatabaseConnectionManager, make_connection_kwargs_from_env
+        database = DatabaseConnectionManager(make_connection_kwargs_from_env(), max_connections=1)
+        score_dict = {game_id: (away_score, home_score) for game_id, away_score, home_score in
+                      database.fetchall(SCORE_TABLE_QUERY)}
+    for season in range(first_season, last_season + 1):
+        season_schedule_df = make_season_schedule_df(season, DEFAULT_CACHE_DIR)
+        written_week_list = pipeline_update_team_form(make_season_results_df(season_schedule_df, score_dict),
+                                                      store_dir)
+        logger.info("%s: %s", season, "weeks {} updated".format(written_week_list) if written_week_list else
+                    "up to date")
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
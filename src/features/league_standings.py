@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from decimal import ROUND_HALF_UP, Decimal
+
+
+LEADERBOARD_PAGE_SIZE = 25
+# Keyset of the row before a league's first standing: ranks start at 1 and user_ids at 1
+FIRST_PAGE_AFTER_KEY = (0, 0)
+
+# The league_standings materialized view holds every player's totals and rank, so pages read LEADERBOARD_PAGE_SIZE
+# rows off the (league_id, standing_rank, user_id) index whatever the league size. Run after grades change
+REFRESH_LEAGUE_STANDINGS_QUERY = "REFRESH MATERIALIZED VIEW CONCURRENTLY league_standings;"
+# Ties share a rank and are shown in user_id order, which keeps the keyset unique
+LEADERBOARD_PAGE_QUERY = """
+    SELECT std.standing_rank, std.tied, std.user_id,
+           (SELECT usr.username FROM users usr WHERE usr.user_id = std.user_id) AS username,
+           std.correct_picks, std.pct_correct, std.weeks_played
+    FROM league_standings std
+    WHERE std.league_id = %(league_id)s AND (std.standing_rank, std.user_id) > (%(after_rank)s, %(after_user_id)s)
+    ORDER BY std.standing_rank, std.user_id
+    LIMIT %(page_size)s
+    ;
+"""
+# Keyset of the row rows_above places ahead of a standing, walking the index backwards. A page opening rows_above rows
+# before that standing starts after it: the previous page is rows_above=LEADERBOARD_PAGE_SIZE from the current page's
+# first row and a user's page is rows_above=LEADERBOARD_PAGE_SIZE // 2 from their own standing. No row means the page
+# starts at the top
+PAGE_AFTER_KEY_QUERY = """
+    SELECT standing_rank, user_id
+    FROM league_standings
+    WHERE league_id = %(league_id)s AND (standing_rank, user_id) < (%(before_rank)s, %(before_user_id)s)
+    ORDER BY standing_rank DESC, user_id DESC
+    OFFSET %(rows_above)s
+    LIMIT 1
+    ;
+"""
+USER_STANDING_QUERY = """
+    SELECT standing_rank, tied
+    FROM league_standings
+    WHERE league_id = %(league_id)s AND user_id = %(user_id)s
+    ;
+"""
+# Where a pick success rate would place a player who isn't in the league, such as the auto-pick model. The model is
+# graded on every scored game and players only on the games they picked, so they are compared on pct_correct
+MODEL_RANK_QUERY = """
+    SELECT COUNT(*) FILTER (WHERE pct_correct > %(pct_correct)s) + 1 AS standing_rank,
+           COALESCE(BOOL_OR(pct_correct = %(pct_correct)s), FALSE) AS tied
+    FROM league_standings
+    WHERE league_id = %(league_id)s
+    ;
+"""
+
+
+def make_rank_text(standing_rank, tied):
+    """
+    Function formats a rank the way sports tables do, prefixing shared ranks with T
+    :param standing_rank: rank, ties share the best rank
+    :param tied: whether another player has the same rank
+    :return: Rank text
+    """
+    return "T{}".format(standing_rank) if tied else str(standing_rank)
+
+
+def make_pct_correct(correct_picks, graded_picks):
+    """
+    Function computes a success rate exactly as league_standings stores pct_correct, so it can be ranked against it
+    :param correct_picks: number of correct picks
+    :param graded_picks: number of graded picks, more than 0
+    :return: Decimal percentage with one decimal
+    """
+    return 100 * (Decimal(correct_picks) / Decimal(graded_picks)).quantize(Decimal("0.001"), rounding=ROUND_HALF_UP)
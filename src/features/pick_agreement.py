@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+
+AWAY_PICK_CODE = -1
+HOME_PICK_CODE = 1
+NO_PICK_CODE = 0
+
+# One row per pick in a league with +1 for the home side and -1 for the away side, for every game of the season up
+# to a week which has kicked off. Picks of games still to kick off stay hidden, as in the league export
+PICK_CODES_QUERY = """
+    SELECT pck.user_id, pck.game_key,
+        CASE
+            WHEN pck.pick_team_id = gms.home_team_id THEN 1
+            ELSE -1
+        END AS pick_code
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    WHERE pck.league_id = %(league_id)s AND gms.season = %(season)s AND gms.week <= %(week)s
+        AND gms.kickoff <= now()
+    ;
+"""
+PICK_CODES_DTYPE_DICT = {"user_id": "int32", "game_key": "int32", "pick_code": "int8"}
+
+
+def make_pick_code_array(pick_codes_df):
+    """
+    Function pivots one-row-per-pick data into a dense users x games array of pick codes (+1 home, -1 away, 0 no pick)
+    :param pick_codes_df: Dataframe with user_id, game_key and pick_code columns
+    :return: user_id array, game_key array, users x games int8 array
+    """
+    user_id_array, user_index_array = np.unique(pick_codes_df["user_id"].to_numpy(), return_inverse=True)
+    game_key_array, game_index_array = np.unique(pick_codes_df["game_key"].to_numpy(), return_inverse=True)
+    pick_code_array = np.full((len(user_id_array), len(game_key_array)), NO_PICK_CODE, dtype=np.int8)
+    pick_code_array[user_index_array, game_index_array] = pick_codes_df["pick_code"].to_numpy()
+    return user_id_array, game_key_array, pick_code_array
+
+
+def make_agreement_matrix(pick_code_array):
+    """
+    Function computes the share of commonly picked games on which each pair of users picked the same side. With
+    codes of +-1, codes @ codes.T counts agreements minus disagreements and |codes| @ |codes|.T counts shared games,
+    so the whole matrix is two matrix products
+    :param pick_code_array: users x games array of pick codes
+    :return: users x users float32 agreement matrix (NaN where two users share no picked game), users x users
+    float32 shared game counts
+    """
+    codes = pick_code_array.astype(np.float32)
+    picked = np.abs(codes)
+    shared_games_matrix = picked @ picked.T
+    agreement_matrix = codes @ codes.T
+    agreement_matrix += shared_games_matrix
+    with np.errstate(invalid="ignore", divide="ignore"):
+        agreement_matrix /= 2 * shared_games_matrix
+    return agreement_matrix, shared_games_matrix
+
+
+def make_agreement_row(pick_code_array, user_index):
+    """
+    Function computes one user's row of the agreement matrix, the same two products against that user's codes only,
+    so a page showing one user never builds the users x users matrices
+    :param pick_code_array: users x games array of pick codes
+    :param user_index: row of the user in pick_code_array
+    :return: float32 agreement array (NaN where the user shares no picked game), float32 shared game counts array
+    """
+    codes = pick_code_array.astype(np.float32)
+    user_codes = codes[user_index]
+    shared_games_row = np.abs(codes) @ np.abs(user_codes)
+    agreement_row = codes @ user_codes
+    agreement_row += shared_games_row
+    with np.errstate(invalid="ignore", divide="ignore"):
+        agreement_row /= 2 * shared_games_row
+    return agreement_row, shared_games_row
+
+
+def make_most_similar_users_df(user_id_array, pick_code_array, user_id, k=5, min_shared_games=1):
+    """
+    Function returns the k users whose picks agree most with the specified user
+    :param user_id_array: user_id of every pick_code_array row
+    :param pick_code_array: users x games array of pick codes
+    :param user_id: user_id key
+    :param k: number of users to return
+    :param min_shared_games: users sharing fewer picked games are ignored
+    :return: Dataframe with user_id, agreement_pct and shared_games columns, most similar first
+    """
+    user_index_array = np.flatnonzero(user_id_array == user_id)
+    if len(user_index_array) == 0:
+        return pd.DataFrame({"user_id": [], "agreement_pct": [], "shared_games": []})
+    user_index = user_index_array[0]
+    agreement_row, shared_games_row = make_agreement_row(pick_code_array, user_index)
+    agreement_row = np.where(shared_games_row >= min_shared_games, agreement_row, np.nan)
+    agreement_row[user_index] = np.nan
+    candidate_index_array = np.flatnonzero(~np.isnan(agreement_row))
+    if len(candidate_index_array) > k:
+        top_k = np.argpartition(-agreement_row[candidate_index_array], k - 1)[:k]
+        candidate_index_array = candidate_index_array[top_k]
+    candidate_index_array = candidate_index_array[np.argsort(-agreement_row[candidate_index_array], kind="stable")]
+    shared_games_array = shared_games_row[candidate_index_array].astype(np.int32)
+    most_similar_users_df = pd.DataFrame({"user_id": user_id_array[candidate_index_array],
+                                          "agreement_pct": agreement_row[candidate_index_array],
+                                          "shared_games": shared_games_array})
+    return most_similar_users_df
+
+
+def make_random_pick_codes_df(user_count, game_count, pick_rate=0.9, seed=0):
+    """
+    Function makes synthetic one-row-per-pick data for benchmarking
+    :param user_count: number of users
+    :param game_count: number of games
+    :param pick_rate: share of games each user picks
+    :param seed: random seed
+    :return: Dataframe with user_id, game_key and pick_code columns
+    """
+    rng = np.random.default_rng(seed)
+    user_id_array, game_key_array = np.meshgrid(np.arange(1, user_count + 1, dtype=np.int32),
+                                                np.arange(1, game_count + 1, dtype=np.int32), indexing="ij")
+    picked_mask = rng.random((user_count, game_count)) < pick_rate
+    pick_codes_df = pd.DataFrame({"user_id": user_id_array[picked_mask], "game_key": game_key_array[picked_mask],
+                                  "pick_code": rng.choice(np.array([AWAY_PICK_CODE, HOME_PICK_CODE], dtype=np.int8),
+                                                          picked_mask.sum())})
+    return pick_codes_df
+
+
+@click.command()
+@click.option("--user-count", type=int, default=5000, help="Number of synthetic users.")
+@click.option("--game-count", type=int, default=272, help="Number of games (272 is a full regular season).")
+def benchmark(user_count, game_count):
+    """ Times the agreement pipeline on synthetic picks: the full matrix and one user's most similar users.
+    """
+    pick_codes_df = make_random_pick_codes_df(user_count, game_count)
+    user_id_array, game_key_array, pick_code_array = make_pick_code_array(pick_codes_df)
+    start = time.perf_counter()
+    make_agreement_matrix(pick_code_array)
+    click.echo("{} users x {} games, full matrix: {:.3f}s".format(user_count, game_count,
+                                                                  time.perf_counter() - start))
+    start = time.perf_counter()
+    make_most_similar_users_df(user_id_array, pick_code_array, user_id_array[0])
+    click.echo("{} users x {} games, one user: {:.3f}s".format(user_count, game_count, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    benchmark()
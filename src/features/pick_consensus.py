@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import threading
+
+
+# One grouped aggregate returns a league's pick counts for every game in a week, instead of a query per matchup card
+WEEK_PICK_CONSENSUS_QUERY = """
+    SELECT gms.game_id, tms.team_abbr, COUNT(*) AS pick_count
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    JOIN nfl_teams tms
+        ON pck.pick_team_id = tms.team_id
+    WHERE pck.league_id = %(league_id)s AND gms.season = %(season)s AND gms.week = %(week)s
+    GROUP BY 1, 2
+    ;
+"""
+
+
+class WeekPickConsensus:
+    """
+    Class holds how many players picked each team of every game in a week. Built from one grouped aggregate and then
+    kept current in place as picks are submitted, so readers never go back to the database between refreshes
+    """
+
+    def __init__(self, week_pick_consensus_df):
+        self._lock = threading.Lock()
+        self._pick_count_dict = dict()
+        for game_id, team_abbr, pick_count in week_pick_consensus_df[["game_id", "team_abbr",
+                                                                      "pick_count"]].itertuples(index=False):
+            self._pick_count_dict.setdefault(game_id, dict())[team_abbr] = int(pick_count)
+
+    def apply_pick_change(self, game_id, old_pick, new_pick):
+        """
+        Function moves one player's pick from old_pick to new_pick
+        :param game_id: game id key
+        :param old_pick: previously picked team, None for a first pick
+        :param new_pick: newly picked team
+        :return: None
+        """
+        if old_pick == new_pick:
+            return None
+        with self._lock:
+            game_pick_count_dict = self._pick_count_dict.setdefault(game_id, dict())
+            if old_pick is not None and game_pick_count_dict.get(old_pick, 0) > 0:
+                game_pick_count_dict[old_pick] -= 1
+            game_pick_count_dict[new_pick] = game_pick_count_dict.get(new_pick, 0) + 1
+        return None
+
+    def make_pick_counts(self, game_id, away_team, home_team):
+        """
+        Function returns how many players picked each side of a game
+        :param game_id: game id key
+        :param away_team: game away team
+        :param home_team: game home team
+        :return: away pick count, home pick count
+        """
+        with self._lock:
+            game_pick_count_dict = self._pick_count_dict.get(game_id, dict())
+            return game_pick_count_dict.get(away_team, 0), game_pick_count_dict.get(home_team, 0)
+
+    def make_pick_pcts(self, game_id, away_team, home_team):
+        """
+        Function returns the share of players who picked each side of a game
+        :param game_id: game id key
+        :param away_team: game away team
+        :param home_team: game home team
+        :return: away pick pct, home pick pct - None when nobody has picked the game
+        """
+        away_picks, home_picks = self.make_pick_counts(game_id, away_team, home_team)
+        total_picks = away_picks + home_picks
+        if total_picks == 0:
+            return None
+        return away_picks / total_picks, home_picks / total_picks
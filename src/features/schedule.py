@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+
+# The schedule columns the app reads. kickoff (naive US/Eastern) replaces gameday, gametime is kept for display and
+# location (Home or Neutral) gives the pick model's home field
+COMPACT_SCHEDULE_DTYPE_DICT = {"game_id": "object", "season": "int16", "week": "int8", "kickoff": "datetime64[ns]",
+                               "weekday": "category", "gametime": "category", "away_team": "category",
+                               "home_team": "category", "away_rest": "int8", "home_rest": "int8",
+                               "spread_line": "float32", "stadium": "category", "location": "category",
+                               "away_score": "Int8", "home_score": "Int8"}
+# A season's schedule is reloaded from nflverse this often, so flexed kickoffs and new final scores reach the pages
+SCHEDULE_TTL_SECONDS = 3600
+# (monotonic load time, compact schedule) by season, shared by every page and session of the process
+_compact_schedule_dict = dict()
+_compact_schedule_lock = threading.Lock()
+
+
+def make_compact_schedule_df(schedule_df):
+    """
+    Function projects an nflverse schedule to the columns the app reads, with categorical teams, stadiums and
+    locations, small ints and a datetime64 kickoff. Rows are sorted by week then kickoff, so every week is a contiguous
+    block make_week_slice can return without copying. The frame is shared across sessions and must be treated as read-only
+    :param schedule_df: Dataframe with an nflverse schedule
+    :return: Dataframe with the COMPACT_SCHEDULE_DTYPE_DICT columns
+    """
+    compact_schedule_df = schedule_df[["game_id", "season", "week", "weekday", "gametime", "away_team", "home_team",
+                                       "away_rest", "home_rest", "spread_line", "stadium", "location",
+                                       "away_score", "home_score"]].copy()
+    compact_schedule_df["kickoff"] = pd.to_datetime(schedule_df["gameday"].astype(str) + " " +
+                                                    schedule_df["gametime"])
+    # Both sides share one category list so teams compare across columns
+    team_dtype = pd.CategoricalDtype(sorted(set(schedule_df["away_team"]) | set(schedule_df["home_team"])))
+    compact_schedule_df = compact_schedule_df.astype(dict(COMPACT_SCHEDULE_DTYPE_DICT, away_team=team_dtype,
+                                                          home_team=team_dtype))
+    compact_schedule_df = compact_schedule_df.sort_values(["week", "kickoff", "game_id"]).reset_index(drop=True)
+    return compact_schedule_df[list(COMPACT_SCHEDULE_DTYPE_DICT)]
+
+
+def load_compact_schedule_df(season, ttl_seconds=SCHEDULE_TTL_SECONDS):
+    """
+    Function returns a season's compact schedule, the one frame every page and session of the process reads. It is
+    downloaded again once it is ttl_seconds old. A failed download keeps the previous frame for another ttl_seconds,
+    and only raises when there is none
+    :param season: NFL season
+    :param ttl_seconds: seconds a loaded schedule is served for
+    :return: Dataframe returned by make_compact_schedule_df
+    """
+    import nfl_data_py as nfl
+    with _compact_schedule_lock:
+        loaded_at, compact_schedule_df = _compact_schedule_dict.get(season, (None, None))
+        if loaded_at is None or time.monotonic() - loaded_at >= ttl_seconds:
+            try:
+                compact_schedule_df = make_compact_schedule_df(nfl.import_schedules([season]))
+            except Exception:
+                if compact_schedule_df is None:
+                    raise
+                logging.getLogger(__name__).exception("schedule reload failed, keeping the current one")
+            _compact_schedule_dict[season] = (time.monotonic(), compact_schedule_df)
+        return compact_schedule_df
+
+
+def make_week_slice(compact_schedule_df, week):
+    """
+    Function returns a week's games in kickoff order as a row slice of the compact schedule, a view rather than a copy
+    :param compact_schedule_df: Dataframe returned by make_compact_schedule_df
+    :param week: NFL week number
+    :return: Dataframe
+    """
+    start, stop = np.searchsorted(compact_schedule_df["week"].to_numpy(), [week, week + 1])
+    return compact_schedule_df.iloc[start:stop]
+
+
+def make_schedule_memory_report_df(schedule_df):
+    """
+    Function compares the deep memory of the full nflverse schedule with the compact one
+    :param schedule_df: Dataframe with an nflverse schedule
+    :return: Dataframe with representation, columns and bytes columns
+    """
+    compact_schedule_df = make_compact_schedule_df(schedule_df)
+    return pd.DataFrame([("nflverse schedule", len(schedule_df.columns),
+                          int(schedule_df.memory_usage(deep=True).sum())),
+                         ("compact schedule", len(compact_schedule_df.columns),
+                          int(compact_schedule_df.memory_usage(deep=True).sum()))],
+                        columns=["representation", "columns", "bytes"])
+
+
+@click.command()
+@click.argument("season", type=int)
+def main(season):
+    """ Reports the memory each Streamlit process holds for SEASON's schedule, as the full nflverse frame and as the
+        compact frame the app caches.
+    """
+    import nfl_data_py as nfl
+    logger = logging.getLogger(__name__)
+    schedule_df = nfl.import_schedules([season])
+    schedule_df["gameday"] = pd.to_datetime(schedule_df["gameday"]).dt.date
+    memory_report_df = make_schedule_memory_report_df(schedule_df)
+    for representation, column_count, byte_count in memory_report_df.itertuples(index=False):
+        click.echo("{:<18} {:>3} columns {:>9.1f} KB".format(representation, column_count, byte_count / 1024))
+    logger.info("compact schedule uses %.1f%% of the memory", 100 * memory_report_df["bytes"].iloc[1] /
+                memory_report_df["bytes"].iloc[0])
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
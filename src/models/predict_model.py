@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.features.schedule import make_compact_schedule_df, make_week_slice
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+PICK_MODEL_FILEPATH = PROJECT_DIR / "models" / "pick_model.json"
+# home_field is 1 unless the game is at a neutral site, so its coefficient is the home field edge left once the
+# spread is accounted for. Rest is capped as week 1 and post-bye games would otherwise dominate it
+FEATURE_COLUMN_LIST = ["home_field", "spread_line", "rest_advantage"]
+MAX_REST_ADVANTAGE = 7
+# Used until a model has been trained: the spread alone, with the logistic approximation of a normal margin around
+# it (1.702 / NFL_MARGIN_STD of src.models.standings_projection)
+DEFAULT_PICK_MODEL = {"feature_list": FEATURE_COLUMN_LIST, "coefficient_list": [0.0, 0.1265, 0.0],
+                      "seasons": None, "game_count": 0}
+# The schedule columns predictions depend on. Predictions are cached under a hash of them, so a moved spread or a
+# rescheduled or relocated game makes new ones and anything else (a score going final) doesn't
+REVISION_COLUMN_LIST = ["game_id", "week", "away_team", "home_team", "location", "away_rest", "home_rest",
+                        "spread_line"]
+
+
+def make_feature_array(schedule_df):
+    """
+    Function computes the model features of every game of a schedule at once. Missing spreads count as a pick'em
+    :param schedule_df: Dataframe with an nflverse or compact schedule
+    :return: games x FEATURE_COLUMN_LIST float64 array
+    """
+    if "location" in schedule_df:
+        home_field = (schedule_df["location"] != "Neutral").to_numpy(dtype=np.float64)
+    else:
+        home_field = np.ones(len(schedule_df))
+    spread_line = np.nan_to_num(schedule_df["spread_line"].to_numpy(dtype=np.float64), nan=0.0)
+    rest_advantage = np.clip(np.nan_to_num(schedule_df["home_rest"].to_numpy(dtype=np.float64) -
+                                           schedule_df["away_rest"].to_numpy(dtype=np.float64)),
+                             -MAX_REST_ADVANTAGE, MAX_REST_ADVANTAGE)
+    return np.column_stack([home_field, spread_line, rest_advantage])
+
+
+def make_home_win_probability(pick_model, feature_array):
+    """
+    Function scores games with the logistic model
+    :param pick_model: Dictionary returned by read_pick_model
+    :param feature_array: array returned by make_feature_array
+    :return: float64 array of home win probabilities
+    """
+    return 1 / (1 + np.exp(-(feature_array @ np.asarray(pick_model["coefficient_list"], dtype=np.float64))))
+
+
+def read_pick_model(filepath=PICK_MODEL_FILEPATH):
+    """
+    Function reads the model written by src.models.train_model, or the spread-only default if none has been trained
+    :param filepath: path of the model JSON
+    :return: Dictionary with feature_list, coefficient_list, seasons and game_count
+    """
+    filepath = Path(filepath)
+    if not filepath.exists():
+        logging.getLogger(__name__).info("no model at %s, picking with the spread alone", filepath)
+        return DEFAULT_PICK_MODEL
+    pick_model = json.loads(filepath.read_text(encoding="utf-8"))
+    if pick_model["feature_list"] != FEATURE_COLUMN_LIST:
+        raise ValueError("{} was trained on {}, retrain it on {}".format(filepath, pick_model["feature_list"],
+                                                                          FEATURE_COLUMN_LIST))
+    return pick_model
+
+
+def make_schedule_revision(schedule_df):
+    """
+    Function identifies the revision of a schedule the predictions depend on
+    :param schedule_df: Dataframe with an nflverse or compact schedule
+    :return: Hex digest
+    """
+    row_hash_array = pd.util.hash_pandas_object(schedule_df[REVISION_COLUMN_LIST], index=False).to_numpy()
+    return hashlib.sha256(row_hash_array.tobytes()).hexdigest()[:16]
+
+
+def make_schedule_predictions_df(pick_model, schedule_df):
+    """
+    Function predicts the winner of every game of a schedule in one batch. Rows keep the schedule's order, so a week
+    of the compact schedule's predictions is a make_week_slice away
+    :param pick_model: Dictionary returned by read_pick_model
+    :param schedule_df: Dataframe with an nflverse or compact schedule
+    :return: Dataframe with game_id, week, home_win_probability, model_pick and confidence columns
+    """
+    home_win_probability = make_home_win_probability(pick_model, make_feature_array(schedule_df))
+    home_pick = home_win_probability >= 0.5
+    schedule_predictions_df = pd.DataFrame({
+        "game_id": schedule_df["game_id"].to_numpy(),
+        "week": schedule_df["week"].to_numpy(),
+        "home_win_probability": home_win_probability.astype(np.float32),
+        "model_pick": np.where(home_pick, schedule_df["home_team"].astype(str), schedule_df["away_team"].astype(str)),
+        "confidence": np.where(home_pick, home_win_probability, 1 - home_win_probability).astype(np.float32)})
+    return schedule_predictions_df
+
+
+def make_model_record(schedule_predictions_df, game_scores_df):
+    """
+    Function grades the model's picks like a player's: a tie has no winner, so nobody picked it right
+    :param schedule_predictions_df: Dataframe returned by make_schedule_predictions_df
+    :param game_scores_df: Dataframe with game_id, away_team, away_score, home_team and home_score of graded games
+    :return: correct picks, graded picks
+    """
+    graded_df = game_scores_df.merge(schedule_predictions_df[["game_id", "model_pick"]], on="game_id")
+    winning_team = np.select([graded_df["away_score"] > graded_df["home_score"],
+                              graded_df["away_score"] < graded_df["home_score"]],
+                             [graded_df["away_team"], graded_df["home_team"]], default=None)
+    return int((graded_df["model_pick"].to_numpy() == winning_team).sum()), len(graded_df)
+
+
+@click.command()
+@click.argument("season", type=int)
+@click.argument("week", type=int)
+@click.option("--model-filepath", type=click.Path(dir_okay=False), default=str(PICK_MODEL_FILEPATH),
+              help="Model written by src.models.train_model.")
+def main(season, week, model_filepath):
+    """ Prints the model's pick and confidence for every game of SEASON's WEEK.
+    """
+    import nfl_data_py as nfl
+    pick_model = read_pick_model(model_filepath)
+    compact_schedule_df = make_compact_schedule_df(nfl.import_schedules([season]))
+    week_predictions_df = make_week_slice(make_schedule_predictions_df(pick_model, compact_schedule_df), week)
+    for row in week_predictions_df.itertuples(index=False):
+        click.echo("{:<18} {:<4} {:>6.1%}".format(row.game_id, row.model_pick, row.confidence))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+
+
+# Standard deviation of NFL final margins around the closing spread, in points
+NFL_MARGIN_STD = 13.45
+DEFAULT_CHUNK_SIZE = 5000
+# Abramowitz and Stegun 7.1.26 coefficients of the error function, a1 to a5
+ERF_P = 0.3275911
+ERF_COEFFICIENT_LIST = [0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429]
+
+# A league's submitted picks for games without a final score, +1 for the home side and -1 for the away side
+REMAINING_PICK_CODES_QUERY = """
+    SELECT pck.user_id, gms.game_id,
+        CASE
+            WHEN pck.pick_team_id = gms.home_team_id THEN 1
+            ELSE -1
+        END AS pick_code
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    LEFT JOIN nfl_game_scores_2022 scr
+        ON gms.game_key = scr.game_key
+    WHERE pck.league_id = %(league_id)s AND gms.season = %(season)s AND scr.game_key IS NULL
+    ;
+"""
+CURRENT_POINTS_QUERY = """
+    SELECT user_id, SUM(correct_pick_flag) AS correct_picks
+    FROM user_winning_picks
+    WHERE league_id = %(league_id)s
+    GROUP BY user_id
+    ;
+"""
+
+
+def make_erf_array(x_array):
+    """
+    Function evaluates the error function over an array with the Abramowitz and Stegun 7.1.26 approximation, accurate
+    to 1.5e-7, well within the float32 probabilities it feeds
+    :param x_array: float64 array
+    :return: float64 array
+    """
+    abs_x_array = np.abs(x_array)
+    t_array = 1 / (1 + ERF_P * abs_x_array)
+    polynomial_array = t_array * np.polyval(ERF_COEFFICIENT_LIST[::-1], t_array)
+    return np.sign(x_array) * (1 - polynomial_array * np.exp(-abs_x_array ** 2))
+
+
+def make_home_win_probability(spread_line_array, margin_std=NFL_MARGIN_STD):
+    """
+    Function converts spreads into home win probabilities, treating the final margin as normally distributed around
+    the spread. nflverse spread_line is from the home team's perspective (positive means the home team is favoured).
+    Missing spreads count as a coin flip
+    :param spread_line_array: array of spreads
+    :param margin_std: standard deviation of the final margin
+    :return: float32 array of home win probabilities
+    """
+    spread_line_array = np.nan_to_num(np.asarray(spread_line_array, dtype=np.float64), nan=0.0)
+    z_array = spread_line_array / (margin_std * math.sqrt(2))
+    home_win_probability = 0.5 * (1 + make_erf_array(z_array))
+    return home_win_probability.astype(np.float32)
+
+
+def make_rank_counts_chunk(seed_sequence, simulation_count, home_win_probability, pick_code_array, current_points):
+    """
+    Function simulates simulation_count seasons and counts how often each user finishes at each rank. Tied users share
+    the best rank (1 + number of users with strictly more correct picks)
+    :param seed_sequence: numpy SeedSequence for this chunk
+    :param simulation_count: number of simulated seasons
+    :param home_win_probability: home win probability of every remaining game
+    :param pick_code_array: users x remaining games array of pick codes (+1 home, -1 away, 0 no pick)
+    :param current_points: correct picks of every user so far
+    :return: users x ranks int64 array of counts
+    """
+    rng = np.random.default_rng(seed_sequence)
+    user_count, game_count = pick_code_array.shape
+    outcome_array = np.where(rng.random((simulation_count, game_count), dtype=np.float32) < home_win_probability,
+                             np.float32(1), np.float32(-1))
+    picks = pick_code_array.astype(np.float32)
+    # outcome @ picks.T counts right minus wrong picks, adding the number of picked games gives twice the right ones
+    net_correct = outcome_array @ picks.T
+    net_correct += np.abs(picks).sum(axis=1)
+    total_points = current_points + np.rint(net_correct / 2).astype(np.int32)
+    # Counting sort per simulation: points are small integers, so offset each row and bincount them all at once
+    width = int(current_points.max(initial=0)) + game_count + 1
+    row_offset = np.arange(simulation_count, dtype=np.int64)[:, None] * width
+    points_counts = np.bincount((row_offset + total_points).ravel(),
+                                minlength=simulation_count * width).reshape(simulation_count, width)
+    users_above = np.cumsum(points_counts[:, ::-1], axis=1)[:, ::-1] - points_counts
+    rank_array = 1 + np.take_along_axis(users_above, total_points, axis=1)
+    user_offset = np.arange(user_count, dtype=np.int64) * user_count
+    rank_counts = np.bincount((user_offset + rank_array - 1).ravel(),
+                              minlength=user_count * user_count).reshape(user_count, user_count)
+    return rank_counts
+
+
+def make_projected_rank_counts(home_win_probability, pick_code_array, current_points, simulation_count=10000,
+                               seed=0, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Function runs the Monte Carlo projection in chunks across a process pool. Each chunk draws from its own child of
+    the seed, so a seed gives the same result whatever the number of workers
+    :param home_win_probability: home win probability of every remaining game
+    :param pick_code_array: users x remaining games array of pick codes
+    :param current_points: correct picks of every user so far
+    :param simulation_count: number of simulated seasons
+    :param seed: random seed
+    :param workers: number of worker processes - None uses every CPU, 1 runs in process
+    :param chunk_size: simulations per chunk
+    :return: users x ranks int64 array of counts
+    """
+    user_count = pick_code_array.shape[0]
+    chunk_size_list = [chunk_size] * (simulation_count // chunk_size)
+    if simulation_count % chunk_size:
+        chunk_size_list.append(simulation_count % chunk_size)
+    seed_sequence_list = np.random.SeedSequence(seed).spawn(len(chunk_size_list))
+    current_points = np.asarray(current_points, dtype=np.int32)
+    rank_counts = np.zeros((user_count, user_count), dtype=np.int64)
+    if workers == 1:
+        for seed_sequence, chunk_simulation_count in zip(seed_sequence_list, chunk_size_list):
+            rank_counts += make_rank_counts_chunk(seed_sequence, chunk_simulation_count, home_win_probability,
+                                                  pick_code_array, current_points)
+        return rank_counts
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_count = len(chunk_size_list)
+        for chunk_rank_counts in executor.map(make_rank_counts_chunk, seed_sequence_list, chunk_size_list,
+                                              [home_win_probability] * chunk_count, [pick_code_array] * chunk_count,
+                                              [current_points] * chunk_count):
+            rank_counts += chunk_rank_counts
+    return rank_counts
+
+
+def make_rank_distribution_df(user_id_array, rank_counts):
+    """
+    Function summarises each user's projected final rank distribution
+    :param user_id_array: user_id of every rank_counts row
+    :param rank_counts: users x ranks array of counts
+    :return: Dataframe with user_id, expected_rank, first_place_pct, top_three_pct and 10th/50th/90th percentile
+    ranks
+    """
+    rank_probability = rank_counts / rank_counts.sum(axis=1, keepdims=True)
+    rank_values = np.arange(1, rank_counts.shape[1] + 1)
+    cumulative_probability = np.cumsum(rank_probability, axis=1)
+    rank_distribution_df = pd.DataFrame({"user_id": user_id_array,
+                                         "expected_rank": rank_probability @ rank_values,
+                                         "first_place_pct": rank_probability[:, 0],
+                                         "top_three_pct": rank_probability[:, :3].sum(axis=1)})
+    for percentile in (10, 50, 90):
+        rank_distribution_df["rank_p{}".format(percentile)] = 1 + np.argmax(
+            cumulative_probability >= percentile / 100 - 1e-9, axis=1)
+    return rank_distribution_df.sort_values("expected_rank").reset_index(drop=True)
+
+
+def make_projection_inputs(remaining_games_df, pick_codes_df, current_points_df):
+    """
+    Function aligns the remaining schedule, submitted picks and current standings into the projection arrays. Users
+    with no pick for a remaining game can't score it
+    :param remaining_games_df: Dataframe with game_id and spread_line of every game without a final score
+    :param pick_codes_df: Dataframe with user_id, game_id and pick_code columns
+    :param current_points_df: Dataframe with user_id and correct_picks columns
+    :return: user_id array, home win probability array, users x games pick code array, current points array
+    """
+    user_id_array = np.union1d(current_points_df["user_id"].to_numpy(), pick_codes_df["user_id"].to_numpy())
+    game_id_array = remaining_games_df["game_id"].to_numpy()
+    pick_codes_df = pick_codes_df[pick_codes_df["game_id"].isin(game_id_array)]
+    pick_code_array = np.zeros((len(user_id_array), len(game_id_array)), dtype=np.int8)
+    game_index_series = pd.Series(np.arange(len(game_id_array)), index=game_id_array)
+    pick_code_array[np.searchsorted(user_id_array, pick_codes_df["user_id"].to_numpy()),
+                    game_index_series[pick_codes_df["game_id"]].to_numpy()] = pick_codes_df["pick_code"].to_numpy()
+    current_points = np.zeros(len(user_id_array), dtype=np.int32)
+    current_points[np.searchsorted(user_id_array, current_points_df["user_id"].to_numpy())] = \
+        current_points_df["correct_picks"].fillna(0).to_numpy()
+    home_win_probability = make_home_win_probability(remaining_games_df["spread_line"].to_numpy())
+    return user_id_array, home_win_probability, pick_code_array, current_points
+
+
+def pipeline_make_projected_standings_df(remaining_games_df, pick_codes_df, current_points_df,
+                                         simulation_count=10000, seed=0, workers=None):
+    """
+    Function pipelines the process required to project every user's final rank distribution
+    :param remaining_games_df: Dataframe with game_id and spread_line of every game without a final score
+    :param pick_codes_df: Dataframe with user_id, game_id and pick_code columns
+    :param current_points_df: Dataframe with user_id and correct_picks columns
+    :param simulation_count: number of simulated seasons
+    :param seed: random seed
+    :param workers: number of worker processes
+    :return: Dataframe
+    """
+    user_id_array, home_win_probability, pick_code_array, current_points = make_projection_inputs(
+        remaining_games_df, pick_codes_df, current_points_df)
+    if len(user_id_array) == 0:
+        return make_rank_distribution_df(user_id_array, np.zeros((0, 0), dtype=np.int64))
+    rank_counts = make_projected_rank_counts(home_win_probability, pick_code_array, current_points,
+                                             simulation_count, seed, workers)
+    return make_rank_distribution_df(user_id_array, rank_counts)
+
+
+@click.command()
+@click.option("--simulation-count", type=int, default=100000, help="Number of simulated seasons.")
+@click.option("--user-count", type=int, default=1000, help="Number of synthetic users.")
+@click.option("--game-count", type=int, default=136, help="Number of remaining games (136 is half a season).")
+@click.option("--workers", type=int, default=None, help="Worker processes, defaults to every CPU.")
+@click.option("--seed", type=int, default=0, help="Random seed.")
+def benchmark(simulation_count, user_count, game_count, workers, seed):
+    """ Times the standings projection on synthetic picks and spreads.
+    """
+    rng = np.random.default_rng(seed)
+    home_win_probability = make_home_win_probability(rng.normal(0, 6, game_count))
+    pick_code_array = rng.choice(np.array([-1, 1], dtype=np.int8), (user_count, game_count))
+    current_points = rng.integers(60, 90, user_count, dtype=np.int32)
+    start = time.perf_counter()
+    rank_counts = make_projected_rank_counts(home_win_probability, pick_code_array, current_points,
+                                             simulation_count, seed, workers)
+    elapsed = time.perf_counter() - start
+    make_rank_distribution_df(np.arange(user_count), rank_counts)
+    click.echo("{} simulations x {} users x {} games on {} workers: {:.2f}s".format(
+        simulation_count, user_count, game_count, workers or os.cpu_count(), elapsed))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    benchmark()
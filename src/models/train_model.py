@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data.make_dataset import DEFAULT_CACHE_DIR, FIRST_NFLVERSE_SEASON, make_season_schedule_df
+from src.models.predict_model import (FEATURE_COLUMN_LIST, PICK_MODEL_FILEPATH, make_feature_array,
+                                      make_home_win_probability)
+
+
+# Shrinks every coefficient but home_field towards zero, which keeps the rest term sensible on a few seasons
+L2_PENALTY = 1.0
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-8
+
+
+def make_training_df(season_list, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Function stacks the games of every season which have a winner. Ties and unplayed games are dropped
+    :param season_list: NFL seasons
+    :param cache_dir: directory holding schedules_<season>.parquet files
+    :return: Dataframe with an nflverse schedule and a home_win column
+    """
+    training_df = pd.concat([make_season_schedule_df(season, cache_dir) for season in season_list],
+                            ignore_index=True)
+    training_df = training_df[training_df["away_score"].notna() & training_df["home_score"].notna() &
+                              (training_df["away_score"] != training_df["home_score"])].copy()
+    training_df["home_win"] = (training_df["home_score"] > training_df["away_score"]).astype(np.float64)
+    return training_df.reset_index(drop=True)
+
+
+def fit_logistic_regression(feature_array, target_array, l2_penalty=L2_PENALTY, max_iterations=MAX_ITERATIONS,
+                            tolerance=TOLERANCE):
+    """
+    Function fits a logistic regression by Newton's method, each step solving the penalised normal equations over
+    every game at once. The first feature (home_field) isn't penalised
+    :param feature_array: games x features array returned by make_feature_array
+    :param target_array: 1 where the home team won, 0 where the away team did
+    :param l2_penalty: L2 penalty of every coefficient but the first
+    :param max_iterations: maximum number of Newton steps
+    :param tolerance: largest coefficient change at which the fit has converged
+    :return: float64 array of coefficients
+    """
+    coefficients = np.zeros(feature_array.shape[1])
+    penalty = np.diag(np.r_[0.0, np.full(feature_array.shape[1] - 1, l2_penalty)])
+    for iteration in range(max_iterations):
+        probability = 1 / (1 + np.exp(-(feature_array @ coefficients)))
+        gradient = feature_array.T @ (probability - target_array) + penalty @ coefficients
+        hessian = (feature_array * (probability * (1 - probability))[:, None]).T @ feature_array + penalty
+        step = np.linalg.solve(hessian, gradient)
+        coefficients -= step
+        if np.abs(step).max() < tolerance:
+            break
+    return coefficients
+
+
+def make_evaluation(pick_model, feature_array, target_array, spread_line_array):
+    """
+    Function scores a model on games it wasn't trained on, next to always picking the spread favourite (the home team
+    on a pick'em)
+    :param pick_model: Dictionary with feature_list and coefficient_list
+    :param feature_array: games x features array returned by make_feature_array
+    :param target_array: 1 where the home team won, 0 where the away team did
+    :param spread_line_array: the games' spreads
+    :return: Dictionary with game_count, log_loss, accuracy and favourite_accuracy
+    """
+    probability = np.clip(make_home_win_probability(pick_model, feature_array), 1e-12, 1 - 1e-12)
+    log_loss = -np.mean(target_array * np.log(probability) + (1 - target_array) * np.log(1 - probability))
+    return {"game_count": len(target_array), "log_loss": float(log_loss),
+            "accuracy": float(np.mean((probability >= 0.5) == (target_array == 1))),
+            "favourite_accuracy": float(np.mean((np.nan_to_num(spread_line_array) >= 0) == (target_array == 1)))}
+
+
+def pipeline_train_pick_model(season_list, holdout_season=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Function pipelines the process required to train the pick model on the seasons provided, evaluating it first on
+    the holdout season when there is one. The holdout season is never trained on
+    :param season_list: NFL seasons trained on
+    :param holdout_season: NFL season evaluated on, or None
+    :param cache_dir: directory holding schedules_<season>.parquet files
+    :return: Dictionary to write to the model JSON
+    """
+    training_df = make_training_df(season_list, cache_dir)
+    coefficients = fit_logistic_regression(make_feature_array(training_df), training_df["home_win"].to_numpy())
+    pick_model = {"feature_list": FEATURE_COLUMN_LIST, "coefficient_list": coefficients.round(6).tolist(),
+                  "seasons": [min(season_list), max(season_list)], "game_count": len(training_df),
+                  "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    if holdout_season is not None:
+        holdout_df = make_training_df([holdout_season], cache_dir)
+        pick_model["holdout"] = dict(make_evaluation(pick_model, make_feature_array(holdout_df),
+                                                     holdout_df["home_win"].to_numpy(),
+                                                     holdout_df["spread_line"].to_numpy(dtype=np.float64)),
+                                     season=holdout_season)
+    return pick_model
+
+
+@click.command()
+@click.option("--first-season", type=int, default=FIRST_NFLVERSE_SEASON, help="First season trained on.")
+@click.option("--last-season", type=int, default=2021, help="Last season trained on.")
+@click.option("--holdout-season", type=int, default=None,
+              help="Season evaluated on, defaults to the season after --last-season. Pass 0 to skip it.")
+@click.option("--model-filepath", type=click.Path(dir_okay=False), default=str(PICK_MODEL_FILEPATH),
+              help="Where the model JSON is written.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=str(DEFAULT_CACHE_DIR),
+              help="Directory of cached nflverse schedules.")
+def main(first_season, last_season, holdout_season, model_filepath, cache_dir):
+    """ Trains the baseline game winner model the pages auto-fill picks with, on the spread, rest and home field of
+        every game from --first-season to --last-season, and writes it to --model-filepath.
+    """
+    logger = logging.getLogger(__name__)
+    if holdout_season is None:
+        holdout_season = last_season + 1
+    pick_model = pipeline_train_pick_model(list(range(first_season, last_season + 1)), holdout_season or None,
+                                           cache_dir)
+    logger.info("trained on %s games from %s to %s", pick_model["game_count"], first_season, last_season)
+    for feature, coefficient in zip(pick_model["feature_list"], pick_model["coefficient_list"]):
+        click.echo("{:<16} {:>9.4f}".format(feature, coefficient))
+    if "holdout" in pick_model:
+        holdout = pick_model["holdout"]
+        click.echo("{} holdout, {} games: log loss {:.4f}, accuracy {:.1%} (favourite {:.1%})".format(
+            holdout["season"], holdout["game_count"], holdout["log_loss"], holdout["accuracy"],
+            holdout["favourite_accuracy"]))
+    Path(model_filepath).parent.mkdir(parents=True, exist_ok=True)
+    Path(model_filepath).write_text(json.dumps(pick_model, indent=2), encoding="utf-8")
+    logger.info("wrote %s", model_filepath)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
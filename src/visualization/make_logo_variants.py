@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import io
+import logging
+from pathlib import Path
+
+import click
+import pandas as pd
+from PIL import Image
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+TEAM_LOGO_LOCATIONS_FILEPATH = PROJECT_DIR / "data" / "processed" / "team_logo_file_locations.csv"
+LOGO_DIR = PROJECT_DIR / "references" / "logos"
+CARD_LOGO_DIR = LOGO_DIR / "card"
+# The logo columns of a matchup card are ~150px wide, doubled for high density screens
+CARD_LOGO_MAX_SIZE = 300
+# 256 colour palettes keep the logos' flat colours and soft edges while cutting the file size several times
+CARD_LOGO_COLORS = 256
+
+
+def make_team_logo_source_dict(team_logo_locations_df):
+    """
+    Function maps every team to its full size logo in references/logos, named like the file its picture_location
+    points to
+    :param team_logo_locations_df: Dataframe with team and picture_location columns
+    :return: Dictionary holding team as key and logo filepath as value
+    """
+    return {team: LOGO_DIR / picture_location.split("?")[0].rsplit("/", 1)[-1]
+            for team, picture_location in team_logo_locations_df[["team", "picture_location"]].itertuples(index=False)}
+
+
+def make_card_logo_bytes(logo_filepath, max_size=CARD_LOGO_MAX_SIZE, colors=CARD_LOGO_COLORS):
+    """
+    Function encodes the web ready variant of a logo shown on matchup cards: scaled to fit max_size, palette
+    quantized and saved as an optimised PNG, the format st.image passes through without re-encoding
+    :param logo_filepath: path of the full size logo
+    :param max_size: largest width or height in pixels
+    :param colors: palette size
+    :return: PNG bytes
+    """
+    logo = Image.open(logo_filepath).convert("RGBA")
+    logo.thumbnail((max_size, max_size), Image.LANCZOS)
+    logo = logo.quantize(colors=colors, method=Image.FASTOCTREE)
+    buffer = io.BytesIO()
+    logo.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+@click.command()
+@click.option("--max-size", type=int, default=CARD_LOGO_MAX_SIZE, help="Largest logo width or height in pixels.")
+def main(max_size):
+    """ Encodes the matchup card variant of every team logo into references/logos/card/<team>.png.
+    """
+    logger = logging.getLogger(__name__)
+    CARD_LOGO_DIR.mkdir(parents=True, exist_ok=True)
+    source_byte_count = 0
+    card_byte_count = 0
+    for team, logo_filepath in make_team_logo_source_dict(pd.read_csv(TEAM_LOGO_LOCATIONS_FILEPATH)).items():
+        card_logo_bytes = make_card_logo_bytes(logo_filepath, max_size)
+        (CARD_LOGO_DIR / "{}.png".format(team)).write_bytes(card_logo_bytes)
+        source_byte_count += logo_filepath.stat().st_size
+        card_byte_count += len(card_logo_bytes)
+    logger.info("encoded card logos: %.0f KB from %.0f KB of full size logos", card_byte_count / 1024,
+                source_byte_count / 1024)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+RECAP_DIR = PROJECT_DIR / "reports" / "recaps"
+CORRECT_COLOR = "#41b45c"
+WRONG_COLOR = "#F05454"
+NEUTRAL_COLOR = "#EFEFEF"
+WEEKS_PREDICTION_PCT_FIGURE = "weeks_prediction_pct"
+MATCHUP_SCORES_FIGURE = "matchup_scores_week_{:02d}"
+# Every user's figure of a name shares its layout (and the plotly_dark template, most of its size), which is written
+# once per revision to base/<figure name>.json. A user's file only holds the traces of each of their figures
+BASE_FIGURE_DIR_NAME = "base"
+# Revision directories are named by make_revision, and only those are removed when a revision goes stale
+REVISION_DIR_NAME_PATTERN = re.compile(r"[0-9a-f]{16}")
+# Users per task sent to a worker process
+DEFAULT_CHUNK_SIZE = 250
+LEAGUE_ID_QUERY = "SELECT league_id FROM leagues ORDER BY league_id;"
+SCORED_GAMES_QUERY = """
+    SELECT game_id, week, away_team, away_score, home_team, home_score
+    FROM nfl_game_scores_2022
+    ORDER BY game_id
+    ;
+"""
+# make_user_weeks_prediction_pct_df of the Analytics page for every player of a league at once
+LEAGUE_WEEKS_PREDICTION_PCT_QUERY = """
+    SELECT user_id, week, COUNT(week) AS played_games, SUM(correct_pick_flag) AS correct_picks,
+           (CAST(SUM(correct_pick_flag) AS float) / CAST(COUNT(week) AS float)) AS pct_correct
+    FROM user_winning_picks
+    WHERE league_id = %(league_id)s
+    GROUP BY user_id, week
+    ORDER BY user_id, week
+    ;
+"""
+# make_user_picks_with_win_df of the Analytics page for every player of a league at once, scored games only
+LEAGUE_PICKS_WITH_WIN_QUERY = """
+    SELECT pck.user_id, pck.game_id, pck.winning_pick,
+        CASE
+            WHEN scr.home_score > scr.away_score AND pck.pick_team_id = gms.home_team_id THEN 1
+            WHEN scr.home_score < scr.away_score AND pck.pick_team_id = gms.away_team_id THEN 1
+            ELSE 0
+        END AS correct_or_not
+    FROM user_weekly_picks pck
+    JOIN nfl_games gms
+        ON pck.game_key = gms.game_key
+    JOIN nfl_game_scores_2022 scr
+        ON pck.game_key = scr.game_key
+    WHERE pck.league_id = %(league_id)s
+    ORDER BY pck.user_id
+    ;
+"""
+# Each player's graded picks, right picks and a sum of the hashed game_keys they got right. A pick imported for a game
+# already final is graded without the scores changing, so recaps are rendered per revision of these too. The hash sum
+# changes when grades move between games or players even where the counts don't
+LEAGUE_GRADES_QUERY = """
+    SELECT user_id, COUNT(*) AS graded_picks, SUM(correct_pick_flag) AS correct_picks,
+           COALESCE(SUM(hashtext(game_key::text)::bigint) FILTER (WHERE correct_pick_flag = 1), 0) AS correct_games_hash
+    FROM user_winning_picks
+    WHERE league_id = %(league_id)s
+    GROUP BY user_id
+    ORDER BY user_id
+    ;
+"""
+
+
+def make_plot_user_weeks_prediction_pct(user_weeks_prediction_pct_df):
+    """
+    Function plots a users prediction success rate and the correct number of games per week
+    :param user_weeks_prediction_pct_df: Dataframe with the weekly win pct rate for a specified user
+    :return: Plotly object
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    weeks_str = [str(x) for x in list(user_weeks_prediction_pct_df["week"])]
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(
+        go.Bar(x=weeks_str, y=list(user_weeks_prediction_pct_df["correct_picks"]), name="Correct Picks", marker_color="#EFEFEF"), secondary_y=False)
+    fig.add_trace(
+        go.Scatter(x=weeks_str, y=list(user_weeks_prediction_pct_df["pct_correct"]), name="Success Rate (%)", marker_color="#5CACEE"), secondary_y=True)
+    fig.update_layout(template="plotly_dark", xaxis=dict(showgrid=False), yaxis=dict(showgrid=False))
+    fig.update_yaxes(range=[0, 16], secondary_y=False, showgrid=False)
+    fig.update_yaxes(range=[0, 1], secondary_y=True, showgrid=False, tickformat=".0%")
+    return fig
+
+
+def make_team_color_arrays(matchup_picks_df):
+    """
+    Function colors both sides of every matchup: the picked side green when the pick was correct and red when it
+    wasn't, and the other side (or both, when the game wasn't picked) neutral
+    :param matchup_picks_df: Dataframe with away_team, home_team, winning_pick and correct_or_not columns, the last two
+    missing where the game wasn't picked
+    :return: away colors array, home colors array
+    """
+    pick_color = np.where(matchup_picks_df["correct_or_not"] == 1, CORRECT_COLOR, WRONG_COLOR)
+    away_team_color_array = np.where(matchup_picks_df["winning_pick"] == matchup_picks_df["away_team"], pick_color,
+                                     NEUTRAL_COLOR)
+    home_team_color_array = np.where(matchup_picks_df["winning_pick"] == matchup_picks_df["home_team"], pick_color,
+                                     NEUTRAL_COLOR)
+    return away_team_color_array, home_team_color_array
+
+
+def pipeline_make_matchup_dicts_team_color_logic(nfl_games_with_scores_df, week, user_picks_with_win_df):
+    """
+    Function pipelines the process needed to create dictionaries holding scores and lists holding colors
+    :param nfl_games_with_scores_df: Dataframe with nfl games and scores
+    :param week: NFL week number
+    :param user_picks_with_win_df: Dataframe with a users matchup pick and correct flag
+    :return: away_score_dict, home_score_dict, away_team_color_list, home_team_color_list
+    """
+    nfl_week_game_score_df = nfl_games_with_scores_df[nfl_games_with_scores_df["week"] == week]
+    matchup_picks_df = nfl_week_game_score_df[["game_id", "away_team", "home_team"]].merge(
+        user_picks_with_win_df[["game_id", "winning_pick", "correct_or_not"]].drop_duplicates("game_id"),
+        on="game_id", how="left")
+    away_team_color_array, home_team_color_array = make_team_color_arrays(matchup_picks_df)
+    matchup_list = (nfl_week_game_score_df["away_team"] + " @ " + nfl_week_game_score_df["home_team"]).tolist()
+    away_score_dict = dict(zip(matchup_list, nfl_week_game_score_df["away_score"].tolist()))
+    home_score_dict = dict(zip(matchup_list, nfl_week_game_score_df["home_score"].tolist()))
+    return away_score_dict, home_score_dict, away_team_color_array.tolist(), home_team_color_array.tolist()
+
+
+def make_plot_matchup_scores(away_score_dict, home_score_dict, away_team_color_list, home_team_color_list):
+    """
+    Function plots a weeks matchup on the xaxis and team scores on the yaxis. Color is used to show correct/incorrect and not picked
+    :param away_score_dict: Dict holding matchup as key and away score as value
+    :param home_score_dict: Dict holding matchup as key and home score as value
+    :param away_team_color_list: List holding color or away teams
+    :param home_team_color_list: List holding color or home teams
+    :return: Plotly bar chart object
+    """
+    import plotly.graph_objects as go
+    fig = go.Figure(data=[
+        go.Bar(x=list(home_score_dict.keys()), y=list(away_score_dict.values()), marker_color=away_team_color_list),
+        go.Bar(x=list(home_score_dict.keys()), y=list(home_score_dict.values()), marker_color=home_team_color_list)
+    ])
+    fig.update_layout(barmode='group', template="plotly_dark", xaxis=dict(showgrid=False), yaxis=dict(showgrid=False), showlegend=False)
+    return fig
+
+
+def make_revision(revision_df):
+    """
+    Function hashes the data a revision of recaps is rendered from into the revision directory's name
+    :param revision_df: Dataframe
+    :return: Hex digest
+    """
+    return hashlib.sha256(revision_df.to_csv(index=False).encode("utf-8")).hexdigest()[:16]
+
+
+def make_scores_revision(nfl_games_with_scores_df):
+    """
+    Function identifies the scores recaps are rendered from. A game going final or a score being corrected gives a
+    new revision, so recaps of older scores are never served
+    :param nfl_games_with_scores_df: Dataframe with game_id, away_score and home_score of every scored game
+    :return: Hex digest
+    """
+    revision_df = nfl_games_with_scores_df[["game_id", "away_score", "home_score"]].sort_values("game_id")
+    return make_revision(revision_df.astype({"away_score": "int64", "home_score": "int64"}))
+
+
+def make_grades_revision(league_grades_df):
+    """
+    Function identifies the grades of a league's recaps. Picks being imported or regraded give a new revision, so
+    recaps missing them are never served
+    :param league_grades_df: Dataframe returned by LEAGUE_GRADES_QUERY
+    :return: Hex digest
+    """
+    return make_revision(league_grades_df[["user_id", "graded_picks", "correct_picks",
+                                           "correct_games_hash"]].astype("int64"))
+
+
+def remove_stale_revision_dirs(parent_dir, revision, marker_name=None):
+    """
+    Function removes the revision directories under parent_dir other than the current one. Only directories named like
+    a revision (and holding marker_name, when given) are removed, so nothing else kept there is touched
+    :param parent_dir: directory holding revision directories
+    :param revision: current revision, kept
+    :param marker_name: name every revision directory holds, None to match on the name alone
+    :return: None
+    """
+    for revision_dir in Path(parent_dir).iterdir():
+        if (revision_dir.is_dir() and revision_dir.name != revision
+                and REVISION_DIR_NAME_PATTERN.fullmatch(revision_dir.name)
+                and (marker_name is None or (revision_dir / marker_name).is_dir())):
+            shutil.rmtree(revision_dir)
+    return None
+
+
+def make_base_figure_filepath(recap_dir, scores_revision, figure_name):
+    """
+    Function returns where the figure every user's figure of a name is built on is rendered
+    :param recap_dir: directory holding every revision's recaps
+    :param scores_revision: value returned by make_scores_revision
+    :param figure_name: WEEKS_PREDICTION_PCT_FIGURE or a formatted MATCHUP_SCORES_FIGURE
+    :return: Path
+    """
+    return Path(recap_dir) / scores_revision / BASE_FIGURE_DIR_NAME / "{}.json".format(figure_name)
+
+
+def make_user_recap_filepath(recap_dir, scores_revision, league_id, grades_revision, user_id):
+    """
+    Function returns where a user's recap traces are rendered
+    :param recap_dir: directory holding every revision's recaps
+    :param scores_revision: value returned by make_scores_revision
+    :param league_id: league id key
+    :param grades_revision: value returned by make_grades_revision for the league
+    :param user_id: user id key
+    :return: Path
+    """
+    return (Path(recap_dir) / scores_revision / "league_{}".format(league_id) / grades_revision
+            / "user_{}.json".format(user_id))
+
+
+def write_json_file(filepath, json_str):
+    """
+    Function writes a JSON file through a temporary file, so a page never reads one half written
+    :param filepath: destination path
+    :param json_str: string
+    :return: None
+    """
+    temporary_filepath = filepath.with_suffix(".tmp")
+    temporary_filepath.write_text(json_str, encoding="utf-8")
+    os.replace(temporary_filepath, filepath)
+    return None
+
+
+def make_base_figure_dict(nfl_games_with_scores_df):
+    """
+    Function makes the figures users' recaps are built on: the success rate plot with no weeks, and each scored
+    week's matchup scores with no picks
+    :param nfl_games_with_scores_df: Dataframe with every scored game
+    :return: Dictionary of figure name to Plotly JSON dictionary
+    """
+    import plotly.io as pio
+    empty_weeks_prediction_pct_df = pd.DataFrame(columns=["week", "correct_picks", "pct_correct"])
+    empty_picks_with_win_df = pd.DataFrame(columns=["game_id", "winning_pick", "correct_or_not"])
+    base_figure_dict = {WEEKS_PREDICTION_PCT_FIGURE: make_plot_user_weeks_prediction_pct(empty_weeks_prediction_pct_df)}
+    for week in sorted(int(week) for week in nfl_games_with_scores_df["week"].unique()):
+        base_figure_dict[MATCHUP_SCORES_FIGURE.format(week)] = make_plot_matchup_scores(
+            *pipeline_make_matchup_dicts_team_color_logic(nfl_games_with_scores_df, week, empty_picks_with_win_df))
+    return {figure_name: json.loads(pio.to_json(fig)) for figure_name, fig in base_figure_dict.items()}
+
+
+def render_user_recaps_chunk(recap_dir, scores_revision, league_id, grades_revision, nfl_games_with_scores_df,
+                             chunk_weeks_prediction_pct_df, chunk_picks_with_win_df):
+    """
+    Function renders the recaps of a chunk of users. Every pick of the chunk is colored at once, then each user's
+    figures are written as the trace properties that differ from the base figures': the x and y of the success rate
+    plot and the marker colors of each week's matchup scores
+    :param recap_dir: directory holding every revision's recaps
+    :param scores_revision: value returned by make_scores_revision
+    :param league_id: league id key
+    :param grades_revision: value returned by make_grades_revision for the league
+    :param nfl_games_with_scores_df: Dataframe with every scored game
+    :param chunk_weeks_prediction_pct_df: Dataframe returned by LEAGUE_WEEKS_PREDICTION_PCT_QUERY for the chunk
+    :param chunk_picks_with_win_df: Dataframe returned by LEAGUE_PICKS_WITH_WIN_QUERY for the chunk
+    :return: Number of figures rendered
+    """
+    games_df = nfl_games_with_scores_df.reset_index(drop=True)
+    week_array = games_df["week"].to_numpy()
+    week_index_dict = {int(week): np.flatnonzero(week_array == week) for week in np.unique(week_array)}
+    picks_df = chunk_picks_with_win_df.drop_duplicates(["user_id", "game_id"]).merge(
+        games_df[["game_id", "away_team", "home_team"]].rename_axis("game_index").reset_index(), on="game_id")
+    picks_df["away_color"], picks_df["home_color"] = make_team_color_arrays(picks_df)
+    picks_by_user_dict = dict(list(picks_df.groupby("user_id")))
+    figure_count = 0
+    for user_id, user_weeks_prediction_pct_df in chunk_weeks_prediction_pct_df.groupby("user_id"):
+        weeks_str = [str(week) for week in user_weeks_prediction_pct_df["week"].tolist()]
+        user_recap_dict = {WEEKS_PREDICTION_PCT_FIGURE: [
+            {"x": weeks_str, "y": user_weeks_prediction_pct_df["correct_picks"].tolist()},
+            {"x": weeks_str, "y": user_weeks_prediction_pct_df["pct_correct"].tolist()}]}
+        away_team_color_array = np.full(len(games_df), NEUTRAL_COLOR, dtype=object)
+        home_team_color_array = np.full(len(games_df), NEUTRAL_COLOR, dtype=object)
+        if user_id in picks_by_user_dict:
+            user_picks_df = picks_by_user_dict[user_id]
+            away_team_color_array[user_picks_df["game_index"].to_numpy()] = user_picks_df["away_color"].to_numpy()
+            home_team_color_array[user_picks_df["game_index"].to_numpy()] = user_picks_df["home_color"].to_numpy()
+        for week, week_index_array in week_index_dict.items():
+            user_recap_dict[MATCHUP_SCORES_FIGURE.format(week)] = [
+                {"marker": {"color": away_team_color_array[week_index_array].tolist()}},
+                {"marker": {"color": home_team_color_array[week_index_array].tolist()}}]
+        write_json_file(make_user_recap_filepath(recap_dir, scores_revision, league_id, grades_revision, user_id),
+                        json.dumps(user_recap_dict, separators=(",", ":")))
+        figure_count += len(user_recap_dict)
+    return figure_count
+
+
+def make_user_chunk_list(league_weeks_prediction_pct_df, league_picks_with_win_df, chunk_size):
+    """
+    Function splits a league's recap data into chunks of users, one task each
+    :param league_weeks_prediction_pct_df: Dataframe returned by LEAGUE_WEEKS_PREDICTION_PCT_QUERY
+    :param league_picks_with_win_df: Dataframe returned by LEAGUE_PICKS_WITH_WIN_QUERY
+    :param chunk_size: users per chunk
+    :return: List of (weeks prediction pct Dataframe, picks with win Dataframe) tuples
+    """
+    user_id_array = league_weeks_prediction_pct_df["user_id"].unique()
+    user_chunk_list = list()
+    for start in range(0, len(user_id_array), chunk_size):
+        chunk_user_id_array = user_id_array[start:start + chunk_size]
+        user_chunk_list.append((
+            league_weeks_prediction_pct_df[league_weeks_prediction_pct_df["user_id"].isin(chunk_user_id_array)],
+            league_picks_with_win_df[league_picks_with_win_df["user_id"].isin(chunk_user_id_array)]))
+    return user_chunk_list
+
+
+def pipeline_render_recaps(database, recap_dir=RECAP_DIR, league_id_list=None, workers=None,
+                           chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Function pipelines the process required to render every graded user's recaps under the current scores revision
+    and their league's grades revision, across a process pool. Each league's data is read in two queries and its users
+    are sent to the workers in chunks. Older revisions are removed once every league is rendered
+    :param database: DatabaseConnectionManager object
+    :param recap_dir: directory holding every revision's recaps
+    :param league_id_list: leagues to render, None for every league
+    :param workers: number of worker processes - None uses every CPU, 1 renders in process
+    :param chunk_size: users per task
+    :return: scores revision, number of users, number of figures
+    """
+    nfl_games_with_scores_df = database.read_sql_df(SCORED_GAMES_QUERY)
+    scores_revision = make_scores_revision(nfl_games_with_scores_df)
+    for figure_name, figure_dict in make_base_figure_dict(nfl_games_with_scores_df).items():
+        base_figure_filepath = make_base_figure_filepath(recap_dir, scores_revision, figure_name)
+        base_figure_filepath.parent.mkdir(parents=True, exist_ok=True)
+        write_json_file(base_figure_filepath, json.dumps(figure_dict))
+    if league_id_list is None:
+        league_id_list = [league_id for (league_id,) in database.fetchall(LEAGUE_ID_QUERY)]
+    task_list = list()
+    grades_revision_dict = dict()
+    for league_id in league_id_list:
+        # Grades are read first, so grading during the run leaves recaps under the older revision, never served
+        grades_revision = make_grades_revision(database.read_sql_df(LEAGUE_GRADES_QUERY,
+                                                                    params={"league_id": league_id}))
+        grades_revision_dict[league_id] = grades_revision
+        make_user_recap_filepath(recap_dir, scores_revision, league_id, grades_revision, 0).parent.mkdir(
+            parents=True, exist_ok=True)
+        league_weeks_prediction_pct_df = database.read_sql_df(LEAGUE_WEEKS_PREDICTION_PCT_QUERY,
+                                                              params={"league_id": league_id})
+        league_picks_with_win_df = database.read_sql_df(LEAGUE_PICKS_WITH_WIN_QUERY, params={"league_id": league_id})
+        for chunk_weeks_prediction_pct_df, chunk_picks_with_win_df in make_user_chunk_list(
+                league_weeks_prediction_pct_df, league_picks_with_win_df, chunk_size):
+            task_list.append((recap_dir, scores_revision, league_id, grades_revision, nfl_games_with_scores_df,
+                              chunk_weeks_prediction_pct_df, chunk_picks_with_win_df))
+    user_count = sum(task[5]["user_id"].nunique() for task in task_list)
+    if workers == 1:
+        figure_count = sum(render_user_recaps_chunk(*task) for task in task_list)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            figure_count = sum(executor.map(render_user_recaps_chunk, *zip(*task_list)))
+    for league_id, grades_revision in grades_revision_dict.items():
+        remove_stale_revision_dirs(make_user_recap_filepath(recap_dir, scores_revision, league_id, grades_revision,
+                                                            0).parents[1], grades_revision)
+    remove_stale_revision_dirs(recap_dir, scores_revision, BASE_FIGURE_DIR_NAME)
+    return scores_revision, user_count, figure_count
+
+
+def read_user_recap_dict(recap_dir, scores_revision, league_id, grades_revision, user_id):
+    """
+    Function reads a user's rendered recap traces
+    :param recap_dir: directory holding every revision's recaps
+    :param scores_revision: value returned by make_scores_revision
+    :param league_id: league id key
+    :param grades_revision: value returned by make_grades_revision for the league
+    :param user_id: user id key
+    :return: Dictionary of figure name to trace properties, None if the user's recaps haven't been rendered
+    """
+    try:
+        return json.loads(make_user_recap_filepath(recap_dir, scores_revision, league_id, grades_revision,
+                                                   user_id).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+@functools.lru_cache(maxsize=64)
+def read_base_figure_dict(recap_dir, scores_revision, figure_name):
+    """
+    Function reads a base figure. They never change once a revision is rendered, so each is read once per process
+    :param recap_dir: directory holding every revision's recaps
+    :param scores_revision: value returned by make_scores_revision
+    :param figure_name: WEEKS_PREDICTION_PCT_FIGURE or a formatted MATCHUP_SCORES_FIGURE
+    :return: Plotly JSON dictionary, None if it hasn't been rendered
+    """
+    try:
+        return json.loads(make_base_figure_filepath(recap_dir, scores_revision, figure_name).read_text(
+            encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def make_recap_figure(user_recap_dict, recap_dir, scores_revision, figure_name):
+    """
+    Function makes a user's pre-rendered recap figure from their traces and the base figure
+    :param user_recap_dict: Dictionary returned by read_user_recap_dict
+    :param recap_dir: directory holding every revision's recaps
+    :param scores_revision: value returned by make_scores_revision
+    :param figure_name: WEEKS_PREDICTION_PCT_FIGURE or a formatted MATCHUP_SCORES_FIGURE
+    :return: Plotly object, None if it hasn't been rendered
+    """
+    import plotly.graph_objects as go
+    if user_recap_dict is None or figure_name not in user_recap_dict:
+        return None
+    base_figure_dict = read_base_figure_dict(recap_dir, scores_revision, figure_name)
+    if base_figure_dict is None:
+        return None
+    data = [dict(base_trace, **user_trace) for base_trace, user_trace in zip(base_figure_dict["data"],
+                                                                             user_recap_dict[figure_name])]
+    return go.Figure({"data": data, "layout": base_figure_dict["layout"]})
+
+
+@click.command()
+@click.option("--league-id", "league_id_list", type=int, multiple=True,
+              help="League to render, repeat for several. Defaults to every league.")
+@click.option("--workers", type=int, default=None, help="Worker processes, defaults to every CPU.")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Users per worker task.")
+@click.option("--recap-dir", type=click.Path(file_okay=False), default=str(RECAP_DIR),
+              help="Directory the recaps are rendered into.")
+def main(league_id_list, workers, chunk_size, recap_dir):
+    """ Renders every graded user's Analytics recap figures (success rate by week and each week's matchup scores)
+        from the current scores into the recap directory, for the page to serve instead of building them per view.
+    """
+    from src.data.database import DatabaseConnectionManager, make_connection_kwargs_from_env
+    logger = logging.getLogger(__name__)
+    database = DatabaseConnectionManager(make_connection_kwargs_from_env(), max_connections=1)
+    start = time.perf_counter()
+    scores_revision, user_count, figure_count = pipeline_render_recaps(
+        database, Path(recap_dir), list(league_id_list) or None, workers, chunk_size)
+    elapsed = time.perf_counter() - start
+    logger.info("rendered %s figures for %s users of scores revision %s in %.1fs (%s workers)", figure_count,
+                user_count, scores_revision, elapsed, workers or os.cpu_count())
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
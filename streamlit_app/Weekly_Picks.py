@@ -1,84 +1,83 @@
 import streamlit as st
+import sys
+import logging
+from pathlib import Path
 import datetime
 import pandas as pd
-import nfl_data_py as nfl
-from PIL import Image
 import psycopg2
-from psycopg2 import Error
-from sqlalchemy import create_engine
+from psycopg2.extras import execute_values
 import pytz
-import requests
 import hashlib
-
-
-# Vars
-USER = st.secrets["USER"]
-PASSWORD = st.secrets["PASSWORD"]
-DATABASE_NAME = st.secrets["DATABASE_NAME"]
-HOST = st.secrets["HOST"]
-PORT = st.secrets["PORT"]
-
-
-
-
+import secrets
+
+PROJECT_DIR = str(Path(__file__).resolve().parents[1])
+if PROJECT_DIR not in sys.path:
+    sys.path.append(PROJECT_DIR)
+from src.data.cache_warming import CacheWarmer
+from src.data.database import DatabaseUnavailableError, make_shared_connection_manager
+from src.data.page_queries import (GRADE_GAMES_QUERY, GRADED_PICKS_QUERY, INSERT_LEAGUE_MEMBER_QUERY, INSERT_LEAGUE_QUERY,
+                                   INSERT_NFL_GAMES_QUERY, INSERT_NFL_TEAMS_QUERY, INSERT_USER_QUERY,
+                                   INSERT_USER_WINNING_PICK_QUERY, LEAGUE_ID_FROM_INVITE_CODE_QUERY, LOGIN_CHECK_QUERY,
+                                   UNIQUE_EMAIL_QUERY, UNIQUE_LEAGUE_NAME_QUERY, UNIQUE_USERNAME_QUERY,
+                                   UPSERT_GAME_SCORES_QUERY, USER_ID_FROM_USERNAME_QUERY, USER_LEAGUES_QUERY,
+                                   USER_WEEKLY_PICKS_QUERY)
+from src.data.pick_submission_queue import PickSubmissionQueue
+from src.features.league_standings import REFRESH_LEAGUE_STANDINGS_QUERY
+from src.features.pick_consensus import WEEK_PICK_CONSENSUS_QUERY, WeekPickConsensus
+from src.features.schedule import load_compact_schedule_df, make_week_slice
+from src.models.predict_model import make_schedule_predictions_df, make_schedule_revision, read_pick_model
+
+
+logger = logging.getLogger(__name__)
+
+DATABASE_UNAVAILABLE_MESSAGE = "The database is temporarily unavailable. Please try again in a minute."
 NON_UNIQUE_USERNAME = "Username already exists. Please try again with a different one"
 NON_UNIQUE_EMAIL = "Email already exists. Please try again with a different one"
+NON_UNIQUE_LEAGUE_NAME = "League name already exists. Please try again with a different one"
+INVALID_INVITE_CODE = "No league has that invite code. Please check it and try again"
+NO_LEAGUE_MESSAGE = "You aren't in a league yet. Create one or join one with an invite code from the sidebar."
 USER_CREATION_SUCCESS_MESSAGE = "Successfully executed the command"
-WEEK_SCHEDULE_COLUMN_LIST = ["game_id", "week", "gameday", "weekday", "gametime", "away_team",
-                             "home_team",
-                           "away_rest", "home_rest", "spread_line", "stadium"]
-WEEK_COLUMN = "week"
+SUBMISSION_PENDING_MESSAGE = "Your picks are taking longer than usual to save. Please check them again in a minute."
+AUTO_FILL_NOTHING_MESSAGE = "Every game of the week you can still pick already has your pick."
+PICKS_LOCKED_MESSAGE = "These games had already kicked off, so their picks weren't changed: {}"
+PICKS_REJECTED_MESSAGE = "These games aren't in the schedule, so their picks weren't saved: {}"
+# Submissions are flushed every few hundred milliseconds, this only runs out if the database is struggling
+SUBMISSION_TIMEOUT_SECONDS = 10
+SEASON = 2022
+# Scores and grades change when games end, so they are reread every minute rather than cached for the process
+SCORES_TTL_SECONDS = 60
+GRADED_PICKS_DTYPE_DICT = {"user_id": "int32", "game_key": "int32", "week": "int8"}
+PICKS_DTYPE_DICT = {"winning_pick": "category"}
 TEXT_AT_SIGN = "@"
 TEXT_DASH_SIGN = "-"
 TEXT_REST = "rested"
 TEXT_DAYS = "days"
 TEXT_SPREAD = "Spread is"
 TEXT_SPACE = " "
-TEAM_LOGO_LOCATIONS_DF = pd.read_csv(
-    r"https://github.com/JaumeClave/nfl_weekly_picks/blob/master/data/processed/team_logo_file_locations.csv?raw=true")
+TEXT_POOL_PICKS = "Pool picks:"
+TEXT_MODEL_PICK = "Model:"
+TEAM_LOGO_LOCATIONS_FILEPATH = Path(PROJECT_DIR) / "data" / "processed" / "team_logo_file_locations.csv"
+CARD_LOGO_DIR = Path(PROJECT_DIR) / "references" / "logos" / "card"
 START_HEADER_CENTERED_HTML = "<h1 style='text-align: center;'>"
 END_HEADER_HTML_HTML = "</h1>"
 START_PARAGRAPH_HTML = "<p style='text-align: center;'>"
 END_PARAGRAPH_HTML = "</p>"
-
-
-def connect_to_postgres_database(user, password, database, host="127.0.0.1", port="5432"):
-    """
-    Function connects to a database and returns the cursor object
-    :param user: database username
-    :param password: database password
-    :param database: database name
-    :param host: server location
-    :param port: listening port
-    :return: psycopg2 cursor object
-    """
-    try:
-        con = psycopg2.connect(user=user,
-                               password=password,
-                               database=database,
-                               host=host,
-                               port=port)
-        cursor = con.cursor()
-    except (Exception, Error) as error:
-        print("Error while connecting to PostgreSQL", error)
-    return con, cursor
+# Statements every rerun of every session runs, prepared once per pooled connection
+PREPARED_STATEMENT_DICT = {"user_weekly_picks": USER_WEEKLY_PICKS_QUERY}
 
 
 def cursor_execute_tuple(command, data_tuple):
     """
-    Function uses the cursor object to execute a command with a tuple pair. It commits and rollsback if error
+    Function uses the connection manager to execute a command with a tuple pair. It commits, or rolls back and logs
+    the error. DatabaseUnavailableError is raised for the page to report
     :param command: SQL query to be executed
     :param data_tuple: data pairing for SQL query variables
     :return:
     """
     try:
-        cursor.execute(command, data_tuple)
-        con.commit()
-        print("Successfully executed the command")
-    except (Exception, psycopg2.DatabaseError) as error:
-        print("Error: %s" % error)
-        con.rollback()
-        print("Could not successfully execute the command")
+        database.execute(command, data_tuple)
+    except psycopg2.Error:
+        logger.exception("could not execute %s", " ".join(command.split())[:80])
     return None
 
 
@@ -88,11 +87,7 @@ def make_check_for_unique_username(username_value):
     :param username_value: username
     :return: False - if not unique
     """
-    insert_command = """SELECT username FROM users
-                        WHERE username = %s
-                        LIMIT 1;"""
-    cursor.execute(insert_command, [username_value])
-    returned_value = cursor.fetchall()
+    returned_value = database.fetchall(UNIQUE_USERNAME_QUERY, {"username": username_value})
     if len(returned_value) != 0:
         return False
 
@@ -103,11 +98,7 @@ def make_check_for_unique_email(email_value):
     :param email_value: email
     :return: False - if not unique
     """
-    insert_command = """SELECT email FROM users
-                        WHERE email = %s
-                        LIMIT 1;"""
-    cursor.execute(insert_command, [email_value])
-    returned_value = cursor.fetchall()
+    returned_value = database.fetchall(UNIQUE_EMAIL_QUERY, {"email": email_value})
     if len(returned_value) != 0:
         return False
 
@@ -160,11 +151,8 @@ def insert_user_in_user_table(username, password, email):
     else:
         hashed_password = make_hashes(password)
         date_created, time_created = make_date_time()
-        insert_command = """INSERT INTO users
-                      (username, password, email, date_created, time_created)
-                      VALUES (%s, %s, %s, %s, %s);"""
-        data_tuple = (username, hashed_password, email, date_created, time_created)
-        cursor_execute_tuple(insert_command, data_tuple)
+        cursor_execute_tuple(INSERT_USER_QUERY, {"username": username, "password": hashed_password, "email": email,
+                                                 "date_created": date_created, "time_created": time_created})
     return None
 
 
@@ -177,10 +165,7 @@ def make_username_password_login_check(username, password):
     :return: True/False
     """
     hashed_password = make_hashes(password)
-    insert_command = """SELECT * FROM users
-                        WHERE username = %s AND password = %s;"""
-    cursor.execute(insert_command, [username, hashed_password])
-    returned_value = cursor.fetchall()
+    returned_value = database.fetchall(LOGIN_CHECK_QUERY, {"username": username, "password": hashed_password})
     if len(returned_value) != 0:
         return True
     else:
@@ -193,23 +178,73 @@ def make_id_from_username(username):
     :param username: username
     :return: user_id
     """
-    insert_command = """SELECT user_id FROM users
-                        WHERE username = %s;"""
-    cursor.execute(insert_command, [username])
-    returned_value = cursor.fetchall()
+    returned_value = database.fetchall(USER_ID_FROM_USERNAME_QUERY, {"username": username})
     return returned_value[0][0]
 
 
-@st.cache(persist=True, show_spinner=False)
-def make_yearly_schedule(year):
+def make_user_leagues_df(user_id):
+    """
+    Function queries the leagues a user is a member of
+    :param user_id: user_id key
+    :return: Dataframe with league_id, league_name and invite_code columns
     """
-    Function returns a dataframe containing the provided years NFL schedule
-    :param year: year of schedule desired
-    :return: Pandas Dataframe
+    user_leagues_df = database.read_sql_df(USER_LEAGUES_QUERY, params={"user_id": user_id})
+    return user_leagues_df
+
+
+def make_check_for_unique_league_name(league_name):
     """
-    yearly_schedule_2022_df = nfl.import_schedules([year])
-    yearly_schedule_2022_df["gameday"] = pd.to_datetime(yearly_schedule_2022_df["gameday"]).dt.date
-    return yearly_schedule_2022_df
+    Function checks if the league name provided is unique in the league_name column of the leagues table
+    :param league_name: league name
+    :return: False - if not unique
+    """
+    returned_value = database.fetchall(UNIQUE_LEAGUE_NAME_QUERY, {"league_name": league_name})
+    if len(returned_value) != 0:
+        return False
+
+
+def make_league_id_from_invite_code(invite_code):
+    """
+    Function checks the leagues table and returns the league_id by referencing an invite code
+    :param invite_code: league invite code
+    :return: league_id - None if no league has the invite code
+    """
+    returned_value = database.fetchall(LEAGUE_ID_FROM_INVITE_CODE_QUERY, {"invite_code": invite_code.strip()})
+    if len(returned_value) == 0:
+        return None
+    return returned_value[0][0]
+
+
+def insert_league_in_leagues_table(league_name, user_id):
+    """
+    Function attempts to create a league with a random invite code and make its creator the first member. It first
+    checks to see if the league name is unique
+    :param league_name: league name
+    :param user_id: user_id key of the creator
+    :return: None
+    """
+    if make_check_for_unique_league_name(league_name) == False:
+        return NON_UNIQUE_LEAGUE_NAME
+    date_created, time_created = make_date_time()
+    cursor_execute_tuple(INSERT_LEAGUE_QUERY, {"league_name": league_name, "invite_code": secrets.token_hex(4),
+                                               "date_created": date_created, "user_id": user_id})
+    return None
+
+
+def insert_user_in_league_members_table(invite_code, user_id):
+    """
+    Function adds a user to the league holding the provided invite code. Joining a league twice does nothing
+    :param invite_code: league invite code
+    :param user_id: user_id key
+    :return: None
+    """
+    league_id = make_league_id_from_invite_code(invite_code)
+    if league_id is None:
+        return INVALID_INVITE_CODE
+    date_joined, time_joined = make_date_time()
+    cursor_execute_tuple(INSERT_LEAGUE_MEMBER_QUERY, {"league_id": league_id, "user_id": user_id,
+                                                      "date_joined": date_joined})
+    return None
 
 
 @st.cache(persist=True, show_spinner=False)
@@ -223,26 +258,68 @@ def make_nfl_game_scores_df(nfl_schedule_df):
     return games_with_scores_df
 
 
-def make_insert_into_nfl_game_scores_2022_table(game_id, week, away_team, away_score, home_team, home_score):
+def make_insert_into_nfl_games_table(nfl_schedule_df):
     """
-    Function inserts the a game_id and its features into the nfl_game_scores_2022 table
-    :param game_id: game id key
-    :param week: int - week number
-    :param away_team: game away team
-    :param away_score: game away score
-    :param home_team: game home team
-    :param home_score: game away score
+    Function inserts every game of a schedule into the nfl_games dimension table in one transaction, adding its teams
+    to the nfl_teams dimension table first. Games already in the table keep their game_key and take the new kickoff
+    :param nfl_schedule_df: Dataframe returned by load_compact_schedule_df
     :return: None
     """
-    query = """
-                 INSERT INTO nfl_game_scores_2022 (game_id, week, away_team, away_score, home_team, home_score)
-                 VALUES (%s, %s, %s, %s, %s, %s)
-                 ;
-            """
-    data_tuple = (game_id, week, away_team, away_score, home_team, home_score)
-    cursor_execute_tuple(query, data_tuple)
+    team_row_list = [(team,) for team in sorted(set(nfl_schedule_df["away_team"]) | set(nfl_schedule_df["home_team"]))]
+    game_row_list = [(game_id, int(season), int(week), away_team, home_team,
+                      None if pd.isna(kickoff) else kickoff.to_pydatetime())
+                     for game_id, season, week, away_team, home_team, kickoff in
+                     nfl_schedule_df[["game_id", "season", "week", "away_team", "home_team",
+                                      "kickoff"]].itertuples(index=False)]
+
+    def operation(con):
+        with con.cursor() as cursor:
+            execute_values(cursor, INSERT_NFL_TEAMS_QUERY, team_row_list)
+            execute_values(cursor, INSERT_NFL_GAMES_QUERY, game_row_list,
+                           template="(%s, %s, %s, %s, %s, %s::timestamp)", page_size=len(game_row_list))
+        con.commit()
+    database.run(operation)
+    return None
+
+
+@st.cache(persist=True, show_spinner=False)
+def pipeline_make_insert_into_nfl_games_table(nfl_schedule_df):
+    """
+    Function pipelines the process required to add every scheduled game to the nfl_games dimension table so picks can
+    be keyed by game_key before kickoff
+    :return: None
+    """
+    if not nfl_schedule_df.empty:
+        make_insert_into_nfl_games_table(nfl_schedule_df)
     return None
 
+
+def make_insert_into_nfl_game_scores_2022_table(nfl_games_with_scores_df):
+    """
+    Function inserts every scored game into the nfl_game_scores_2022 table in one statement, updating the scores of
+    the game_ids already in that table. Every league's picks of the games whose score is new or changed are graded
+    and the league standings refreshed in the same transaction, whether or not the live-score poller runs. A game
+    missing from nfl_games raises instead of being skipped
+    :param nfl_games_with_scores_df: Dataframe returned by make_nfl_game_scores_df
+    :return: None
+    """
+    score_row_list = [(game_id, int(week), away_team, int(away_score), home_team, int(home_score))
+                      for game_id, week, away_team, away_score, home_team, home_score in nfl_games_with_scores_df[[
+                          "game_id", "week", "away_team", "away_score", "home_team",
+                          "home_score"]].itertuples(index=False)]
+
+    def operation(con):
+        with con.cursor() as cursor:
+            game_key_list = [row[0] for row in execute_values(cursor, UPSERT_GAME_SCORES_QUERY, score_row_list,
+                                                              page_size=len(score_row_list), fetch=True)]
+            if game_key_list:
+                cursor.execute(GRADE_GAMES_QUERY, {"game_key_list": game_key_list})
+                cursor.execute(REFRESH_LEAGUE_STANDINGS_QUERY)
+        con.commit()
+    database.run(operation)
+    return None
+
+
 @st.cache(persist=True, show_spinner=False)
 def pipeline_make_insert_into_nfl_game_scores_2022_table(nfl_schedule_df):
     """
@@ -250,10 +327,8 @@ def pipeline_make_insert_into_nfl_game_scores_2022_table(nfl_schedule_df):
     :return: None
     """
     nfl_games_with_scores_df = make_nfl_game_scores_df(nfl_schedule_df)
-    for index, row in nfl_games_with_scores_df.iterrows():
-        make_insert_into_nfl_game_scores_2022_table(row["game_id"], row["week"],
-                                                    row["away_team"], row["away_score"],
-                                                    row["home_team"], row["home_score"])
+    if not nfl_games_with_scores_df.empty:
+        make_insert_into_nfl_game_scores_2022_table(nfl_games_with_scores_df)
     return nfl_games_with_scores_df
 
 
@@ -263,21 +338,20 @@ def make_current_nfl_week_number(yearly_schedule):
     :param yearly_schedule: Dataframe containing the provided years NFL schedule
     :return: Current NFL week - int
     """
-    current_date = datetime.datetime.now().date()
-    dates_less_than_today = yearly_schedule[yearly_schedule["gameday"] <= current_date]
-    current_week = dates_less_than_today["week"].max()
+    tomorrow = pd.Timestamp(datetime.datetime.now().date()) + pd.Timedelta(days=1)
+    current_week = yearly_schedule.loc[yearly_schedule["kickoff"] < tomorrow, "week"].max()
     return current_week
 
 
 def make_week_schedule(yearly_schedule_df, week_number):
     """
-    Function returns a dataframe containing home & away team & rest, kickoff time and day and spread
-    :param week_number:
-    :return:
+    Function returns a dataframe containing home & away team & rest, kickoff time and day and spread, in kickoff order.
+    A view of the shared yearly schedule, so it must not be modified
+    :param yearly_schedule_df: Dataframe returned by load_compact_schedule_df
+    :param week_number: NFL week number
+    :return: Dataframe
     """
-    yearly_week_schedule_df = yearly_schedule_df[yearly_schedule_df[WEEK_COLUMN] == week_number]
-    week_schedule_df = yearly_week_schedule_df[WEEK_SCHEDULE_COLUMN_LIST]
-    week_schedule_df.sort_values(["gameday", "gametime"], axis=0, ascending=True, inplace=True)
+    week_schedule_df = make_week_slice(yearly_schedule_df, week_number)
     return week_schedule_df
 
 
@@ -371,16 +445,32 @@ def pipeline_make_matchup_text_lists(weekly_schedule):
     return all_matchup_list
 
 
-@st.cache(persist=True, show_spinner=False, allow_output_mutation=True)
+@st.cache(show_spinner=False)
+def make_team_logo_locations_df():
+    """
+    Function reads the team logo locations from the repository copy, so no network read happens before a logo is drawn
+    :return: Dataframe with team and picture_location columns
+    """
+    team_logo_locations_df = pd.read_csv(TEAM_LOGO_LOCATIONS_FILEPATH)
+    return team_logo_locations_df
+
+
+@st.cache(show_spinner=False, allow_output_mutation=True)
 def make_team_logo_image(team_acronym):
     """
-    Function creates and Pillow image object from a specified file path loaded up from a dataframe
+    Function returns a team's matchup card logo as PNG bytes, pre-encoded by src.visualization.make_logo_variants.
+    st.image passes PNG bytes through as they are, so reruns don't re-encode any logo. Falls back to downloading the
+    full size logo when the card variant hasn't been built
     :param team_acronym: Acronym of team name
-    :return: Rendered image of team logo
+    :return: PNG bytes of team logo
     """
-    image_location = TEAM_LOGO_LOCATIONS_DF[TEAM_LOGO_LOCATIONS_DF["team"] == team_acronym]["picture_location"].iloc[0]
-    logo = Image.open(requests.get(image_location, stream=True).raw)
-    return logo
+    card_logo_filepath = CARD_LOGO_DIR / "{}.png".format(team_acronym)
+    if card_logo_filepath.exists():
+        return card_logo_filepath.read_bytes()
+    import requests
+    team_logo_locations_df = make_team_logo_locations_df()
+    image_location = team_logo_locations_df[team_logo_locations_df["team"] == team_acronym]["picture_location"].iloc[0]
+    return requests.get(image_location).content
 
 
 def add_values_in_dict(dictionary, key, list_of_values):
@@ -410,20 +500,6 @@ def make_gameday_gameid_home_away(all_matchup_list):
     return game_daytime, game_id, home_team, away_team
 
 
-def make_weekly_picks_df(weekly_picks_dict, user_id):
-    """
-    Function creates a dataframe containing user_id and the users respective weekly matchup winning picks
-    :param weekly_picks_dict: Dictionary containing game_id as a key and the winning pick as a value
-    :param user_id: ID of user
-    :return: Dataframe containing user id and weekly winning picks
-    """
-    weekly_picks_df = pd.DataFrame(weekly_picks_dict).T.reset_index()
-    weekly_picks_df.columns = ["game_id", "winning_pick"]
-    weekly_picks_df["user_id"] = user_id
-    weekly_picks_df["user_id_game_id"] = weekly_picks_df["user_id"].astype(str) + "_" + weekly_picks_df["game_id"]
-    return weekly_picks_df
-
-
 def make_gamedaytime_timedelta(week_schedule_df, game_id):
     """
     Function makes a timestamp from a game_id
@@ -431,10 +507,7 @@ def make_gamedaytime_timedelta(week_schedule_df, game_id):
     :param game_id: game_id key
     :return: Timestamp
     """
-    gametime_df = week_schedule_df[["game_id", "gameday", "gametime", "weekday"]]
-    gametime_df["gamedaytime"] = gametime_df["gameday"].astype(str) + " " + gametime_df["gametime"]
-    gametime_df["gamedaytime"] = pd.to_datetime(gametime_df["gamedaytime"])
-    timestamp = gametime_df[gametime_df["game_id"] == game_id]["gamedaytime"].iloc[0]
+    timestamp = week_schedule_df.loc[week_schedule_df["game_id"] == game_id, "kickoff"].iloc[0]
     return timestamp
 
 
@@ -511,186 +584,243 @@ def pipeline_make_countdown_text(week_schedule_df, game_id):
     return days, hours, minutes, countdown_text
 
 
-def make_current_picks_df(user_id):
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def make_pick_submission_queue():
     """
-    Function queries the user_weekly_picks table and returns a Pandas DataFrame for the specified users data
-    :param user_id: user_id key
-    :return: Dataframe
+    Function starts the write-behind queue every session submits its picks through, once per process
+    :return: PickSubmissionQueue object
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """
-         SELECT user_id, game_id, winning_pick
-         FROM user_weekly_picks
-         WHERE user_id=%(user_id)s
-         ;
-         """
-    current_picks_df = pd.read_sql_query(query, con=engine, params={"user_id": user_id})
-    return current_picks_df
+    return PickSubmissionQueue(database).start()
 
 
-def make_insert_into_weekly_picks_table(user_id_game_id, user_id, game_id, winning_pick, timestamp):
+def pipeline_submit_weekly_picks(weekly_picks_dict, user_id, league_id, week_pick_consensus):
     """
-    Function inserts the user_weekly_picks into the weekly_picks table. It uses the INSERT INTO along with the ON CONFLICT DO UPDATE SET clause in order to update the user_weekly_picks field when the user_id_game_id is already in that table
-    :param user_id_game_id: user_id and game_id key
-    :param user_id: user_id key
-    :param game_id: game_id key
-    :param winning_pick: winning team pick
-    :param timestamp: datetime
-    :return: None
+    Function pipelines the process required to submit the weekly picks. They go through the write-behind queue, which
+    batches them with every other session's and skips picks which are unchanged or whose game has kicked off, and
+    returns once they are committed. The picks written are applied to the cached league consensus
+    :param weekly_picks_dict: Dictionary containing game_id as a key and a list with the winning pick as a value
+    :param user_id: ID of user
+    :param league_id: ID of the league the picks are made in
+    :param week_pick_consensus: WeekPickConsensus object of the week
+    :return: PickSubmission object, None if it wasn't committed in time
     """
-    query = """
-                 INSERT INTO user_weekly_picks (user_id_game_id, user_id, game_id, winning_pick, timestamp_added)
-                 VALUES (%s, %s, %s, %s, %s)
-                 ON CONFLICT (user_id_game_id) DO UPDATE SET
-                 (user_id, game_id, winning_pick, timestamp_added) = (EXCLUDED.user_id, EXCLUDED.game_id, EXCLUDED.winning_pick, EXCLUDED.timestamp_added);
-            """
-    data_tuple = (user_id_game_id, user_id, game_id, winning_pick, timestamp)
-    cursor_execute_tuple(query, data_tuple)
-    return None
+    pick_dict = {game_id: pick_list[0] for game_id, pick_list in weekly_picks_dict.items()}
+    submission = make_pick_submission_queue().submit(league_id, user_id, pick_dict)
+    if not submission.wait(SUBMISSION_TIMEOUT_SECONDS):
+        return None
+    # Only picks the flush committed move the consensus, a failed flush leaves it as the database has it
+    if submission.error is None:
+        for game_id, previous_pick, winning_pick in submission.changed_pick_list:
+            week_pick_consensus.apply_pick_change(game_id, previous_pick, winning_pick)
+    return submission
 
 
-def make_logical_insert_into_weekly_picks_table(weekly_picks_df):
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def make_pick_model():
     """
-    Function holds the logic used to insert matchups when they don't exist and update them when they differ from their current value
-    :param weekly_picks_df: Dataframe containing user id and weekly winning picks
-    :return:
+    Function reads the auto-pick model once per process
+    :return: Dictionary returned by read_pick_model
     """
-    current_picks_df = make_current_picks_df(user_id)
-    timestamp = datetime.datetime.now()
-    for index, row in weekly_picks_df.iterrows():
-        temp_df = current_picks_df[current_picks_df["game_id"] == row["game_id"]]
-        if len(temp_df) == 0: # If not game_id record exists then upload matchup
-            make_insert_into_weekly_picks_table(row["user_id_game_id"], row["user_id"], row["game_id"], row["winning_pick"], timestamp)
-        elif temp_df["winning_pick"].iloc[0] == row["winning_pick"]: # If game_id exists and winning pick is unchanged then pass
-            pass
-        elif temp_df["winning_pick"].iloc[0] != row["winning_pick"]: # If game_id exists and winning pick is different then upload matchup
-            make_insert_into_weekly_picks_table(row["user_id_game_id"], row["user_id"], row["game_id"], row["winning_pick"], timestamp)
-    return None
+    return read_pick_model()
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
-def pipeline_make_insert_into_weekly_picks_table(weekly_picks_dict, user_id):
+@st.cache(allow_output_mutation=True, show_spinner=False, hash_funcs={pd.DataFrame: make_schedule_revision})
+def make_schedule_predictions(pick_model, yearly_schedule_df):
     """
-    Function pipelines the process required to insert the weekly_picks_df into the weekly_picks table
-    :param weekly_picks_dict: Dictionary containing game_id as a key and the winning pick as a value
-    :param user_id: ID of user
+    Function predicts every game of the season in one batch. Cached per schedule revision, so the model only runs
+    again when a spread, rest or matchup changes, never on a rerun
+    :param pick_model: Dictionary returned by make_pick_model
+    :param yearly_schedule_df: Dataframe returned by load_compact_schedule_df
+    :return: Dataframe returned by make_schedule_predictions_df, indexed by game_id
     """
-    weekly_picks_df = make_weekly_picks_df(weekly_picks_dict, user_id)
-    make_logical_insert_into_weekly_picks_table(weekly_picks_df)
-    return None
+    return make_schedule_predictions_df(pick_model, yearly_schedule_df).set_index("game_id", drop=False)
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
+def make_auto_fill_picks_dict(week_schedule_df, user_weekly_picks_df):
+    """
+    Function makes the model's picks for the week's games the user hasn't picked and which haven't kicked off
+    :param week_schedule_df: Dataframe containing a weeks NFL schedule
+    :param user_weekly_picks_df: Dataframe returned by make_user_weekly_picks_df
+    :return: Dictionary with game_id as a key and a list with the model's pick as a value
+    """
+    time_now = datetime.datetime.now(tz=pytz.timezone('US/Eastern')).replace(tzinfo=None)
+    open_games_df = week_schedule_df[(week_schedule_df["kickoff"] > time_now) &
+                                     ~week_schedule_df["game_id"].isin(user_weekly_picks_df["game_id"])]
+    model_pick_series = schedule_predictions_df.loc[open_games_df["game_id"], "model_pick"]
+    return {game_id: [model_pick] for game_id, model_pick in model_pick_series.items()}
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
 def make_database_games_with_scores_df():
     """
     Function queries the nfl_game_scores_2022 table and returns a Pandas DataFrame
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
     query = """
          SELECT week, away_team, away_score, home_team, home_score
          FROM nfl_game_scores_2022
          ;
          """
-    database_games_with_scores_df = pd.read_sql_query(query, con=engine)
+    database_games_with_scores_df = database.read_replica_sql_df(query)
     return database_games_with_scores_df
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
-def make_games_with_scores_df():
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
+def make_games_with_scores_df(league_id):
     """
-    Function creates a dataframe with a users chosen games and a flag for correct matchup pick
-    :param user_id: user id key
+    Function creates a dataframe with a leagues chosen games and a flag for correct matchup pick. Cached per league so
+    grading one league never waits on another
+    :param league_id: league id key
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """
-        WITH nfl_game_scores_2022 AS (
-            SELECT week, game_id,
-                CASE
-                    WHEN away_score > home_score THEN away_team
-                    WHEN away_score < home_score THEN home_team
-                    WHEN away_score = home_score THEN 'TIE'
-                END AS winning_team
-            FROM nfl_game_scores_2022
-        ),
-            user_weekly_picks AS (
-            SELECT user_id_game_id, user_id, game_id, winning_pick
-            FROM user_weekly_picks
-        ),
-            left_join_above AS (
-            SELECT usr.user_id_game_id, usr.user_id, nfl.game_id, nfl.week,
-                CASE
-                    WHEN usr.winning_pick = nfl.winning_team THEN 1
-                    WHEN usr.winning_pick != nfl.winning_team THEN 0
-                END AS correct_pick_flag
-            FROM nfl_game_scores_2022 nfl
-            LEFT JOIN user_weekly_picks usr
-                ON nfl.game_id = usr.game_id
-            WHERE usr.user_id_game_id IS NOT NULL
-        )
-         SELECT * FROM left_join_above ;
-         """
-    database_games_with_scores_df = pd.read_sql_query(query, con=engine)
+    database_games_with_scores_df = database.read_sql_df(GRADED_PICKS_QUERY, params={"league_id": league_id},
+                                                         dtype=GRADED_PICKS_DTYPE_DICT)
     return database_games_with_scores_df
 
 
 @st.cache(allow_output_mutation=True, show_spinner=False)
-def make_insert_into_user_winning_picks_table(user_id_game_id, user_id, game_id, week, correct_pick_flag):
+def make_insert_into_user_winning_picks_table(user_id_game_id, user_id, league_id, game_id, game_key, week,
+                                              correct_pick_flag):
     """
     Function inserts picks into the winning picks table
     :param user_id_game_id: user and game id key
     :param user_id: user_id key
+    :param league_id: league_id key
     :param game_is:  game_id key
+    :param game_key: integer surrogate key of the game
     :param week: int - week
     :param correct_pick_flag: boolean (1, 0)
     :return: None
     """
-    query = """
-                 INSERT INTO user_winning_picks (user_id_game_id, user_id, game_id, week, correct_pick_flag)
-                 VALUES (%s, %s, %s, %s, %s)
-                 ;
-            """
-    data_tuple = (user_id_game_id, user_id, game_id, week, correct_pick_flag)
-    cursor_execute_tuple(query, data_tuple)
+    cursor_execute_tuple(INSERT_USER_WINNING_PICK_QUERY, {
+        "user_id_game_id": user_id_game_id, "user_id": user_id, "league_id": league_id, "game_id": game_id,
+        "game_key": game_key, "week": week, "correct_pick_flag": correct_pick_flag})
     return None
 
 
 @st.cache(allow_output_mutation=True, show_spinner=False)
 def pipeline_make_insert_into_user_winning_picks_table(user_games_with_scores_df):
     """
-    Function pipelines the process required to insert picks into the winning picks table
+    Function pipelines the process required to insert picks into the winning picks table. The league standings are
+    refreshed wherever final scores are written, which grades the same games
     :return: None
     """
     # user_games_with_scores_df = make_games_with_scores_df()
     for index, row in user_games_with_scores_df.iterrows():
-        make_insert_into_user_winning_picks_table(row["user_id_game_id"], row["user_id"],
-                                                  row["game_id"], row["week"],
+        make_insert_into_user_winning_picks_table(row["user_id_game_id"], row["user_id"], row["league_id"],
+                                                  row["game_id"], row["game_key"], row["week"],
                                                   row["correct_pick_flag"])
     return None
 
 
-def make_user_weekly_picks_df(user_id):
+def make_user_weekly_picks_df(user_id, league_id):
     """
-    Function queries the user_weekly_picks table and returns a Pandas DataFrame for the specified users data
+    Function queries the user_weekly_picks table and returns a Pandas DataFrame for the specified users data in a
+    league
     :param user_id: user_id key
+    :param league_id: league_id key
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """
-         SELECT game_id, winning_pick
-         FROM user_weekly_picks
-         WHERE user_id=%(user_id)s
-         ;
-         """
-    user_weekly_picks_df = pd.read_sql_query(query, con=engine, params={"user_id": user_id})
+    user_weekly_picks_df = database.read_prepared_sql_df("user_weekly_picks", params={"league_id": league_id,
+                                                                                      "user_id": user_id},
+                                                         dtype=PICKS_DTYPE_DICT)
     return user_weekly_picks_df
 
 
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=600)
+def make_week_pick_consensus(league_id, week):
+    """
+    Function builds a leagues pick consensus of every game in a week from a single grouped query. The cached object is
+    shared by every session of the league and updated in place on each submission, the ttl reconciles it with the
+    database
+    :param league_id: league id key
+    :param week: NFL week number
+    :return: WeekPickConsensus object
+    """
+    week_pick_consensus_df = database.read_sql_df(WEEK_PICK_CONSENSUS_QUERY,
+                                                  params={"league_id": league_id, "season": SEASON, "week": week})
+    return WeekPickConsensus(week_pick_consensus_df)
+
+
+def make_league_id_list():
+    """
+    Function returns the league_id of every league
+    :return: List of ints
+    """
+    return [row[0] for row in database.fetchall("SELECT league_id FROM leagues ORDER BY league_id;")]
+
+
+def warm_schedule_cache():
+    """
+    Function fills the schedule cache and runs the schedule and score ingestion a first visit would otherwise run
+    :return: None
+    """
+    yearly_schedule_df = load_compact_schedule_df(SEASON)
+    pipeline_make_insert_into_nfl_games_table(yearly_schedule_df)
+    pipeline_make_insert_into_nfl_game_scores_2022_table(yearly_schedule_df)
+    return None
+
+
+def make_cache_warm_step_list(week):
+    """
+    Function lists the caches the first visit after a deploy or a week rollover would otherwise fill: the schedule,
+    every team logo, the model's predictions, the scores and every league's graded picks and every league's pick
+    consensus of the week
+    :param week: NFL week number
+    :return: List of (cache name, callable) tuples
+    """
+    league_id_list = make_league_id_list()
+    return [("schedule", warm_schedule_cache),
+            ("team logos", lambda: [make_team_logo_image(team) for team in make_team_logo_locations_df()["team"]]),
+            ("model predictions", lambda: make_schedule_predictions(make_pick_model(),
+                                                                    load_compact_schedule_df(SEASON))),
+            ("grading", lambda: [make_database_games_with_scores_df()] +
+                                [make_games_with_scores_df(league_id) for league_id in league_id_list]),
+            ("week consensus", lambda: [make_week_pick_consensus(league_id, week) for league_id in league_id_list])]
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def make_cache_warmer():
+    """
+    Function starts the cache warmer shared by every session, once per process. It warms the caches straight away and
+    again whenever make_current_nfl_week_number changes
+    :return: CacheWarmer object
+    """
+    # number_input returns an int, so the week is cast for the warmed consensus to share its cache key
+    cache_warmer = CacheWarmer(lambda: int(make_current_nfl_week_number(load_compact_schedule_df(SEASON))),
+                               make_cache_warm_step_list)
+    cache_warmer.start()
+    return cache_warmer
+
+
+def make_pool_picks_text(game_id, away_team, home_team):
+    """
+    Function makes the text showing the share of the pool which picked each side of a matchup
+    :param game_id: game id key
+    :param away_team: name of away team
+    :param home_team: name of home team
+    :return: Pool picks text - None when nobody has picked the game
+    """
+    pick_pcts = week_pick_consensus.make_pick_pcts(game_id, away_team, home_team)
+    if pick_pcts is None:
+        return None
+    pool_picks_text = TEXT_POOL_PICKS + TEXT_SPACE + away_team + TEXT_SPACE + "{:.0%}".format(pick_pcts[0]) + \
+                      TEXT_SPACE + TEXT_DASH_SIGN + TEXT_SPACE + "{:.0%}".format(pick_pcts[1]) + TEXT_SPACE + \
+                      home_team
+    return pool_picks_text
+
+
+def make_model_pick_text(game_id):
+    """
+    Function makes the text showing the model's pick of a matchup and how sure it is
+    :param game_id: game id key
+    :return: Model pick text
+    """
+    model_pick, confidence = schedule_predictions_df.loc[game_id, ["model_pick", "confidence"]]
+    model_pick_text = TEXT_MODEL_PICK + TEXT_SPACE + model_pick + TEXT_SPACE + "{:.0%}".format(confidence)
+    return model_pick_text
+
+
 def make_away_home_checkbox_default_value(game_id, home_team, away_team, user_weekly_picks_df):
     """
     Function creates a flag for the away and home team checkboxes based on logic which considers if
@@ -762,6 +892,44 @@ def login_and_signup_ui_app():
     return None
 
 
+def league_sidebar_ui_app(user_id):
+    """
+    Function renders the league picker along with the create and join league forms in the sidebar. The selected
+    league is kept in the session state so every page reads the same league
+    :param user_id: user_id key
+    :return: league_id of the selected league - None if the user isn't in a league
+    """
+    user_leagues_df = make_user_leagues_df(user_id)
+    league_id = None
+    if len(user_leagues_df) != 0:
+        league_id_list = list(user_leagues_df["league_id"])
+        default_index = league_id_list.index(st.session_state["league_id"]) \
+            if st.session_state.get("league_id") in league_id_list else 0
+        league_name = st.sidebar.selectbox("League", list(user_leagues_df["league_name"]), index=default_index)
+        league_row = user_leagues_df[user_leagues_df["league_name"] == league_name].iloc[0]
+        league_id = int(league_row["league_id"])
+        st.session_state["league_id"] = league_id
+        st.session_state["league_name"] = league_name
+        st.sidebar.caption("Invite code: {}".format(league_row["invite_code"]))
+    with st.sidebar.expander("Create a league"):
+        new_league_name = st.text_input("League Name")
+        if st.button("Create League") and new_league_name:
+            league_creation_statement = insert_league_in_leagues_table(new_league_name, user_id)
+            if league_creation_statement == NON_UNIQUE_LEAGUE_NAME:
+                st.error(NON_UNIQUE_LEAGUE_NAME)
+            else:
+                st.experimental_rerun()
+    with st.sidebar.expander("Join a league"):
+        invite_code = st.text_input("Invite Code")
+        if st.button("Join League") and invite_code:
+            league_join_statement = insert_user_in_league_members_table(invite_code, user_id)
+            if league_join_statement == INVALID_INVITE_CODE:
+                st.error(INVALID_INVITE_CODE)
+            else:
+                st.experimental_rerun()
+    return league_id
+
+
 def make_game_day_and_countdown_ui(game_daytime):
     """
     Function creates the logic and UI for matchup day and countdown
@@ -812,6 +980,14 @@ def make_column2_ui():
     st.markdown("{open}{text}{close}".format(open=START_PARAGRAPH_HTML,
                                              text=all_matchup_list[i][3],
                                              close=END_PARAGRAPH_HTML), unsafe_allow_html=True)
+    pool_picks_text = make_pool_picks_text(game_id, away_team, home_team)
+    if pool_picks_text is not None:
+        st.markdown("{open}{text}{close}".format(open=START_PARAGRAPH_HTML,
+                                                 text=pool_picks_text,
+                                                 close=END_PARAGRAPH_HTML), unsafe_allow_html=True)
+    st.markdown("{open}{text}{close}".format(open=START_PARAGRAPH_HTML,
+                                             text=make_model_pick_text(game_id),
+                                             close=END_PARAGRAPH_HTML), unsafe_allow_html=True)
 
 
 def make_column3_ui(game_started_flag, home_team_checkbox_value):
@@ -837,6 +1013,26 @@ def make_warning_two_team_matchup_win_selected():
             away=away_team, home=home_team))
 
 
+def make_submission_outcome_ui(submission):
+    """
+    Function shows whether a pick submission was committed
+    :param submission: PickSubmission object returned by pipeline_submit_weekly_picks
+    :return: True if it was committed
+    """
+    if submission is None:
+        st.warning(SUBMISSION_PENDING_MESSAGE)
+        return False
+    if submission.error is not None:
+        st.error(DATABASE_UNAVAILABLE_MESSAGE)
+        return False
+    if submission.locked_game_id_list:
+        st.warning(PICKS_LOCKED_MESSAGE.format(", ".join(submission.locked_game_id_list)))
+    if submission.rejected_game_id_list:
+        st.warning(PICKS_REJECTED_MESSAGE.format(", ".join(submission.rejected_game_id_list)))
+    st.success("Submitted")
+    return True
+
+
 def make_submit_weekly_picks_button():
     """
     Function creates the logic and UI for the Submit Weekly Picks button
@@ -846,17 +1042,36 @@ def make_submit_weekly_picks_button():
     try:
         if max(wins_selected_per_matchup_dict.values()) == 1:
             if st.button("Submit Picks!"):
-                pipeline_make_insert_into_weekly_picks_table(weekly_picks_dict, user_id)
-                st.success("Submitted")
+                submission = pipeline_submit_weekly_picks(weekly_picks_dict, user_id, league_id,
+                                                          week_pick_consensus)
+                make_submission_outcome_ui(submission)
     except ValueError:
         pass
 
 
+def make_auto_fill_picks_button():
+    """
+    Function creates the logic and UI for the Auto-fill button, which submits the model's picks for the games the user
+    hasn't picked yet
+    :return: True if picks were submitted, so the matchups below are drawn from the picks just committed
+    """
+    if not st.button("Auto-fill my picks 🤖"):
+        return False
+    auto_fill_picks_dict = make_auto_fill_picks_dict(week_schedule_df, user_weekly_picks_df)
+    if not auto_fill_picks_dict:
+        st.info(AUTO_FILL_NOTHING_MESSAGE)
+        return False
+    submission = pipeline_submit_weekly_picks(auto_fill_picks_dict, user_id, league_id, week_pick_consensus)
+    return make_submission_outcome_ui(submission)
+
+
 ######################################### RUN #######################################
 
 
 # Connect to DB
-con, cursor = connect_to_postgres_database(USER, PASSWORD, DATABASE_NAME, HOST, port="5432")
+database = make_shared_connection_manager(st.secrets, PREPARED_STATEMENT_DICT)
+# Warm every shared cache in the background on the process's first run and at each week rollover
+make_cache_warmer()
 
 
 try:
@@ -866,15 +1081,22 @@ try:
     st.markdown("{open}NFL Weekly Picks 🏈{close}".format(open=START_HEADER_CENTERED_HTML,
                                                   close=END_HEADER_HTML_HTML), unsafe_allow_html=True)
 
+    # League - every pick, grade and standing below is scoped to it
+    league_id = league_sidebar_ui_app(user_id)
+    if league_id is None:
+        st.info(NO_LEAGUE_MESSAGE)
+        st.stop()
+
     # Get yearly schedule
     with st.spinner('Getting the 2022 NFL schedule...'):
         # THIS HERE NEEDS TO BE IMPROVED BIG TIME BY UNCACHING ALL THESE FUNCTIONS AND MAKING
         # THEM OCCUR IN THE LOGIN SECTION
-        yearly_schedule_2022_df = make_yearly_schedule(2022)
+        yearly_schedule_2022_df = load_compact_schedule_df(SEASON)
+        pipeline_make_insert_into_nfl_games_table(yearly_schedule_2022_df)
         pipeline_make_insert_into_nfl_game_scores_2022_table(yearly_schedule_2022_df)
-        user_games_with_scores_df = make_games_with_scores_df()
+        user_games_with_scores_df = make_games_with_scores_df(league_id)
         pipeline_make_insert_into_user_winning_picks_table(user_games_with_scores_df)
-    user_weekly_picks_df = make_user_weekly_picks_df(user_id)
+    user_weekly_picks_df = make_user_weekly_picks_df(user_id, league_id)
 
     # Get current NFL week number
     current_nfl_week_number = make_current_nfl_week_number(yearly_schedule_2022_df)
@@ -888,6 +1110,12 @@ try:
     # Make current weekly schedule
     week_schedule_df = make_week_schedule(yearly_schedule_2022_df, week_number)
     all_matchup_list = pipeline_make_matchup_text_lists(week_schedule_df)
+    week_pick_consensus = make_week_pick_consensus(league_id, week_number)
+    schedule_predictions_df = make_schedule_predictions(make_pick_model(), yearly_schedule_2022_df)
+    c1, c2, c3 = st.columns((2, 1, 2))
+    with c2:
+        if make_auto_fill_picks_button():
+            user_weekly_picks_df = make_user_weekly_picks_df(user_id, league_id)
     st.markdown("""---""")
 
     # Display matchups
@@ -915,4 +1143,9 @@ try:
         make_submit_weekly_picks_button()
 
 except KeyError:
-    login_and_signup_ui_app()
+    try:
+        login_and_signup_ui_app()
+    except DatabaseUnavailableError:
+        st.error(DATABASE_UNAVAILABLE_MESSAGE)
+except DatabaseUnavailableError:
+    st.error(DATABASE_UNAVAILABLE_MESSAGE)
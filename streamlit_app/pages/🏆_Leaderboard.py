@@ -1,88 +1,119 @@
 import streamlit as st
+import sys
+from pathlib import Path
 import pandas as pd
-import psycopg2
-from psycopg2 import Error
-from sqlalchemy import create_engine
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
+PROJECT_DIR = str(Path(__file__).resolve().parents[2])
+if PROJECT_DIR not in sys.path:
+    sys.path.append(PROJECT_DIR)
+from src.data.database import DatabaseUnavailableError, make_shared_connection_manager
+from src.data.page_queries import LEAGUE_USERNAMES_QUERY, PCT_CORRECT_BY_WEEK_QUERY
+from src.features.league_standings import (FIRST_PAGE_AFTER_KEY, LEADERBOARD_PAGE_QUERY, LEADERBOARD_PAGE_SIZE,
+                                           MODEL_RANK_QUERY, PAGE_AFTER_KEY_QUERY, USER_STANDING_QUERY,
+                                           make_pct_correct, make_rank_text)
+from src.features.schedule import load_compact_schedule_df
+from src.models.predict_model import (make_model_record, make_schedule_predictions_df, make_schedule_revision,
+                                      read_pick_model)
+from src.models.standings_projection import (CURRENT_POINTS_QUERY, REMAINING_PICK_CODES_QUERY,
+                                             pipeline_make_projected_standings_df)
 
-# Vars
-USER = st.secrets["USER"]
-PASSWORD = st.secrets["PASSWORD"]
-DATABASE_NAME = st.secrets["DATABASE_NAME"]
-HOST = st.secrets["HOST"]
-PORT = st.secrets["PORT"]
 
+DATABASE_UNAVAILABLE_MESSAGE = "The database is temporarily unavailable. Please try again in a minute."
+SEASON = 2022
+PROJECTION_SIMULATION_COUNT = 20000
+PROJECTION_SEED = 2022
+# Simulated in the Streamlit process: a process pool per cache miss would fork every CPU from the web server
+PROJECTION_WORKERS = 1
+GAME_SCORES_QUERY = """
+    SELECT game_id, away_team, away_score, home_team, home_score
+    FROM nfl_game_scores_2022
+    ;
+"""
+# Statements every rerun of every session runs, prepared once per pooled connection
+PREPARED_STATEMENT_DICT = {"leaderboard_page": LEADERBOARD_PAGE_QUERY, "user_standing": USER_STANDING_QUERY,
+                           "page_after_key": PAGE_AFTER_KEY_QUERY}
 
 
-def make_leaderboard_df():
+def make_leaderboard_page_df(league_id, after_key):
     """
-    Function queries the database to return a leaderboard showing username, games played
+    Function queries the league_standings view for the page of a leagues leaderboard starting after a standing, so
+    only LEADERBOARD_PAGE_SIZE rows are read and formatted however large the league is
+    :param league_id: league id key
+    :param after_key: (standing_rank, user_id) tuple of the row before the page
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """
-            SELECT usr.username,
-                   SUM(pck.correct_pick_flag) AS Correct_Picks,
-                   100 * ROUND(CAST(SUM(pck.correct_pick_flag) AS numeric) / CAST(COUNT(
-                   pck.game_id) AS numeric), 3) AS pct_correct,
-                   COUNT(DISTINCT pck.week) AS weekls_played
-            FROM user_winning_picks pck
-            LEFT JOIN users usr
-                ON pck.user_id = usr.user_id
-            GROUP BY 1
-            ORDER BY 2 DESC
-         ;
-         """
-    leaderboard_df = pd.read_sql_query(query, con=engine)
-    return leaderboard_df
-
-
-def make_pct_correct_by_week_df():
-    """
-    Function queries the database to a DataFrame showing the games correct (as a percentage) that each user has had correct
+    after_rank, after_user_id = after_key
+    leaderboard_page_df = database.read_replica_prepared_sql_df("leaderboard_page", params={
+        "league_id": league_id, "after_rank": after_rank, "after_user_id": after_user_id,
+        "page_size": LEADERBOARD_PAGE_SIZE})
+    leaderboard_page_df.insert(0, "rank", [make_rank_text(standing_rank, tied) for standing_rank, tied in
+                                           leaderboard_page_df[["standing_rank", "tied"]].itertuples(index=False)])
+    return leaderboard_page_df
+
+
+def make_page_after_key(league_id, before_key, rows_above):
+    """
+    Function returns the keyset of the page which opens rows_above rows ahead of a standing
+    :param league_id: league id key
+    :param before_key: (standing_rank, user_id) tuple of the standing
+    :param rows_above: number of rows shown ahead of the standing
+    :return: (standing_rank, user_id) tuple
+    """
+    before_rank, before_user_id = before_key
+    page_after_key_df = database.read_replica_prepared_sql_df("page_after_key", params={
+        "league_id": league_id, "before_rank": before_rank, "before_user_id": before_user_id,
+        "rows_above": rows_above})
+    if page_after_key_df.empty:
+        return FIRST_PAGE_AFTER_KEY
+    return tuple(int(value) for value in page_after_key_df.iloc[0])
+
+
+def make_user_standing_df(league_id, user_id):
+    """
+    Function returns a users rank in a league, empty until one of their picks has been graded
+    :param league_id: league id key
+    :param user_id: user id key
+    :return: Dataframe with standing_rank and tied columns
+    """
+    return database.read_replica_prepared_sql_df("user_standing", params={"league_id": league_id,
+                                                                          "user_id": user_id})
+
+
+def show_leaderboard_page(after_key_name, after_key):
+    """
+    Function is the on_click callback of the leaderboard buttons, opening the page which starts after after_key
+    :param after_key_name: session state key holding the shown page's keyset
+    :param after_key: (standing_rank, user_id) tuple
+    :return: None
+    """
+    st.session_state[after_key_name] = after_key
+    return None
+
+
+def show_leaderboard_page_before(after_key_name, league_id, before_key, rows_above):
+    """
+    Function is the on_click callback of the previous and jump to my rank buttons, opening the page which starts
+    rows_above rows ahead of a standing
+    :param after_key_name: session state key holding the shown page's keyset
+    :param league_id: league id key
+    :param before_key: (standing_rank, user_id) tuple of the standing
+    :param rows_above: number of rows shown ahead of the standing
+    :return: None
+    """
+    st.session_state[after_key_name] = make_page_after_key(league_id, before_key, rows_above)
+    return None
+
+
+def make_pct_correct_by_week_df(league_id, season, user_id_list):
+    """
+    Function queries the database to a DataFrame showing the games correct (as a percentage) that each user in a league has had correct
+    :param league_id: league id key
+    :param season: NFL season
+    :param user_id_list: users shown, those on the current leaderboard page
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """
-            WITH nfl_games_per_week AS (
-                SELECT
-                    week,
-                    COUNT(game_id) AS count_of_games
-                FROM
-                     nfl_games_2022
-                GROUP BY 1
-            ),
-                won_by_week AS(
-                SELECT
-                    usr.username,
-                    pck.week,
-                    CAST(SUM(pck.correct_pick_flag) AS numeric) AS correct_picks
-                FROM user_winning_picks pck
-                LEFT JOIN users usr
-                    ON pck.user_id = usr.user_id
-                GROUP BY 1, 2
-            ),
-                pct_won_by_week AS (
-                SELECT
-                    won.username,
-                    won.week,
-                    won.correct_picks,
-                    ROUND((won.correct_picks / nfl.count_of_games), 3) AS pct_correct
-                FROM
-                    won_by_week won
-                LEFT JOIN
-                    nfl_games_per_week nfl
-                    ON won.week = nfl.week
-            )
-            SELECT * FROM pct_won_by_week
-            ORDER BY 2, 1
-         ;
-         """
-    pct_correct_by_week_df = pd.read_sql_query(query, con=engine)
+    pct_correct_by_week_df = database.read_replica_sql_df(PCT_CORRECT_BY_WEEK_QUERY, params={
+        "league_id": league_id, "season": season, "user_id_list": user_id_list})
     return pct_correct_by_week_df
 
 
@@ -92,6 +123,7 @@ def make_pct_correct_by_week_plot(pct_correct_by_week_df):
     :param make_pct_correct_by_week_df:
     :return: Plotly object
     """
+    import plotly.graph_objects as go
     fig = go.Figure()
     for username in pct_correct_by_week_df["username"].unique():
         temp_df = pct_correct_by_week_df[pct_correct_by_week_df["username"] == username]
@@ -101,29 +133,155 @@ def make_pct_correct_by_week_plot(pct_correct_by_week_df):
     return fig
 
 
-def make_pipeline_pct_correct_by_week():
+def make_pipeline_pct_correct_by_week(league_id, season, user_id_list):
     """
     Function pipelines the process required to plot the percentage of games which have been correct per user by week
+    :param league_id: league id key
+    :param season: NFL season
+    :param user_id_list: users plotted
     :return: Plotly object
     """
-    pct_correct_by_week_df = make_pct_correct_by_week_df()
+    pct_correct_by_week_df = make_pct_correct_by_week_df(league_id, season, user_id_list)
     fig = make_pct_correct_by_week_plot(pct_correct_by_week_df)
     return fig
 
 
+def make_schedule_spreads_df(season):
+    """
+    Function returns the game_id and spread_line of every game in the provided years NFL schedule
+    :param season: year of schedule desired
+    :return: Dataframe
+    """
+    return load_compact_schedule_df(season)[["game_id", "spread_line"]]
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def make_pick_model():
+    """
+    Function reads the auto-pick model once per process
+    :return: Dictionary returned by read_pick_model
+    """
+    return read_pick_model()
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False, hash_funcs={pd.DataFrame: make_schedule_revision})
+def make_schedule_predictions(pick_model, yearly_schedule_df):
+    """
+    Function predicts every game of the season in one batch, cached per schedule revision
+    :param pick_model: Dictionary returned by make_pick_model
+    :param yearly_schedule_df: Dataframe returned by load_compact_schedule_df
+    :return: Dataframe returned by make_schedule_predictions_df
+    """
+    return make_schedule_predictions_df(pick_model, yearly_schedule_df)
+
+
+@st.cache(show_spinner=False, ttl=600)
+def make_model_standing(league_id, season):
+    """
+    Function grades the model's pick of every scored game like a player's and ranks its success rate against the
+    league's players
+    :param league_id: league id key
+    :param season: NFL season
+    :return: correct picks, graded picks, rank text
+    """
+    schedule_predictions_df = make_schedule_predictions(make_pick_model(), load_compact_schedule_df(season))
+    game_scores_df = database.read_replica_sql_df(GAME_SCORES_QUERY)
+    correct_picks, graded_picks = make_model_record(schedule_predictions_df, game_scores_df)
+    if not graded_picks:
+        return correct_picks, graded_picks, None
+    model_rank_df = database.read_replica_sql_df(MODEL_RANK_QUERY, params={
+        "league_id": league_id, "pct_correct": make_pct_correct(correct_picks, graded_picks)})
+    return correct_picks, graded_picks, make_rank_text(int(model_rank_df["standing_rank"].iloc[0]),
+                                                       bool(model_rank_df["tied"].iloc[0]))
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=3600)
+def make_projected_standings_df(league_id, season):
+    """
+    Function simulates the rest of the season from the spreads and every league member's submitted picks and returns
+    each user's projected final rank distribution within the league. Cached per league
+    :param league_id: league id key
+    :param season: NFL season
+    :return: Dataframe
+    """
+    schedule_spreads_df = make_schedule_spreads_df(season)
+    scored_game_ids = database.read_replica_sql_df("SELECT game_id FROM nfl_game_scores_2022;")["game_id"]
+    remaining_games_df = schedule_spreads_df[~schedule_spreads_df["game_id"].isin(scored_game_ids)]
+    pick_codes_df = database.read_replica_sql_df(REMAINING_PICK_CODES_QUERY, params={"league_id": league_id, "season": season})
+    current_points_df = database.read_replica_sql_df(CURRENT_POINTS_QUERY, params={"league_id": league_id})
+    projected_standings_df = pipeline_make_projected_standings_df(remaining_games_df, pick_codes_df,
+                                                                  current_points_df, PROJECTION_SIMULATION_COUNT,
+                                                                  PROJECTION_SEED, workers=PROJECTION_WORKERS)
+    usernames_df = database.read_replica_sql_df(LEAGUE_USERNAMES_QUERY, params={"league_id": league_id})
+    projected_standings_df = projected_standings_df.merge(usernames_df, on="user_id", how="left")
+    return projected_standings_df[["username", "expected_rank", "first_place_pct", "top_three_pct", "rank_p10",
+                                   "rank_p50", "rank_p90"]]
+
+
 ######################################### RUN #######################################
 
+
+# Connect to DB
+database = make_shared_connection_manager(st.secrets, PREPARED_STATEMENT_DICT)
+
 try:
 
     # User ID
     user_id = st.session_state["user_id"]
+    league_id = st.session_state["league_id"]
 
     st.header("Leaderboard 🥇")
+    st.caption(st.session_state["league_name"])
+
+    after_key_name = "leaderboard_after_key_{}".format(league_id)
+    if after_key_name not in st.session_state:
+        st.session_state[after_key_name] = FIRST_PAGE_AFTER_KEY
+    leaderboard_page_df = make_leaderboard_page_df(league_id, st.session_state[after_key_name])
+    user_standing_df = make_user_standing_df(league_id, user_id)
+    user_key = None
+    if not user_standing_df.empty:
+        user_key = (int(user_standing_df["standing_rank"].iloc[0]), user_id)
+        st.write("Your rank: **{}**".format(make_rank_text(user_key[0], user_standing_df["tied"].iloc[0])))
+
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        st.button("Top", on_click=show_leaderboard_page, args=(after_key_name, FIRST_PAGE_AFTER_KEY))
+    if not leaderboard_page_df.empty:
+        first_key = tuple(int(value) for value in leaderboard_page_df[["standing_rank", "user_id"]].iloc[0])
+        last_key = tuple(int(value) for value in leaderboard_page_df[["standing_rank", "user_id"]].iloc[-1])
+        with c2:
+            st.button("◀ Previous", on_click=show_leaderboard_page_before,
+                      args=(after_key_name, league_id, first_key, LEADERBOARD_PAGE_SIZE),
+                      disabled=st.session_state[after_key_name] == FIRST_PAGE_AFTER_KEY)
+        with c3:
+            st.button("Next ▶", on_click=show_leaderboard_page, args=(after_key_name, last_key),
+                      disabled=len(leaderboard_page_df) < LEADERBOARD_PAGE_SIZE)
+    with c4:
+        st.button("Jump to my rank 🎯", on_click=show_leaderboard_page_before,
+                  args=(after_key_name, league_id, user_key, LEADERBOARD_PAGE_SIZE // 2), disabled=user_key is None)
+
+    st.dataframe(leaderboard_page_df[["rank", "username", "correct_picks", "pct_correct", "weeks_played"]]
+                 .style.format({"pct_correct": '{:.1f}%'}))
+    model_correct_picks, model_graded_picks, model_rank_text = make_model_standing(league_id, SEASON)
+    if model_graded_picks:
+        st.caption("🤖 The auto-pick model has {} of {} games right ({:.1f}%), rank {} in this league by success "
+                   "rate".format(model_correct_picks, model_graded_picks,
+                                 100 * model_correct_picks / model_graded_picks, model_rank_text))
 
-    st.dataframe(make_leaderboard_df().style.format({"pct_correct" : '{:.1f}%'}))
+    if not leaderboard_page_df.empty:
+        st.plotly_chart(make_pipeline_pct_correct_by_week(league_id, SEASON, leaderboard_page_df["user_id"].tolist()),
+                        use_container_width=True)
 
-    st.plotly_chart(make_pipeline_pct_correct_by_week(), use_container_width=True)
+    st.subheader("Projected final standings 🔮")
+    st.write("Based on {:,} simulations of the remaining games using the betting spreads and everyone's submitted "
+             "picks".format(PROJECTION_SIMULATION_COUNT))
+    with st.spinner("Simulating the rest of the season..."):
+        projected_standings_df = make_projected_standings_df(league_id, SEASON)
+    st.dataframe(projected_standings_df.style.format({"expected_rank": "{:.1f}", "first_place_pct": "{:.1%}",
+                                                      "top_three_pct": "{:.1%}"}))
 
 except KeyError:
-    st.warning("You must login before accessing this page. Please authenticate via the login "
+    st.warning("You must login and choose a league before accessing this page. Please authenticate via the login "
                "menu on the Weekly Picks page.")
+except DatabaseUnavailableError:
+    st.error(DATABASE_UNAVAILABLE_MESSAGE)
@@ -1,201 +1,156 @@
 import streamlit as st
+import sys
+import logging
+from pathlib import Path
+import tempfile
 import pandas as pd
 import psycopg2
-from psycopg2 import Error
-from sqlalchemy import create_engine
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
-
-# Vars
-USER = st.secrets["USER"]
-PASSWORD = st.secrets["PASSWORD"]
-DATABASE_NAME = st.secrets["DATABASE_NAME"]
-HOST = st.secrets["HOST"]
-PORT = st.secrets["PORT"]
-
-
-CORRECT_COLOR = "#41b45c"
-WRONG_COLOR = "#F05454"
-NEUTRAL_COLOR = "#EFEFEF"
-
-
-def connect_to_postgres_database(user, password, database, host="127.0.0.1", port="5432"):
-    """
-    Function connects to a database and returns the cursor object
-    :param user: database username
-    :param password: database password
-    :param database: database name
-    :param host: server location
-    :param port: listening port
-    :return: psycopg2 cursor object
-    """
-    try:
-        con = psycopg2.connect(user=user,
-                               password=password,
-                               database=database,
-                               host=host,
-                               port=port)
-        cursor = con.cursor()
-    except (Exception, Error) as error:
-        print("Error while connecting to PostgreSQL", error)
-    return con, cursor
+PROJECT_DIR = str(Path(__file__).resolve().parents[2])
+if PROJECT_DIR not in sys.path:
+    sys.path.append(PROJECT_DIR)
+from src.data.database import DatabaseUnavailableError, make_shared_connection_manager
+from src.data.page_queries import (GRADED_PICKS_QUERY, INSERT_USER_WINNING_PICK_QUERY, USERNAMES_QUERY,
+                                   USER_PICKS_WITH_WIN_QUERY, USER_WEEKS_PREDICTION_PCT_QUERY)
+from src.features.build_features import FORM_WEEKS, read_team_form_df
+from src.features.pick_consensus import WEEK_PICK_CONSENSUS_QUERY, WeekPickConsensus
+from src.features.pick_agreement import (PICK_CODES_DTYPE_DICT, PICK_CODES_QUERY, make_most_similar_users_df,
+                                         make_pick_code_array)
+from src.visualization.visualize import (LEAGUE_GRADES_QUERY, MATCHUP_SCORES_FIGURE, RECAP_DIR,
+                                         WEEKS_PREDICTION_PCT_FIGURE, make_grades_revision,
+                                         make_plot_matchup_scores, make_plot_user_weeks_prediction_pct,
+                                         make_recap_figure, make_scores_revision,
+                                         pipeline_make_matchup_dicts_team_color_logic, read_user_recap_dict)
+
+
+logger = logging.getLogger(__name__)
+
+DATABASE_UNAVAILABLE_MESSAGE = "The database is temporarily unavailable. Please try again in a minute."
+GRADED_PICKS_DTYPE_DICT = {"user_id": "int32", "game_key": "int32", "week": "int8"}
+SEASON = 2022
+SIMILAR_USERS_COUNT = 5
+# The live-score poller stores final scores and grades picks within seconds of the final whistle
+SCORES_TTL_SECONDS = 60
+TEAM_FORM_COLUMN_LIST = ["team", "wins", "losses", "ties", "points_for_per_game", "points_against_per_game",
+                         "form_wins", "form_losses", "form_ties", "form_point_diff", "cover_rate", "form_cover_rate",
+                         "rest_days_per_game"]
+EXPORT_SCOPE_DICT = {"My picks": "my_picks", "Whole league": "league_picks"}
+EXPORT_MIME_TYPE_DICT = {"csv": "text/csv", "parquet": "application/octet-stream"}
+# st.download_button holds the whole file in memory, so larger exports are left to python -m src.data.export_picks
+MAX_EXPORT_DOWNLOAD_BYTES = 50 * 1024 * 1024
+EXPORT_TOO_LARGE_MESSAGE = ("This export is {:.0f} MB, too large to download here. Try Parquet, or your picks only, or "
+                            "ask an admin to run python -m src.data.export_picks.")
+# Statements every rerun of every session runs, prepared once per pooled connection
+PREPARED_STATEMENT_DICT = {"user_weeks_prediction_pct": USER_WEEKS_PREDICTION_PCT_QUERY}
 
 
 def cursor_execute_tuple(command, data_tuple):
     """
-    Function uses the cursor object to execute a command with a tuple pair. It commits and rollsback if error
+    Function uses the connection manager to execute a command with a tuple pair. It commits, or rolls back and logs
+    the error. DatabaseUnavailableError is raised for the page to report
     :param command: SQL query to be executed
     :param data_tuple: data pairing for SQL query variables
     :return:
     """
     try:
-        cursor.execute(command, data_tuple)
-        con.commit()
-        print("Successfully executed the command")
-    except (Exception, psycopg2.DatabaseError) as error:
-        print("Error: %s" % error)
-        con.rollback()
-        print("Could not successfully execute the command")
+        database.execute(command, data_tuple)
+    except psycopg2.Error:
+        logger.exception("could not execute %s", " ".join(command.split())[:80])
     return None
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
 def make_database_games_with_scores_df():
     """
     Function queries the nfl_game_scores_2022 table and returns a Pandas DataFrame
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
     query = """
          SELECT *
          FROM nfl_game_scores_2022
          ;
          """
-    database_games_with_scores_df = pd.read_sql_query(query, con=engine)
+    database_games_with_scores_df = database.read_replica_sql_df(query)
     return database_games_with_scores_df
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
-def make_games_with_scores_df():
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
+def make_games_with_scores_df(league_id):
     """
-    Function creates a dataframe with a users chosen games and a flag for correct matchup pick
-    :param user_id: user id key
+    Function creates a dataframe with a leagues chosen games and a flag for correct matchup pick
+    :param league_id: league id key
     :return: Dataframe
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """
-        WITH nfl_game_scores_2022 AS (
-            SELECT week, game_id,
-                CASE
-                    WHEN away_score > home_score THEN away_team
-                    WHEN away_score < home_score THEN home_team
-                    WHEN away_score = home_score THEN 'TIE'
-                END AS winning_team
-            FROM nfl_game_scores_2022
-        ),
-            user_weekly_picks AS (
-            SELECT user_id_game_id, user_id, game_id, winning_pick
-            FROM user_weekly_picks
-        ),
-            left_join_above AS (
-            SELECT usr.user_id_game_id, usr.user_id, nfl.game_id, nfl.week,
-                CASE
-                    WHEN usr.winning_pick = nfl.winning_team THEN 1
-                    WHEN usr.winning_pick != nfl.winning_team THEN 0
-                END AS correct_pick_flag
-            FROM nfl_game_scores_2022 nfl
-            LEFT JOIN user_weekly_picks usr
-                ON nfl.game_id = usr.game_id
-            WHERE usr.user_id_game_id IS NOT NULL
-        )
-         SELECT * FROM left_join_above ;
-         """
-    database_games_with_scores_df = pd.read_sql_query(query, con=engine)
+    database_games_with_scores_df = database.read_sql_df(GRADED_PICKS_QUERY, params={"league_id": league_id},
+                                                         dtype=GRADED_PICKS_DTYPE_DICT)
     return database_games_with_scores_df
 
 
-def make_insert_into_user_winning_picks_table(user_id_game_id, user_id, game_id, week, correct_pick_flag):
+def make_insert_into_user_winning_picks_table(user_id_game_id, user_id, league_id, game_id, game_key, week,
+                                              correct_pick_flag):
     """
     Function inserts picks into the winning picks table
     :param user_id_game_id: user and game id key
     :param user_id: user_id key
+    :param league_id: league_id key
     :param game_is:  game_id key
+    :param game_key: integer surrogate key of the game
     :param week: int - week
     :param correct_pick_flag: boolean (1, 0)
     :return: None
     """
-    query = """
-                 INSERT INTO user_winning_picks (user_id_game_id, user_id, game_id, week, correct_pick_flag)
-                 VALUES (%s, %s, %s, %s, %s)
-                 ;
-            """
-    data_tuple = (user_id_game_id, user_id, game_id, week, correct_pick_flag)
-    cursor_execute_tuple(query, data_tuple)
+    cursor_execute_tuple(INSERT_USER_WINNING_PICK_QUERY, {
+        "user_id_game_id": user_id_game_id, "user_id": user_id, "league_id": league_id, "game_id": game_id,
+        "game_key": game_key, "week": week, "correct_pick_flag": correct_pick_flag})
     return None
 
 
-def pipeline_make_insert_into_user_winning_picks_table():
+def pipeline_make_insert_into_user_winning_picks_table(league_id):
     """
-    Function pipelines the process required to insert picks into the winning picks table
+    Function pipelines the process required to insert a leagues picks into the winning picks table. The league
+    standings are refreshed wherever final scores are written, which grades the same games
+    :param league_id: league id key
     :return: None
     """
-    user_games_with_scores_df = make_games_with_scores_df()
+    user_games_with_scores_df = make_games_with_scores_df(league_id)
     for index, row in user_games_with_scores_df.iterrows():
-        make_insert_into_user_winning_picks_table(row["user_id_game_id"], row["user_id"],
-                                                  row["game_id"], row["week"],
+        make_insert_into_user_winning_picks_table(row["user_id_game_id"], row["user_id"], row["league_id"],
+                                                  row["game_id"], row["game_key"], row["week"],
                                                   row["correct_pick_flag"])
     return user_games_with_scores_df
 
 
-def make_user_weeks_prediction_pct_df(user_id):
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
+def make_league_grades_revision(league_id):
     """
-    Function returns the weekly win pct rate for a specified user
-    :param user_id: user_id
-    :return: Dataframe
+    Function returns the revision of a league's grades its pre-rendered recaps are looked up under
+    :param league_id: league id key
+    :return: Hex digest
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """SELECT week,
-                    COUNT(week) AS played_games,
-                    SUM(correct_pick_flag) AS correct_picks,
-                    (CAST(SUM(correct_pick_flag) AS float) / CAST(COUNT(week) AS float)) AS 
-                    pct_correct
-                FROM user_winning_picks
-                WHERE user_id = %(user_id)s
-                GROUP BY week
-                ORDER BY week;"""
-    user_weeks_prediction_pct_df = pd.read_sql_query(query, con=engine, params={"user_id": user_id})
-    return user_weeks_prediction_pct_df
+    league_grades_df = database.read_sql_df(LEAGUE_GRADES_QUERY, params={"league_id": league_id})
+    return make_grades_revision(league_grades_df)
 
 
-def make_plot_user_weeks_prediction_pct(user_weeks_prediction_pct_df):
+def make_user_weeks_prediction_pct_df(user_id, league_id):
     """
-    Function plots a users prediction success rate and the correct number of games per week
-    :param user_weeks_prediction_pct_df: Dataframe with the weekly win pct rate for a specified user
-    :return: Plotly object
+    Function returns the weekly win pct rate for a specified user in a league
+    :param user_id: user_id
+    :param league_id: league_id
+    :return: Dataframe
     """
-    weeks_str = [str(x) for x in list(user_weeks_prediction_pct_df["week"])]
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-    fig.add_trace(
-        go.Bar(x=weeks_str, y=list(user_weeks_prediction_pct_df["correct_picks"]), name="Correct Picks", marker_color="#EFEFEF"), secondary_y=False)
-    fig.add_trace(
-        go.Scatter(x=weeks_str, y=list(user_weeks_prediction_pct_df["pct_correct"]), name="Success Rate (%)", marker_color="#5CACEE"), secondary_y=True)
-    fig.update_layout(template="plotly_dark", xaxis=dict(showgrid=False), yaxis=dict(showgrid=False))
-    fig.update_yaxes(range=[0, 16], secondary_y=False, showgrid=False)
-    fig.update_yaxes(range=[0, 1], secondary_y=True, showgrid=False, tickformat=".0%")
-    return fig
+    user_weeks_prediction_pct_df = database.read_replica_prepared_sql_df("user_weeks_prediction_pct", params={
+        "league_id": league_id, "user_id": user_id})
+    return user_weeks_prediction_pct_df
 
 
-def make_pipeline_plot_user_weeks_prediction_pct(user_id):
+def make_pipeline_plot_user_weeks_prediction_pct(user_id, league_id):
     """
     Function pipelines the process required to make a plot showing pick success rate by week
     :param user_id:
+    :param league_id:
     :return: Plotly object
     """
-    user_weeks_prediction_pct_df = make_user_weeks_prediction_pct_df(user_id)
+    user_weeks_prediction_pct_df = make_user_weeks_prediction_pct_df(user_id, league_id)
     fig = make_plot_user_weeks_prediction_pct(user_weeks_prediction_pct_df)
     return fig
 
@@ -211,129 +166,139 @@ def make_tab_names(nfl_games_with_scored_df):
     return tab_name_list
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
-def make_user_picks_with_win_df(user_id):
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
+def make_user_picks_with_win_df(user_id, league_id):
     """
     Function checks the dashboard_user table and returns the user_id by referencing a username
     :param username: username
+    :param league_id: league_id
     :return: user_id
     """
-    engine = create_engine("postgresql+psycopg2://" + USER + ":" + PASSWORD + "@" + HOST + "/" +
-                           DATABASE_NAME)
-    query = """WITH user_picks AS (
-                        SELECT game_id, winning_pick
-                        FROM user_weekly_picks
-                        WHERE user_id = %(user_id)s
-                        ),
-                        nfl_game_scores AS (
-                            SELECT game_id, away_team, home_team,
-                                   CASE
-                        WHEN home_score > away_score THEN home_team
-                        WHEN home_score < away_score THEN away_team
-                        ELSE NULL
-                        END AS nfl_winning_team
-                        FROM nfl_game_scores_2022
-                        ),
-                        left_join AS (
-                            SELECT usr.game_id, nfl.away_team, nfl.home_team, nfl.nfl_winning_team, usr.winning_pick
-                        FROM user_picks usr
-                        LEFT JOIN nfl_game_scores nfl
-                        ON usr.game_id = nfl.game_id
-                        ),
-                        case_statement AS (
-                            SELECT game_id, away_team, home_team, winning_pick,
-                                   CASE
-                        WHEN winning_pick = nfl_winning_team THEN 1
-                        WHEN winning_pick != nfl_winning_team THEN 0
-                        ELSE 0
-                        END AS correct_or_not
-                        FROM left_join
-                        )
-                        SELECT * FROM  case_statement;"""
-    user_picks_with_win_df = pd.read_sql_query(query, con=engine, params={"user_id": user_id})
+    user_picks_with_win_df = database.read_replica_sql_df(USER_PICKS_WITH_WIN_QUERY, params={"league_id": league_id,
+                                                                                        "user_id": user_id})
     return user_picks_with_win_df
 
 
-def make_matchup_score_dicts(row, away_score_dict, home_score_dict):
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=600)
+def make_week_pick_agreement(league_id, week):
     """
-    Function adds matchup information to two different dictionaries
-    :param row: Row from Pandas.DataFrame.iterrows()
-    :param away_score_dict: Dict holding matchup as key and away score as value - empty
-    :param home_score_dict: Dict holding matchup as key and home score as value - empty
-    :return: None
+    Function builds a leagues users x games pick codes over every game of the season up to a week which has kicked
+    off. Cached per league and week so every viewer of that week shares one int8 array, and each viewer's agreement
+    is computed against it
+    :param league_id: league id key
+    :param week: NFL week number
+    :return: user_id array, users x games pick code array
     """
-    dict_key = row["away_team"] + " @ " + row["home_team"]
-    away_dict_value = row["away_score"]
-    away_score_dict[dict_key] = away_dict_value
-    home_dict_value = row["home_score"]
-    home_score_dict[dict_key] = home_dict_value
-    return None
+    pick_codes_df = database.read_replica_sql_df(PICK_CODES_QUERY,
+                                         params={"league_id": league_id, "season": SEASON, "week": week},
+                                         dtype=PICK_CODES_DTYPE_DICT)
+    user_id_array, game_key_array, pick_code_array = make_pick_code_array(pick_codes_df)
+    return user_id_array, pick_code_array
 
 
-def make_team_color_logic(dataframe, away_team_color_list, home_team_color_list):
+def make_usernames_df(user_id_list):
     """
-    Function appends a color, depending on the correctness of a pick, to a list
-    :param dataframe: Dataframe holding single row of user pick data
-    :param away_team_color_list: List holding color or away teams - empty
-    :param home_team_color_list: List holding color or home teams - empty
-    :return: None
+    Function queries the users table for the usernames of a list of user ids
+    :param user_id_list: list of user_id keys
+    :return: Dataframe
     """
-    if dataframe["correct_or_not"].iloc[0] == 1:
-        if dataframe["winning_pick"].iloc[0] == dataframe["home_team"].iloc[0]:
-            home_team_color_list.append(CORRECT_COLOR)
-            away_team_color_list.append(NEUTRAL_COLOR)
-        elif dataframe["winning_pick"].iloc[0] == dataframe["away_team"].iloc[0]:
-            home_team_color_list.append(NEUTRAL_COLOR)
-            away_team_color_list.append(CORRECT_COLOR)
-    if dataframe["correct_or_not"].iloc[0] == 0:
-        if dataframe["winning_pick"].iloc[0] == dataframe["home_team"].iloc[0]:
-            home_team_color_list.append(WRONG_COLOR)
-            away_team_color_list.append(NEUTRAL_COLOR)
-        elif dataframe["winning_pick"].iloc[0] == dataframe["away_team"].iloc[0]:
-            home_team_color_list.append(NEUTRAL_COLOR)
-            away_team_color_list.append(WRONG_COLOR)
-    return None
+    usernames_df = database.read_replica_sql_df(USERNAMES_QUERY, params={"user_id_list": user_id_list})
+    return usernames_df
 
 
-def pipeline_make_matchup_dicts_team_color_logic(nfl_games_with_scores_df, week, user_picks_with_win_df):
+def make_pipeline_most_similar_users_df(user_id, league_id, week):
     """
-    Function pipelines the process needed to create dictioanries holding scores and lists holding colors
-    :param nfl_week_game_score_df: Dataframe with nfl games and scores
+    Function pipelines the process required to list the players in a league whose picks agree most with a user's
+    :param user_id: user_id key
+    :param league_id: league_id key
     :param week: NFL week number
-    :param user_picks_with_win_df: Dataframe with a users matchup pick and correct flag
-    :return: away_score_dict, home_score_dict, away_team_color_list, home_team_color_list
+    :return: Dataframe with username, agreement_pct and shared_games columns
+    """
+    user_id_array, pick_code_array = make_week_pick_agreement(league_id, week)
+    most_similar_users_df = make_most_similar_users_df(user_id_array, pick_code_array, user_id, k=SIMILAR_USERS_COUNT)
+    usernames_df = make_usernames_df([int(x) for x in most_similar_users_df["user_id"]])
+    most_similar_users_df = most_similar_users_df.merge(usernames_df, on="user_id", how="left")
+    return most_similar_users_df[["username", "agreement_pct", "shared_games"]]
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=3600)
+def make_week_pick_consensus(league_id, week):
+    """
+    Function builds a leagues pick consensus of every game in a week from a single grouped query. It is read from the
+    primary, like Weekly Picks, so a pick just submitted is counted
+    :param league_id: league id key
+    :param week: NFL week number
+    :return: WeekPickConsensus object
+    """
+    week_pick_consensus_df = database.read_sql_df(WEEK_PICK_CONSENSUS_QUERY,
+                                                  params={"league_id": league_id, "season": SEASON, "week": week})
+    return WeekPickConsensus(week_pick_consensus_df)
+
+
+def make_week_consensus_df(nfl_games_with_scores_df, league_id, week):
     """
-    away_score_dict = dict()
-    home_score_dict = dict()
-    away_team_color_list = list()
-    home_team_color_list = list()
+    Function creates a dataframe showing the share of the league which picked each side of a weeks games and the
+    winner
+    :param nfl_games_with_scores_df: Dataframe with nfl games and scores
+    :param league_id: league id key
+    :param week: NFL week number
+    :return: Dataframe
+    """
+    week_pick_consensus = make_week_pick_consensus(league_id, week)
+    week_consensus_list = list()
     nfl_week_game_score_df = nfl_games_with_scores_df[nfl_games_with_scores_df["week"] == week]
     for index, row in nfl_week_game_score_df.iterrows():
-        make_matchup_score_dicts(row, away_score_dict, home_score_dict)
-        if row["game_id"] in list(user_picks_with_win_df["game_id"]):
-            temp_df = user_picks_with_win_df[user_picks_with_win_df["game_id"] == row["game_id"]]
-            make_team_color_logic(temp_df, away_team_color_list, home_team_color_list)
+        away_picks, home_picks = week_pick_consensus.make_pick_counts(row["game_id"], row["away_team"],
+                                                                      row["home_team"])
+        total_picks = max(away_picks + home_picks, 1)
+        if row["away_score"] > row["home_score"]:
+            winner = row["away_team"]
+        elif row["away_score"] < row["home_score"]:
+            winner = row["home_team"]
         else:
-            away_team_color_list.append(NEUTRAL_COLOR)
-            home_team_color_list.append(NEUTRAL_COLOR)
-    return away_score_dict, home_score_dict, away_team_color_list, home_team_color_list
+            winner = "TIE"
+        week_consensus_list.append({"matchup": row["away_team"] + " @ " + row["home_team"],
+                                    "away_picks_pct": away_picks / total_picks,
+                                    "home_picks_pct": home_picks / total_picks,
+                                    "winner": winner})
+    week_consensus_df = pd.DataFrame(week_consensus_list)
+    return week_consensus_df
+
+
+def make_pick_history_export_file(export_path, league_id, user_id, viewer_user_id, export_format):
+    """
+    Function streams a league's (or one of its users') pick history from a server-side cursor into a CSV or Parquet
+    file, chunk by chunk. Other players' picks of games which haven't kicked off are left out
+    :param export_path: path of the file to write
+    :param league_id: league id key
+    :param user_id: user id key - None exports the whole league
+    :param viewer_user_id: user id key of the player exporting
+    :param export_format: csv or parquet
+    :return: None
+    """
+    from src.data.export_picks import export_pick_history
 
+    def operation(con):
+        with open(export_path, "wb") as file_obj:
+            export_pick_history(con, file_obj, export_format, league_id, user_id, viewer_user_id=viewer_user_id)
+    database.run_replica(operation)
+    return None
 
-def make_plot_matchup_scores(away_score_dict, home_score_dict, away_team_color_list, home_team_color_list):
+
+@st.cache(allow_output_mutation=True, show_spinner=False, ttl=SCORES_TTL_SECONDS)
+def make_team_form_df(season):
     """
-    Function plots a weeks matchup on the xaxis and team scores on the yaxis. Color is used to show correct/incorrect and not picked
-    :param away_score_dict: Dict holding matchup as key and away score as value
-    :param home_score_dict: Dict holding matchup as key and home score as value
-    :param away_team_color_list: List holding color or away teams
-    :param home_team_color_list: List holding color or home teams
-    :return: Plotly bar chart object
+    Function reads every team's form through the latest week in the team form feature store, the season record,
+    points per game, record over the last FORM_WEEKS weeks and cover rate against the spread
+    :param season: NFL season
+    :return: Dataframe sorted by recent form, empty until the store has a week of the season
     """
-    fig = go.Figure(data=[
-        go.Bar(x=list(home_score_dict.keys()), y=list(away_score_dict.values()), marker_color=away_team_color_list),
-        go.Bar(x=list(home_score_dict.keys()), y=list(home_score_dict.values()), marker_color=home_team_color_list)
-    ])
-    fig.update_layout(barmode='group', template="plotly_dark", xaxis=dict(showgrid=False), yaxis=dict(showgrid=False), showlegend=False)
-    return fig
+    team_form_df = read_team_form_df(season)
+    if team_form_df.empty:
+        return team_form_df
+    team_form_df["form_point_diff"] = team_form_df["form_points_for"] - team_form_df["form_points_against"]
+    team_form_df = team_form_df.sort_values(["form_win_pct", "form_point_diff"], ascending=False)
+    return team_form_df[["week"] + TEAM_FORM_COLUMN_LIST].reset_index(drop=True)
 
 
 def make_pipeline_plot_matchup_scores(nfl_games_with_scores_df, week, user_picks_with_win_df):
@@ -354,18 +319,20 @@ def make_pipeline_plot_matchup_scores(nfl_games_with_scores_df, week, user_picks
 
 
 # Connect to DB
-con, cursor = connect_to_postgres_database(USER, PASSWORD, DATABASE_NAME, HOST, port="5432")
+database = make_shared_connection_manager(st.secrets, PREPARED_STATEMENT_DICT)
 
 try:
     # User ID
     user_id = st.session_state["user_id"]
+    league_id = st.session_state["league_id"]
 
     st.header("Analytics 📊")
+    st.caption(st.session_state["league_name"])
 
     with st.spinner("Getting your picks..."):
         nfl_games_with_scored_df = make_database_games_with_scores_df()
-        user_games_with_scores_df = make_games_with_scores_df()
-        user_picks_with_win_df = make_user_picks_with_win_df(user_id)
+        user_games_with_scores_df = make_games_with_scores_df(league_id)
+        user_picks_with_win_df = make_user_picks_with_win_df(user_id, league_id)
     tab_name_list = make_tab_names(nfl_games_with_scored_df)
 
     user_weekly_picks_df = user_games_with_scores_df[user_games_with_scores_df["user_id"] ==user_id]
@@ -374,9 +341,33 @@ try:
     pct_correct_picks = round(((correct_picks / games_played_this_week) * 100))
     st.write("You've correctly chosen {} out of the {} games ({}%) played this season".format(
         correct_picks, games_played_this_week, pct_correct_picks))
-    fig1 = make_pipeline_plot_user_weeks_prediction_pct(user_id)
+    # Recaps pre-rendered by src.visualization.visualize from the current scores and grades, built here if there are
+    # none
+    scores_revision = make_scores_revision(nfl_games_with_scored_df)
+    grades_revision = make_league_grades_revision(league_id)
+    user_recap_dict = read_user_recap_dict(RECAP_DIR, scores_revision, league_id, grades_revision, user_id)
+    fig1 = make_recap_figure(user_recap_dict, RECAP_DIR, scores_revision, WEEKS_PREDICTION_PCT_FIGURE)
+    if fig1 is None:
+        fig1 = make_pipeline_plot_user_weeks_prediction_pct(user_id, league_id)
     st.plotly_chart(fig1, use_container_width=True)
 
+    # Until the season's first final score there are no graded weeks to compare picks over
+    if not nfl_games_with_scored_df.empty:
+        latest_scored_week = int(nfl_games_with_scored_df["week"].max())
+        st.subheader("Who picks like you 🤝")
+        st.write("Players whose picks most often matched yours up to week {}".format(latest_scored_week))
+        st.dataframe(make_pipeline_most_similar_users_df(user_id, league_id, latest_scored_week).style.format(
+            {"agreement_pct": "{:.1%}"}))
+
+    team_form_df = make_team_form_df(SEASON)
+    if not team_form_df.empty:
+        st.subheader("Team form 🔥")
+        st.write("Every team's record and cover rate against the spread through week {}, ordered by their last {} "
+                 "weeks".format(int(team_form_df["week"].iloc[0]), FORM_WEEKS))
+        st.dataframe(team_form_df[TEAM_FORM_COLUMN_LIST].style.format(
+            {"points_for_per_game": "{:.1f}", "points_against_per_game": "{:.1f}", "cover_rate": "{:.0%}",
+             "form_cover_rate": "{:.0%}", "rest_days_per_game": "{:.1f}"}, na_rep="-"))
+
     for tab, week in zip(st.tabs(tab_name_list), tab_name_list):
         with tab:
             number_week = int(week.split(" ")[1])
@@ -389,11 +380,38 @@ try:
                 correct_picks, games_played_this_week))
 
 
-            fig2 = make_pipeline_plot_matchup_scores(nfl_games_with_scored_df, number_week,
-                                                    user_picks_with_win_df)
+            fig2 = make_recap_figure(user_recap_dict, RECAP_DIR, scores_revision,
+                                     MATCHUP_SCORES_FIGURE.format(number_week))
+            if fig2 is None:
+                fig2 = make_pipeline_plot_matchup_scores(nfl_games_with_scored_df, number_week,
+                                                        user_picks_with_win_df)
             st.plotly_chart(fig2, use_container_width=True)
 
+            st.write("How the league picked")
+            st.dataframe(make_week_consensus_df(nfl_games_with_scored_df, league_id, number_week).style.format(
+                {"away_picks_pct": "{:.0%}", "home_picks_pct": "{:.0%}"}))
+
+    with st.expander("Export picks 💾"):
+        export_scope = st.radio("Picks", list(EXPORT_SCOPE_DICT), horizontal=True)
+        export_format = st.radio("Format", list(EXPORT_MIME_TYPE_DICT), horizontal=True)
+        # Exported once per click, not on every rerun of the page
+        if st.button("Prepare export"):
+            export_user_id = user_id if export_scope == "My picks" else None
+            export_file_name = "{}_{}.{}".format(EXPORT_SCOPE_DICT[export_scope], league_id, export_format)
+            with tempfile.TemporaryDirectory() as export_dir:
+                export_path = Path(export_dir) / export_file_name
+                with st.spinner("Exporting picks..."):
+                    make_pick_history_export_file(export_path, league_id, export_user_id, user_id, export_format)
+                export_bytes = export_path.stat().st_size
+                if export_bytes > MAX_EXPORT_DOWNLOAD_BYTES:
+                    st.warning(EXPORT_TOO_LARGE_MESSAGE.format(export_bytes / 1024 / 1024))
+                else:
+                    st.download_button("Download", data=export_path.read_bytes(), file_name=export_file_name,
+                                       mime=EXPORT_MIME_TYPE_DICT[export_format])
+
 except KeyError:
-    st.warning("You must login before accessing this page. Please authenticate via the login "
+    st.warning("You must login and choose a league before accessing this page. Please authenticate via the login "
                "menu on the Weekly Picks page.")
+except DatabaseUnavailableError:
+    st.error(DATABASE_UNAVAILABLE_MESSAGE)
 